@@ -21,7 +21,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterFile,
                        QgsProcessingParameterFileDestination)
 from qgis import processing
-from pcraster import *
 from osgeo import gdal
 import sys
 import csv
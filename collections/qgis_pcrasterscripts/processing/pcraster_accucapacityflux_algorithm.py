@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterAccucapacityfluxAlgorithm(QgsProcessingAlgorithm):
@@ -156,6 +155,8 @@ class PCRasterAccucapacityfluxAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import accucapacityflux, accucapacitystate, readmap, report, setclone
+
         input_flowdirection = self.parameterAsRasterLayer(parameters, self.INPUT_FLOWDIRECTION, context)
         input_material = self.parameterAsRasterLayer(parameters, self.INPUT_MATERIAL, context)
         input_capacity = self.parameterAsRasterLayer(parameters, self.INPUT_CAPACITY, context)
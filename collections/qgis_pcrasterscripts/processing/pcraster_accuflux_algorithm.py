@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterAccuFluxAlgorithm(QgsProcessingAlgorithm):
@@ -139,6 +138,8 @@ class PCRasterAccuFluxAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import accuflux, readmap, report, setclone
+
         input_ldd = self.parameterAsRasterLayer(parameters, self.INPUT_LDD, context)
         input_material = self.parameterAsRasterLayer(parameters, self.INPUT_MATERIAL, context)
         output_accuflux = self.parameterAsRasterLayer(parameters, self.OUTPUT_ACCUFLUX, context)
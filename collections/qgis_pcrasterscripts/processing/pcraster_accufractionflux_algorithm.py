@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterAccufractionfluxAlgorithm(QgsProcessingAlgorithm):
@@ -156,6 +155,8 @@ class PCRasterAccufractionfluxAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import accufractionflux, accufractionstate, readmap, report, setclone
+
         input_flowdirection = self.parameterAsRasterLayer(parameters, self.INPUT_FLOWDIRECTION, context)
         input_material = self.parameterAsRasterLayer(parameters, self.INPUT_MATERIAL, context)
         input_fraction = self.parameterAsRasterLayer(parameters, self.INPUT_FRACTION, context)
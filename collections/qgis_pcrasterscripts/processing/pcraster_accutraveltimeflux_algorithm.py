@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterAccutraveltimefluxAlgorithm(QgsProcessingAlgorithm):
@@ -156,6 +155,8 @@ class PCRasterAccutraveltimefluxAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import accutraveltimeflux, accutraveltimestate, readmap, report, setclone
+
         input_flowdirection = self.parameterAsRasterLayer(parameters, self.INPUT_FLOWDIRECTION, context)
         input_material = self.parameterAsRasterLayer(parameters, self.INPUT_MATERIAL, context)
         input_velocity = self.parameterAsRasterLayer(parameters, self.INPUT_VELOCITY, context)
@@ -20,7 +20,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterEnum,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterAreaareaAlgorithm(QgsProcessingAlgorithm):
@@ -142,6 +141,8 @@ class PCRasterAreaareaAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import areaarea, readmap, report, setclone, setglobaloption
+
         input_discrete = self.parameterAsRasterLayer(parameters, self.INPUT_DISCRETE, context)
         lengthunits = self.parameterAsEnum(parameters, self.INPUT_UNITS, context)
         if lengthunits == 0:
@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterAreaaverageAlgorithm(QgsProcessingAlgorithm):
@@ -138,6 +137,8 @@ class PCRasterAreaaverageAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import areaaverage, readmap, report, setclone
+
         input_discrete = self.parameterAsRasterLayer(parameters, self.INPUT_DISCRETE, context)
         input_scalar = self.parameterAsRasterLayer(parameters, self.INPUT_SCALAR, context)
         output_areaaverage = self.parameterAsRasterLayer(parameters, self.OUTPUT_AREAAVERAGE, context)
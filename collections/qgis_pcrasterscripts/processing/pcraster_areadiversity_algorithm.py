@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterAreadiversityAlgorithm(QgsProcessingAlgorithm):
@@ -138,6 +137,8 @@ class PCRasterAreadiversityAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import areadiversity, readmap, report, setclone
+
         input_class = self.parameterAsRasterLayer(parameters, self.INPUT_CLASS, context)
         input_discrete = self.parameterAsRasterLayer(parameters, self.INPUT_DISCRETE, context)
         output_areadiversity = self.parameterAsRasterLayer(parameters, self.OUTPUT_AREADIVERSITY, context)
@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterAreamajorityAlgorithm(QgsProcessingAlgorithm):
@@ -138,6 +137,8 @@ class PCRasterAreamajorityAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import areamajority, readmap, report, setclone
+
         input_class = self.parameterAsRasterLayer(parameters, self.INPUT_CLASS, context)
         input_discrete = self.parameterAsRasterLayer(parameters, self.INPUT_DISCRETE, context)
         output_areamajority = self.parameterAsRasterLayer(parameters, self.OUTPUT_AREAMAJORITY, context)
@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterAreamaximumAlgorithm(QgsProcessingAlgorithm):
@@ -138,6 +137,8 @@ class PCRasterAreamaximumAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import areamaximum, readmap, report, setclone
+
         input_class = self.parameterAsRasterLayer(parameters, self.INPUT_CLASS, context)
         input_raster = self.parameterAsRasterLayer(parameters, self.INPUT_RASTER, context)
         output_areamaximum = self.parameterAsRasterLayer(parameters, self.OUTPUT_AREAMAXIMUM, context)
@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterAreanormalAlgorithm(QgsProcessingAlgorithm):
@@ -130,6 +129,8 @@ class PCRasterAreanormalAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import areanormal, readmap, report, setclone
+
         input_discrete = self.parameterAsRasterLayer(parameters, self.INPUT_DISCRETE, context)
 
         output_areanormal = self.parameterAsRasterLayer(parameters, self.OUTPUT_AREANORMAL, context)
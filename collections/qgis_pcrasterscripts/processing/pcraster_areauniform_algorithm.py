@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterAreauniformAlgorithm(QgsProcessingAlgorithm):
@@ -130,6 +129,8 @@ class PCRasterAreauniformAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import areauniform, readmap, report, setclone
+
         input_discrete = self.parameterAsRasterLayer(parameters, self.INPUT_DISCRETE, context)
 
         output_areauniform = self.parameterAsRasterLayer(parameters, self.OUTPUT_AREAUNIFORM, context)
@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterAsinAlgorithm(QgsProcessingAlgorithm):
@@ -130,6 +129,8 @@ class PCRasterAsinAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import asin, readmap, report, setclone
+
         input_raster = self.parameterAsRasterLayer(parameters, self.INPUT_RASTER, context)
 
         output_raster = self.parameterAsRasterLayer(parameters, self.OUTPUT_RASTER, context)
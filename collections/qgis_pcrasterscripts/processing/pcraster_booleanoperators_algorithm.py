@@ -20,7 +20,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterEnum,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterBooleanOperatorsAlgorithm(QgsProcessingAlgorithm):
@@ -152,6 +151,8 @@ class PCRasterBooleanOperatorsAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import pcrand, pcrnot, pcror, pcrxor, readmap, report, setclone
+
         input_boolean1 = self.parameterAsRasterLayer(parameters, self.INPUT_BOOLEAN1, context)
         input_boolean2 = self.parameterAsRasterLayer(parameters, self.INPUT_BOOLEAN2, context)
         booleanoperator = self.parameterAsEnum(parameters, self.INPUT_OPERATOR, context)
@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterCatchmenttotalAlgorithm(QgsProcessingAlgorithm):
@@ -138,6 +137,8 @@ class PCRasterCatchmenttotalAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import catchmenttotal, readmap, report, setclone
+
         input_ldd = self.parameterAsRasterLayer(parameters, self.INPUT_LDD, context)
         input_material = self.parameterAsRasterLayer(parameters, self.INPUT_MATERIAL, context)
         output_accuflux = self.parameterAsRasterLayer(parameters, self.OUTPUT_ACCUFLUX, context)
@@ -20,7 +20,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterEnum,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRastercellareaAlgorithm(QgsProcessingAlgorithm):
@@ -151,6 +150,8 @@ class PCRastercellareaAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import cellarea, report, setclone, setglobaloption
+
         input_raster = self.parameterAsRasterLayer(parameters, self.INPUT_RASTER, context)
         lengthunits = self.parameterAsEnum(parameters, self.INPUT_UNITS, context)
         if lengthunits == 0:
@@ -20,7 +20,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterEnum,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterClumpAlgorithm(QgsProcessingAlgorithm):
@@ -142,6 +141,8 @@ class PCRasterClumpAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import clump, readmap, report, setclone, setglobaloption
+
         input_raster = self.parameterAsRasterLayer(parameters, self.INPUT_RASTER, context)
         direction_options = self.parameterAsEnum(parameters, self.INPUT_DIRECTIONS, context)
         if direction_options == 0:
@@ -20,7 +20,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterEnum,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterComparisonOperatorsAlgorithm(QgsProcessingAlgorithm):
@@ -152,6 +151,8 @@ class PCRasterComparisonOperatorsAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import readmap, report, setclone
+
         input1 = self.parameterAsRasterLayer(parameters, self.INPUT1, context)
         input2 = self.parameterAsRasterLayer(parameters, self.INPUT2, context)
         comparisonoperator = self.parameterAsEnum(parameters, self.INPUT_OPERATOR, context)
@@ -21,7 +21,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterNumber,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterConvertdatatypeAlgorithm(QgsProcessingAlgorithm):
@@ -137,6 +136,8 @@ class PCRasterConvertdatatypeAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import boolean, directional, ldd, nominal, ordinal, readmap, report, scalar
+
         input_raster = self.parameterAsRasterLayer(parameters, self.INPUT_RASTER, context)
         InputRaster = readmap(input_raster.dataProvider().dataSourceUri())
         output_raster = self.parameterAsRasterLayer(parameters, self.OUTPUT_RASTER, context)
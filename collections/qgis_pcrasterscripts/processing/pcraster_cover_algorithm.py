@@ -20,7 +20,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterMultipleLayers,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterCoverAlgorithm(QgsProcessingAlgorithm):
@@ -142,6 +141,8 @@ class PCRasterCoverAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import cover, readmap, report, setclone
+
         input_raster = self.parameterAsRasterLayer(parameters, self.INPUT_RASTER, context)
         input_cover = []
         for l in self.parameterAsLayerList(parameters, self.INPUT_COVER, context):
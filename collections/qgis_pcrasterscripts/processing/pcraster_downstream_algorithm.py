@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterDownstreamAlgorithm(QgsProcessingAlgorithm):
@@ -139,6 +138,8 @@ class PCRasterDownstreamAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import downstream, readmap, report, setclone
+
         input_ldd = self.parameterAsRasterLayer(parameters, self.INPUT_LDD, context)
         input_raster = self.parameterAsRasterLayer(parameters, self.INPUT_RASTER, context)
         output_downstream = self.parameterAsRasterLayer(parameters, self.OUTPUT_DOWNSTREAM, context)
@@ -20,7 +20,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterEnum,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterDownstreamdistAlgorithm(QgsProcessingAlgorithm):
@@ -142,6 +141,8 @@ class PCRasterDownstreamdistAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import downstreamdist, readmap, report, setclone, setglobaloption
+
         input_ldd = self.parameterAsRasterLayer(parameters, self.INPUT_LDD, context)
         lengthunits = self.parameterAsEnum(parameters, self.INPUT_UNITS, context)
         if lengthunits == 0:
@@ -20,7 +20,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterLayer,
                        QgsProcessingParameterNumber)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterExtentofviewAlgorithm(QgsProcessingAlgorithm):
@@ -140,6 +139,8 @@ class PCRasterExtentofviewAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import extentofview, readmap, report, setclone
+
         input_discrete = self.parameterAsRasterLayer(parameters, self.INPUT_CLASSES, context)
         input_directions = self.parameterAsDouble(parameters, self.INPUT_DIRECTIONS, context)
         output_raster = self.parameterAsRasterLayer(parameters, self.OUTPUT_RASTER, context)
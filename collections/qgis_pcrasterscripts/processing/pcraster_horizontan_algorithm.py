@@ -20,7 +20,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterLayer,
                        QgsProcessingParameterNumber)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterHorizontanAlgorithm(QgsProcessingAlgorithm):
@@ -140,6 +139,8 @@ class PCRasterHorizontanAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import horizontan, readmap, report, setclone
+
         input_dem = self.parameterAsRasterLayer(parameters, self.INPUT_DEM, context)
         input_angle = self.parameterAsDouble(parameters, self.INPUT_ANGLE, context)
         output_raster = self.parameterAsRasterLayer(parameters, self.OUTPUT_RASTER, context)
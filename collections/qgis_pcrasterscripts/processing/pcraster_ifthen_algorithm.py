@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterIfThenAlgorithm(QgsProcessingAlgorithm):
@@ -139,6 +138,8 @@ class PCRasterIfThenAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import ifthen, readmap, report, setclone
+
         input_condition = self.parameterAsRasterLayer(parameters, self.INPUT_CONDITION, context)
         input_true = self.parameterAsRasterLayer(parameters, self.INPUT_TRUE, context)
         setclone(input_condition.dataProvider().dataSourceUri())
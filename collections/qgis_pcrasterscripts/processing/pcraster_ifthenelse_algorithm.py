@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterIfThenElseAlgorithm(QgsProcessingAlgorithm):
@@ -147,6 +146,8 @@ class PCRasterIfThenElseAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import ifthenelse, readmap, report, setclone
+
         input_condition = self.parameterAsRasterLayer(parameters, self.INPUT_CONDITION, context)
         input_true = self.parameterAsRasterLayer(parameters, self.INPUT_TRUE, context)
         input_false = self.parameterAsRasterLayer(parameters, self.INPUT_FALSE, context)
@@ -21,7 +21,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterEnum,
                        QgsProcessingParameterNumber)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterInversedistanceAlgorithm(QgsProcessingAlgorithm):
@@ -184,6 +183,8 @@ class PCRasterInversedistanceAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import inversedistance, readmap, report, setclone, setglobaloption
+
         input_mask = self.parameterAsRasterLayer(parameters, self.INPUT_MASK, context)
         input_points = self.parameterAsRasterLayer(parameters, self.INPUT_POINTS, context)
         input_idp = self.parameterAsDouble(parameters, self.INPUT_IDP, context)
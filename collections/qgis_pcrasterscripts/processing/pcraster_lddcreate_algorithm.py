@@ -21,7 +21,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterEnum,
                        QgsProcessingParameterNumber)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterLDDCreateAlgorithm(QgsProcessingAlgorithm):
@@ -197,6 +196,8 @@ class PCRasterLDDCreateAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import lddcreate, readmap, report, setclone, setglobaloption
+
         input_dem = self.parameterAsRasterLayer(parameters, self.INPUT_DEM, context)
         edgesetting = self.parameterAsEnum(parameters, self.INPUT_EDGE, context)
         if edgesetting == 0:
@@ -21,7 +21,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterEnum,
                        QgsProcessingParameterNumber)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterLDDCreateDEMAlgorithm(QgsProcessingAlgorithm):
@@ -210,6 +209,8 @@ class PCRasterLDDCreateDEMAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import lddcreatedem, readmap, report, setclone, setglobaloption
+
         input_dem = self.parameterAsRasterLayer(parameters, self.INPUT_DEM, context)
         elevationsetting = self.parameterAsEnum(parameters, self.INPUT_ELEVATION, context)
         if elevationsetting == 0:
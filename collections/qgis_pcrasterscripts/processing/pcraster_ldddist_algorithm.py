@@ -20,7 +20,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterEnum,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterLDDDistAlgorithm(QgsProcessingAlgorithm):
@@ -160,6 +159,8 @@ class PCRasterLDDDistAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import ldddist, readmap, report, setclone, setglobaloption
+
         input_ldd = self.parameterAsRasterLayer(parameters, self.INPUT_LDD, context)
         lengthunits = self.parameterAsEnum(parameters, self.INPUT_UNITS, context)
         if lengthunits == 0:
@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterLddMaskAlgorithm(QgsProcessingAlgorithm):
@@ -139,6 +138,8 @@ class PCRasterLddMaskAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import lddmask, readmap, report, setclone
+
         input_ldd = self.parameterAsRasterLayer(parameters, self.INPUT_LDD, context)
         input_mask = self.parameterAsRasterLayer(parameters, self.INPUT_MASK, context)
         output_raster = self.parameterAsRasterLayer(parameters, self.OUTPUT_RASTER, context)
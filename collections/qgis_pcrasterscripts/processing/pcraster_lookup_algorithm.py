@@ -23,7 +23,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterNumber,
                        QgsProcessingParameterMultipleLayers)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterLookupAlgorithm(QgsProcessingAlgorithm):
@@ -158,6 +157,9 @@ class PCRasterLookupAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import (lookupboolean, lookupdirectional, lookupldd, lookupnominal, lookupordinal,
+                              lookupscalar, report, setclone)
+
         input_rasters = []
         for l in self.parameterAsLayerList(parameters, self.INPUT_RASTERS, context):
             input_rasters.append(l.source())
@@ -23,7 +23,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterNumber,
                        QgsProcessingParameterMultipleLayers)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterLookuplinearAlgorithm(QgsProcessingAlgorithm):
@@ -144,6 +143,8 @@ class PCRasterLookuplinearAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import lookuplinear, readmap, report, setclone
+
         input_raster = self.parameterAsRasterLayer(parameters, self.INPUT_RASTER, context)
         input_lookuptable = self.parameterAsFile(parameters, self.INPUT_TABLE, context)
         output_raster = self.parameterAsRasterLayer(parameters, self.OUTPUT_RASTER, context)
@@ -20,7 +20,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterEnum,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterMapareaAlgorithm(QgsProcessingAlgorithm):
@@ -142,6 +141,8 @@ class PCRasterMapareaAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import maparea, readmap, report, setclone, setglobaloption
+
         input_raster = self.parameterAsRasterLayer(parameters, self.INPUT_RASTER, context)
         lengthunits = self.parameterAsEnum(parameters, self.INPUT_UNITS, context)
         if lengthunits == 0:
@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterMapmaximumAlgorithm(QgsProcessingAlgorithm):
@@ -130,6 +129,8 @@ class PCRasterMapmaximumAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import cellvalue, mapmaximum, readmap, report, setclone
+
         input_raster = self.parameterAsRasterLayer(parameters, self.INPUT_RASTER, context)
 
         output_max = self.parameterAsRasterLayer(parameters, self.OUTPUT_MAX, context)
@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterMapminimumAlgorithm(QgsProcessingAlgorithm):
@@ -130,6 +129,8 @@ class PCRasterMapminimumAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import cellvalue, mapminimum, readmap, report, setclone
+
         input_raster = self.parameterAsRasterLayer(parameters, self.INPUT_RASTER, context)
 
         output_min = self.parameterAsRasterLayer(parameters, self.OUTPUT_MIN, context)
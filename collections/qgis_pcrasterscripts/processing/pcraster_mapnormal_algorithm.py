@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterMapnormalAlgorithm(QgsProcessingAlgorithm):
@@ -130,6 +129,8 @@ class PCRasterMapnormalAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import mapnormal, report, setclone
+
         input_clone = self.parameterAsRasterLayer(parameters, self.INPUT_CLONE, context)
 
         output_mapnormal = self.parameterAsRasterLayer(parameters, self.OUTPUT_MAPNORMAL, context)
@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterMaptotalAlgorithm(QgsProcessingAlgorithm):
@@ -129,6 +128,8 @@ class PCRasterMaptotalAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import maptotal, readmap, report, setclone
+
         input_raster = self.parameterAsRasterLayer(parameters, self.INPUT_RASTER, context)
         output_maptotal = self.parameterAsRasterLayer(parameters, self.OUTPUT_MAPTOTAL, context)
         setclone(input_raster.dataProvider().dataSourceUri())
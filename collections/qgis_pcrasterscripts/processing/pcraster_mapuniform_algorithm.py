@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterMapuniformAlgorithm(QgsProcessingAlgorithm):
@@ -130,6 +129,8 @@ class PCRasterMapuniformAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import mapnormal, report, setclone
+
         input_clone = self.parameterAsRasterLayer(parameters, self.INPUT_CLONE, context)
 
         output_mapuniform = self.parameterAsRasterLayer(parameters, self.OUTPUT_MAPUNIFORM, context)
@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterNormalAlgorithm(QgsProcessingAlgorithm):
@@ -131,6 +130,8 @@ class PCRasterNormalAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import normal, readmap, report, setclone
+
         input_boolean = self.parameterAsRasterLayer(parameters, self.INPUT_BOOLEAN, context)
 
         output_normal = self.parameterAsRasterLayer(parameters, self.OUTPUT, context)
@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterPathAlgorithm(QgsProcessingAlgorithm):
@@ -139,6 +138,8 @@ class PCRasterPathAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import path, readmap, report, setclone
+
         input_ldd = self.parameterAsRasterLayer(parameters, self.INPUT_LDD, context)
         input_points = self.parameterAsRasterLayer(parameters, self.INPUT_POINTS, context)
         output_path = self.parameterAsRasterLayer(parameters, self.OUTPUT_PATH, context)
@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterPitAlgorithm(QgsProcessingAlgorithm):
@@ -131,6 +130,8 @@ class PCRasterPitAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import pit, readmap, report, setclone
+
         input_ldd = self.parameterAsRasterLayer(parameters, self.INPUT_LDD, context)
 
         output_pit = self.parameterAsRasterLayer(parameters, self.OUTPUT_PIT, context)
@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterPlancurvAlgorithm(QgsProcessingAlgorithm):
@@ -131,6 +130,8 @@ class PCRasterPlancurvAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import plancurv, readmap, report, setclone
+
         input_dem = self.parameterAsRasterLayer(parameters, self.INPUT_DEM, context)
 
         output_plancurv = self.parameterAsRasterLayer(parameters, self.OUTPUT_PLANCURV, context)
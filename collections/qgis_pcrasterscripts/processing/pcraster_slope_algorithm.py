@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterSlopeAlgorithm(QgsProcessingAlgorithm):
@@ -131,6 +130,8 @@ class PCRasterSlopeAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import readmap, report, setclone, slope
+
         input_dem = self.parameterAsRasterLayer(parameters, self.INPUT_DEM, context)
 
         output_slope = self.parameterAsRasterLayer(parameters, self.OUTPUT_SLOPE, context)
@@ -21,7 +21,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterNumber,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterSpatialAlgorithm(QgsProcessingAlgorithm):
@@ -155,6 +154,8 @@ class PCRasterSpatialAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import boolean, directional, ldd, nominal, ordinal, report, scalar, setclone, spatial
+
         input_nonspatial = self.parameterAsDouble(parameters, self.INPUT_NONSPATIAL, context)
         input_clone = self.parameterAsRasterLayer(parameters, self.INPUT_CLONE, context)
         output_raster = self.parameterAsRasterLayer(parameters, self.OUTPUT_RASTER, context)
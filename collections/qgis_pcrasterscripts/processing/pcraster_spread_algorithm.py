@@ -21,7 +21,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterEnum,
                        QgsProcessingParameterNumber)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterSpreadAlgorithm(QgsProcessingAlgorithm):
@@ -162,6 +161,8 @@ class PCRasterSpreadAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import readmap, report, setclone, setglobaloption, spread
+
         input_points = self.parameterAsRasterLayer(parameters, self.INPUT_POINTS, context)
         lengthunits = self.parameterAsEnum(parameters, self.INPUT_UNITS, context)
         if lengthunits == 0:
@@ -21,7 +21,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterEnum,
                        QgsProcessingParameterNumber)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterSpreadlddAlgorithm(QgsProcessingAlgorithm):
@@ -171,6 +170,8 @@ class PCRasterSpreadlddAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import readmap, report, setclone, setglobaloption, spreadldd
+
         input_ldd = self.parameterAsRasterLayer(parameters, self.INPUT_LDD, context)
         input_points = self.parameterAsRasterLayer(parameters, self.INPUT_POINTS, context)
         lengthunits = self.parameterAsEnum(parameters, self.INPUT_UNITS, context)
@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterStreamOrderAlgorithm(QgsProcessingAlgorithm):
@@ -131,6 +130,8 @@ class PCRasterStreamOrderAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import readmap, report, setclone, streamorder
+
         input_ldd = self.parameterAsRasterLayer(parameters, self.INPUT_LDD, context)
 
         output_streamorder = self.parameterAsRasterLayer(parameters, self.OUTPUT_STREAMORDER, context)
@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterSubcatchmentAlgorithm(QgsProcessingAlgorithm):
@@ -139,6 +138,8 @@ class PCRasterSubcatchmentAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import readmap, report, setclone, subcatchment
+
         input_ldd = self.parameterAsRasterLayer(parameters, self.INPUT_LDD, context)
         input_outlet = self.parameterAsRasterLayer(parameters, self.INPUT_OUTLET, context)
         output_catchment = self.parameterAsRasterLayer(parameters, self.OUTPUT_CATCHMENT, context)
@@ -20,7 +20,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterNumber,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterTransientAlgorithm(QgsProcessingAlgorithm):
@@ -187,6 +186,8 @@ class PCRasterTransientAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import readmap, report, setclone, transient
+
         input_elevation = self.parameterAsRasterLayer(parameters, self.INPUT_ELEVATION, context)
         input_recharge = self.parameterAsRasterLayer(parameters, self.INPUT_RECHARGE, context)
         input_transmissivity = self.parameterAsRasterLayer(parameters, self.INPUT_TRANSMISSIVITY, context)
@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterUniformAlgorithm(QgsProcessingAlgorithm):
@@ -131,6 +130,8 @@ class PCRasterUniformAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import readmap, report, setclone, uniform
+
         input_boolean = self.parameterAsRasterLayer(parameters, self.INPUT_BOOLEAN, context)
 
         output_uniform = self.parameterAsRasterLayer(parameters, self.OUTPUT_UNIFORM, context)
@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterUniqueidAlgorithm(QgsProcessingAlgorithm):
@@ -130,6 +129,8 @@ class PCRasterUniqueidAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import readmap, report, setclone, uniqueid
+
         input_boolean = self.parameterAsRasterLayer(parameters, self.INPUT_BOOLEAN, context)
 
         output_scalar = self.parameterAsRasterLayer(parameters, self.OUTPUT_SCALAR, context)
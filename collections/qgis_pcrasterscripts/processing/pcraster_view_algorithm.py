@@ -19,7 +19,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterRasterDestination,
                        QgsProcessingParameterRasterLayer)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterViewAlgorithm(QgsProcessingAlgorithm):
@@ -139,6 +138,8 @@ class PCRasterViewAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import readmap, report, setclone, view
+
         input_dem = self.parameterAsRasterLayer(parameters, self.INPUT_DEM, context)
         input_points = self.parameterAsRasterLayer(parameters, self.INPUT_POINTS, context)
         output_view = self.parameterAsRasterLayer(parameters, self.OUTPUT_VIEW, context)
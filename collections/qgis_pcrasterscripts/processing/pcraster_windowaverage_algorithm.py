@@ -21,7 +21,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterEnum,
                        QgsProcessingParameterNumber)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterWindowAverageAlgorithm(QgsProcessingAlgorithm):
@@ -154,6 +153,8 @@ class PCRasterWindowAverageAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import readmap, report, setclone, setglobaloption, windowaverage
+
         input_raster = self.parameterAsRasterLayer(parameters, self.INPUT_RASTER, context)
         lengthunits = self.parameterAsEnum(parameters, self.INPUT_UNITS, context)
         if lengthunits == 0:
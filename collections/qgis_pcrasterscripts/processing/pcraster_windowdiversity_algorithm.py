@@ -21,7 +21,6 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterEnum,
                        QgsProcessingParameterNumber)
 from qgis import processing
-from pcraster import *
 
 
 class PCRasterWindowDiversityAlgorithm(QgsProcessingAlgorithm):
@@ -155,6 +154,8 @@ class PCRasterWindowDiversityAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import readmap, report, setclone, setglobaloption, windowdiversity
+
         input_raster = self.parameterAsRasterLayer(parameters, self.INPUT_RASTER, context)
         lengthunits = self.parameterAsEnum(parameters, self.INPUT_UNITS, context)
         if lengthunits == 0:
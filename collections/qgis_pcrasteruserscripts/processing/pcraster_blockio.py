@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+# Block-wise raster reading and writing shared by the user scripts that work
+# on NumPy arrays instead of full PCRaster fields. This module contains no
+# algorithm, so the Processing script provider skips it.
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from osgeo import gdal
+
+from qgis.core import (
+    QgsProcessingException,
+    QgsProcessingUtils,
+    QgsRasterFileWriter)
+
+# GDAL data type and missing value used by the PCRaster driver for each
+# value scale.
+VALUESCALES = {
+    'VS_BOOLEAN': (gdal.GDT_Byte, 255),
+    'VS_NOMINAL': (gdal.GDT_Int32, -2147483648),
+    'VS_ORDINAL': (gdal.GDT_Int32, -2147483648),
+    'VS_SCALAR': (gdal.GDT_Float32, -3.4028234663852886e+38),
+    'VS_DIRECTION': (gdal.GDT_Float32, -3.4028234663852886e+38),
+    'VS_LDD': (gdal.GDT_Byte, 255),
+}
+
+# Value scales that PCRaster cannot tell from the data type of a GeoTIFF,
+# which it reads as nominal or scalar. Outputs with these value scales are
+# written in the PCRaster format whatever their extension, as report()
+# does, so readmap still sees an LDD, boolean, ordinal or directional map.
+CSF_VALUESCALES = ('VS_BOOLEAN', 'VS_ORDINAL', 'VS_DIRECTION', 'VS_LDD')
+
+# Number of cells read or written per block.
+BLOCK_CELLS = 1 << 22
+
+
+def open_raster(path):
+    """
+    Opens a raster read-only and raises a processing exception when GDAL
+    cannot read it.
+    """
+    ds = gdal.Open(path, gdal.GA_ReadOnly)
+    if ds is None:
+        raise QgsProcessingException('Could not open raster {}'.format(path))
+    return ds
+
+
+def valuescale(ds):
+    """
+    Returns the PCRaster value scale of a dataset, or VS_SCALAR when the
+    dataset does not carry one.
+    """
+    return ds.GetMetadataItem('PCRASTER_VALUESCALE') or 'VS_SCALAR'
+
+
+def cell_area(ds):
+    """
+    Returns the area of a single cell in map units.
+    """
+    geotransform = ds.GetGeoTransform()
+    return abs(geotransform[1] * geotransform[5])
+
+
+def check_same_grid(ds, other):
+    """
+    Raises a processing exception when two datasets are not on the same grid.
+    """
+    if (ds.RasterXSize, ds.RasterYSize) != (other.RasterXSize, other.RasterYSize):
+        raise QgsProcessingException('Input rasters must have the same number of rows and columns')
+    if not np.allclose(ds.GetGeoTransform(), other.GetGeoTransform()):
+        raise QgsProcessingException('Input rasters must have the same extent and cell size')
+
+
+def row_windows(ds, rows=None):
+    """
+    Returns (yoff, ysize) row bands covering the dataset. Bands are a whole
+    number of GDAL blocks high and hold about BLOCK_CELLS cells.
+    """
+    block_rows = max(ds.GetRasterBand(1).GetBlockSize()[1], 1)
+    if rows is None:
+        rows = max(BLOCK_CELLS // max(ds.RasterXSize, 1), 1)
+        rows = max(rows // block_rows, 1) * block_rows
+    return [(yoff, min(rows, ds.RasterYSize - yoff)) for yoff in range(0, ds.RasterYSize, rows)]
+
+
+def read_rows(ds, yoff, ysize, halo=0):
+    """
+    Reads a row band of the first band and returns the values together with
+    a boolean array that is True where the cells are not missing. With a
+    halo, the band is extended by that many cells on every side; cells
+    outside the raster are returned as missing.
+    """
+    band = ds.GetRasterBand(1)
+    top = max(yoff - halo, 0)
+    bottom = min(yoff + ysize + halo, ds.RasterYSize)
+    values = band.ReadAsArray(0, top, ds.RasterXSize, bottom - top)
+    valid = valid_mask(values, band.GetNoDataValue())
+    if halo == 0:
+        return values, valid
+    padding = ((top - (yoff - halo), (yoff + ysize + halo) - bottom), (halo, halo))
+    return np.pad(values, padding), np.pad(valid, padding)
+
+
+def worker_count():
+    """
+    Returns the number of worker threads used for block processing.
+    """
+    return os.cpu_count() or 1
+
+
+def map_ordered(function, items, max_workers=None):
+    """
+    Calls function(item) for the items in a thread pool and yields the
+    results in item order. Only a few items per worker are processed ahead
+    of the consumer, so memory stays bounded when the consumer is slower.
+    """
+    max_workers = max_workers or worker_count()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= 2 * max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def map_blocks(path, windows, function, max_workers=None, halo=0):
+    """
+    Calls function(values, valid) for the row bands of a raster in a thread
+    pool and yields the results in window order. Every worker thread opens
+    its own dataset, as GDAL datasets must not be shared between threads,
+    and only a few bands per worker are read ahead of the consumer.
+    """
+    local = threading.local()
+
+    def work(window):
+        ds = getattr(local, 'ds', None)
+        if ds is None:
+            ds = local.ds = open_raster(path)
+        return function(*read_rows(ds, window[0], window[1], halo))
+
+    yield from map_ordered(work, windows, max_workers)
+
+
+def block_statistics(values, valid):
+    """
+    Returns (count, total, minimum, maximum) of the defined cells of a block.
+    """
+    values = values[valid].astype(np.float64)
+    if len(values) == 0:
+        return 0, 0.0, np.inf, -np.inf
+    return len(values), values.sum(), values.min(), values.max()
+
+
+def map_statistics(path, feedback=None, max_workers=None):
+    """
+    Reduces a raster to the count, total, minimum and maximum of its defined
+    cells. Partial results of the row bands are combined as they arrive from
+    the thread pool. Returns None when the feedback is canceled.
+    """
+    ds = open_raster(path)
+    windows = row_windows(ds)
+    count, total, minimum, maximum = 0, 0.0, np.inf, -np.inf
+    for i, partial in enumerate(map_blocks(path, windows, block_statistics, max_workers)):
+        if feedback is not None:
+            if feedback.isCanceled():
+                return None
+            feedback.setProgress(100 * (i + 1) / len(windows))
+        count += partial[0]
+        total += partial[1]
+        minimum = min(minimum, partial[2])
+        maximum = max(maximum, partial[3])
+    return {
+        'count': count,
+        'total': total,
+        'minimum': minimum if count else None,
+        'maximum': maximum if count else None,
+        'area': count * cell_area(ds),
+        'average': total / count if count else None,
+    }
+
+
+def valid_mask(values, nodata):
+    """
+    Returns a boolean array that is True where values are not missing.
+    """
+    if np.issubdtype(values.dtype, np.floating):
+        valid = ~np.isnan(values)
+        if nodata is not None and not np.isnan(nodata):
+            valid &= values != nodata
+        return valid
+    if nodata is None:
+        return np.ones(values.shape, dtype=bool)
+    return values != nodata
+
+
+class RasterWriter:
+    """
+    Writes row bands to a raster on the grid of a template dataset and
+    stores the PCRaster value scale in its metadata. GeoTIFF outputs become
+    tiled, compressed Cloud Optimized GeoTIFFs with overviews; outputs with
+    a value scale in CSF_VALUESCALES are PCRaster maps. Rows are first
+    written to an uncompressed temporary GeoTIFF, which is copied to the
+    requested format when the writer is closed. A scratch writer keeps that
+    uncompressed GeoTIFF at path instead, for intermediate rasters that are
+    only read back by the script itself.
+    """
+
+    def __init__(self, path, template, valuescale='VS_SCALAR', scratch=False):
+        self.path = path
+        self.valuescale = valuescale
+        self.scratch = scratch
+        self.datatype, self.nodata = VALUESCALES[valuescale]
+        if scratch:
+            self.driver_name = 'GTiff'
+        elif valuescale in CSF_VALUESCALES:
+            self.driver_name = 'PCRaster'
+        else:
+            self.driver_name = driver_for_path(path)
+        temp_path = path if scratch else QgsProcessingUtils.generateTempFilename('{}.tif'.format(os.path.basename(path)))
+        self.ds = gdal.GetDriverByName('GTiff').Create(
+            temp_path, template.RasterXSize, template.RasterYSize, 1, self.datatype,
+            ['TILED=YES', 'BIGTIFF=IF_SAFER', 'SPARSE_OK=TRUE'])
+        self.ds.SetGeoTransform(template.GetGeoTransform())
+        self.ds.SetProjection(template.GetProjection())
+        self.ds.SetMetadataItem('PCRASTER_VALUESCALE', valuescale)
+        self.band = self.ds.GetRasterBand(1)
+        self.band.SetNoDataValue(self.nodata)
+
+    def write(self, values, valid, yoff):
+        """
+        Writes a row band, setting cells where valid is False to the missing
+        value.
+        """
+        values = np.where(valid, values, self.nodata).astype(gdal_array_type(self.datatype))
+        self.band.WriteArray(values, 0, yoff)
+
+    def close(self):
+        """
+        Flushes the raster and copies it to the requested format.
+        """
+        self.band = None
+        if self.scratch:
+            self.ds = None
+            return self.path
+        driver_name, options = self.driver_name, []
+        if driver_name == 'PCRaster':
+            options = ['PCRASTER_VALUESCALE={}'.format(self.valuescale)]
+        elif driver_name == 'GTiff':
+            driver_name, options = self._geotiff_options()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        copy = gdal.GetDriverByName(driver_name).CreateCopy(self.path, self.ds, 0, options)
+        if copy is None:
+            raise QgsProcessingException('Could not write raster {}'.format(self.path))
+        if driver_name == 'GTiff':
+            copy.BuildOverviews(self._resampling(), overview_levels(copy.RasterXSize, copy.RasterYSize))
+        copy = None
+        temp_path = self.ds.GetDescription()
+        self.ds = None
+        gdal.GetDriverByName('GTiff').Delete(temp_path)
+        return self.path
+
+    def _resampling(self):
+        return 'AVERAGE' if self.valuescale == 'VS_SCALAR' else 'NEAREST'
+
+    def _geotiff_options(self):
+        # The COG driver builds the overviews itself and picks the predictor
+        # from the data type; older GDAL versions get a tiled GeoTIFF with
+        # overviews added after the copy
+        if gdal.GetDriverByName('COG') is not None:
+            return 'COG', ['COMPRESS=DEFLATE', 'PREDICTOR=YES', 'NUM_THREADS=ALL_CPUS',
+                           'BIGTIFF=IF_SAFER', 'OVERVIEWS=AUTO', 'RESAMPLING={}'.format(self._resampling())]
+        predictor = '3' if self.datatype == gdal.GDT_Float32 else '2'
+        return 'GTiff', ['TILED=YES', 'COMPRESS=DEFLATE', 'PREDICTOR={}'.format(predictor),
+                         'NUM_THREADS=ALL_CPUS', 'BIGTIFF=IF_SAFER']
+
+
+def overview_levels(xsize, ysize, minimum_size=256):
+    """
+    Returns the overview decimation factors down to about minimum_size cells.
+    """
+    levels = []
+    level = 2
+    while max(xsize, ysize) / level >= minimum_size:
+        levels.append(level)
+        level *= 2
+    return levels
+
+
+def write_field(field, path, clone):
+    """
+    Writes a PCRaster field on the grid of the clone raster. Paths ending in
+    .map and fields with a value scale in CSF_VALUESCALES are written by
+    PCRaster itself; other formats, such as GeoTIFF, go through RasterWriter
+    so they keep the value scale in their metadata.
+    """
+    import pcraster
+    scales = {
+        pcraster.Boolean: 'VS_BOOLEAN',
+        pcraster.Nominal: 'VS_NOMINAL',
+        pcraster.Ordinal: 'VS_ORDINAL',
+        pcraster.Scalar: 'VS_SCALAR',
+        pcraster.Directional: 'VS_DIRECTION',
+        pcraster.Ldd: 'VS_LDD',
+    }
+    scale = scales[field.dataType()]
+    if driver_for_path(path) == 'PCRaster' or scale in CSF_VALUESCALES:
+        pcraster.report(field, path)
+        return path
+    if not field.isSpatial():
+        field = pcraster.spatial(field)
+    writer = RasterWriter(path, open_raster(clone), scale)
+    values = pcraster.pcr2numpy(field, writer.nodata)
+    writer.write(values, values != writer.nodata, 0)
+    return writer.close()
+
+
+def broadcast(path, template, value, valuescale='VS_SCALAR'):
+    """
+    Writes a raster on the grid of the template with every cell set to value,
+    as PCRaster does when reporting a non-spatial result.
+    """
+    writer = RasterWriter(path, template, valuescale)
+    for yoff, ysize in row_windows(template):
+        values = np.full((ysize, template.RasterXSize), np.nan if value is None else value)
+        writer.write(values, ~np.isnan(values), yoff)
+    return writer.close()
+
+
+def grid_template(extent, cell_size, wkt):
+    """
+    Returns an empty dataset with square cells of cell_size that covers an
+    (xmin, ymin, xmax, ymax) extent, to be used as template grid. The grid
+    starts at the top left corner of the extent.
+    """
+    cols = max(int(np.ceil((extent[2] - extent[0]) / cell_size)), 1)
+    rows = max(int(np.ceil((extent[3] - extent[1]) / cell_size)), 1)
+    ds = gdal.GetDriverByName('VRT').Create('', cols, rows, 1, gdal.GDT_Byte)
+    ds.SetGeoTransform((extent[0], cell_size, 0.0, extent[3], 0.0, -cell_size))
+    ds.SetProjection(wkt)
+    return ds
+
+
+def driver_for_path(path):
+    """
+    Returns the GDAL driver name for an output path based on its extension.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.map':
+        return 'PCRaster'
+    if extension in ('.tif', '.tiff', ''):
+        return 'GTiff'
+    driver_name = QgsRasterFileWriter.driverForExtension(extension)
+    if not driver_name:
+        raise QgsProcessingException('No raster driver found for {}'.format(path))
+    return driver_name
+
+
+def gdal_array_type(datatype):
+    """
+    Returns the NumPy dtype for a GDAL data type.
+    """
+    return {
+        gdal.GDT_Byte: np.uint8,
+        gdal.GDT_Int32: np.int32,
+        gdal.GDT_Float32: np.float32,
+    }[datatype]
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+# Burning drainage into a DEM, shared by the burndem script and the burn
+# drainage model. PCRaster is only imported by the functions that run its
+# operators. This module contains no algorithm, so the Processing script
+# provider skips it.
+
+import hashlib
+import json
+import math
+import os
+
+import numpy as np
+from osgeo import gdal, ogr, osr
+
+from qgis.core import (
+    QgsFeatureRequest,
+    QgsRectangle)
+
+import pcraster_lazy as lazy
+from pcraster_blockio import (
+    RasterWriter,
+    open_raster,
+    read_rows,
+    row_windows,
+    valid_mask)
+
+
+def rasterize_layers(layers, template, burn=1, window=None):
+    """
+    Rasterizes the features of QGIS vector layers in memory on the grid of a
+    template dataset, or on the (xoff, yoff, xsize, ysize) window of it.
+    Returns a uint8 array with burn on the cells touched by a feature and 0
+    elsewhere. The layers must use the CRS of the template.
+    """
+    xoff, yoff, xsize, ysize = window or (0, 0, template.RasterXSize, template.RasterYSize)
+    geotransform = list(template.GetGeoTransform())
+    geotransform[0] += xoff * geotransform[1]
+    geotransform[3] += yoff * geotransform[5]
+    target = gdal.GetDriverByName('MEM').Create('', xsize, ysize, 1, gdal.GDT_Byte)
+    target.SetGeoTransform(geotransform)
+    target.SetProjection(template.GetProjection())
+
+    extent = QgsRectangle(geotransform[0], geotransform[3] + ysize * geotransform[5],
+                          geotransform[0] + xsize * geotransform[1], geotransform[3])
+    spatial_reference = osr.SpatialReference()
+    spatial_reference.ImportFromWkt(template.GetProjection())
+    source = ogr.GetDriverByName('Memory').CreateDataSource('drainage')
+    for layer in layers:
+        memory_layer = source.CreateLayer(layer.id(), spatial_reference)
+        request = QgsFeatureRequest().setFilterRect(extent).setNoAttributes()
+        for feature in layer.getFeatures(request):
+            if not feature.hasGeometry():
+                continue
+            ogr_feature = ogr.Feature(memory_layer.GetLayerDefn())
+            ogr_feature.SetGeometry(ogr.CreateGeometryFromWkb(bytes(feature.geometry().asWkb())))
+            memory_layer.CreateFeature(ogr_feature)
+        gdal.RasterizeLayer(target, [1], memory_layer, burn_values=[burn])
+    return target.GetRasterBand(1).ReadAsArray()
+
+
+def drainage_expression(drainage, dem):
+    """
+    Returns a Boolean lazy expression that is True on the drainage cells, False
+    on the other cells of the DEM and missing where the DEM is missing. This
+    replaces the spatial and cover steps of the burn drainage model.
+    """
+    return lazy.local('where({0} == {0}, where({1} != 0, 1.0, 0.0), nan)',
+                      dem, lazy.array(drainage, 'VS_BOOLEAN'), valuescale='VS_BOOLEAN')
+
+
+def filled_dem(dem, outflowdepth=9999999, corearea=9999999, corevolume=9999999, precipitation=9999999):
+    """
+    Returns the lazy expression of the DEM with its pits removed by
+    lddcreatedem. PCRaster must use the DEM as clone and the lddcreatedem
+    options must be set.
+    """
+    from pcraster import lddcreatedem
+
+    return lazy.apply(lddcreatedem, dem, outflowdepth, corearea, corevolume, precipitation)
+
+
+def burned_dem(filled, drainage, bufferdistance, smoothdrop, sharpdrop):
+    """
+    Returns the lazy expression of the burned DEM. Cells of the filled DEM
+    within bufferdistance of the drainage are lowered gradually by up to
+    smoothdrop and drainage cells by a further sharpdrop. The unit option of
+    PCRaster must be set.
+    """
+    from pcraster import spread
+
+    distanceToDrainage = lazy.apply(spread, drainage, 0, 1)
+    tempDEM = lazy.ifthenelse(distanceToDrainage < bufferdistance,
+                              filled - smoothdrop * (bufferdistance - distanceToDrainage) / bufferdistance,
+                              filled)
+    return lazy.ifthenelse(distanceToDrainage == 0.0, tempDEM - sharpdrop, tempDEM)
+
+
+def file_fingerprint(path):
+    """
+    Returns the absolute path, size and modification time of a file.
+    """
+    status = os.stat(path)
+    return [os.path.abspath(path), status.st_size, status.st_mtime]
+
+
+def feature_hashes(layers):
+    """
+    Returns a dictionary with the SHA-1 hash of the geometry and the bounding
+    box of every feature of the layers, keyed by layer source and feature id.
+    """
+    features = {}
+    request = QgsFeatureRequest().setNoAttributes()
+    for layer in layers:
+        for feature in layer.getFeatures(request):
+            if not feature.hasGeometry():
+                continue
+            geometry = feature.geometry()
+            box = geometry.boundingBox()
+            features['{}:{}'.format(layer.source(), feature.id())] = [
+                hashlib.sha1(bytes(geometry.asWkb())).hexdigest(),
+                box.xMinimum(), box.yMinimum(), box.xMaximum(), box.yMaximum()]
+    return features
+
+
+def changed_extent(previous, current):
+    """
+    Returns (xmin, ymin, xmax, ymax) around the features that were added,
+    removed or changed between two feature_hashes() results, or None when
+    nothing changed. Changed features contribute their old and new extent.
+    """
+    boxes = [box for key, (digest, *box) in previous.items() if current.get(key, [None])[0] != digest]
+    boxes += [box for key, (digest, *box) in current.items() if previous.get(key, [None])[0] != digest]
+    if not boxes:
+        return None
+    xmin, ymin, xmax, ymax = zip(*boxes)
+    return min(xmin), min(ymin), max(xmax), max(ymax)
+
+
+def load_state(path):
+    """
+    Returns the state stored by save_state(), or None if there is none.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as state_file:
+        return json.load(state_file)
+
+
+def save_state(path, state):
+    with open(path, 'w') as state_file:
+        json.dump(state, state_file)
+
+
+def grid_window(ds, extent, margin=0):
+    """
+    Returns the (xoff, yoff, xsize, ysize) window of the cells of a dataset
+    that overlap an (xmin, ymin, xmax, ymax) extent grown by margin cells.
+    """
+    geotransform = ds.GetGeoTransform()
+    left = math.floor((extent[0] - geotransform[0]) / geotransform[1]) - margin
+    right = math.ceil((extent[2] - geotransform[0]) / geotransform[1]) + margin
+    top = math.floor((extent[3] - geotransform[3]) / geotransform[5]) - margin
+    bottom = math.ceil((extent[1] - geotransform[3]) / geotransform[5]) + margin
+    left, top = max(left, 0), max(top, 0)
+    right, bottom = min(right, ds.RasterXSize), min(bottom, ds.RasterYSize)
+    return left, top, max(right - left, 0), max(bottom - top, 0)
+
+
+def update_burned_dem(output, filled_path, layers, extent, bufferdistance, smoothdrop, sharpdrop):
+    """
+    Patches a burned DEM written by an earlier run for drainage that changed
+    within extent. The filled DEM of that run does not depend on the drainage
+    and is reused; spread only runs on the changed window plus a margin of
+    the buffer distance, so distances to unchanged drainage outside the
+    window are still found. Returns the path of the output.
+    """
+    from pcraster import Boolean, numpy2pcr, pcr2numpy, setclone, spread
+
+    filled_ds = open_raster(filled_path)
+    geotransform = filled_ds.GetGeoTransform()
+    margin = int(math.ceil(bufferdistance / abs(geotransform[1]))) + 1
+    patch = grid_window(filled_ds, extent, margin)
+    xoff, yoff = max(patch[0] - margin, 0), max(patch[1] - margin, 0)
+    xsize = min(patch[0] + patch[2] + margin, filled_ds.RasterXSize) - xoff
+    ysize = min(patch[1] + patch[3] + margin, filled_ds.RasterYSize) - yoff
+    compute = (xoff, yoff, xsize, ysize)
+    if patch[2] == 0 or patch[3] == 0:
+        return output
+
+    band = filled_ds.GetRasterBand(1)
+    filled = band.ReadAsArray(xoff, yoff, xsize, ysize).astype(np.float64)
+    valid = valid_mask(filled, band.GetNoDataValue())
+    drainage = rasterize_layers(layers, filled_ds, window=compute)
+    setclone(ysize, xsize, abs(geotransform[1]),
+             geotransform[0] + xoff * geotransform[1], geotransform[3] + yoff * geotransform[5])
+    distance = pcr2numpy(spread(numpy2pcr(Boolean, np.where(valid, drainage != 0, 255).astype(np.uint8), 255), 0, 1),
+                         np.nan)
+    with np.errstate(invalid='ignore'):
+        burned = np.where(distance < bufferdistance,
+                          filled - smoothdrop * (bufferdistance - distance) / bufferdistance, filled)
+        burned = np.where(distance == 0, burned - sharpdrop, burned)
+    rows = slice(patch[1] - yoff, patch[1] - yoff + patch[3])
+    cols = slice(patch[0] - xoff, patch[0] - xoff + patch[2])
+    burned, valid = burned[rows, cols], valid[rows, cols] & ~np.isnan(burned[rows, cols])
+
+    # Copy the previous output with the window replaced, so compressed and
+    # PCRaster outputs keep a valid layout
+    previous = open_raster(output)
+    writer = RasterWriter(output, previous, 'VS_SCALAR')
+    for window_yoff, window_ysize in row_windows(previous):
+        values, values_valid = read_rows(previous, window_yoff, window_ysize)
+        top = max(patch[1], window_yoff)
+        bottom = min(patch[1] + patch[3], window_yoff + window_ysize)
+        if top < bottom:
+            target = (slice(top - window_yoff, bottom - window_yoff), slice(patch[0], patch[0] + patch[2]))
+            source = slice(top - patch[1], bottom - patch[1])
+            values = values.astype(np.float64)
+            values[target] = burned[source]
+            values_valid[target] = valid[source]
+        writer.write(values, values_valid, window_yoff)
+    previous = None
+    return writer.close()
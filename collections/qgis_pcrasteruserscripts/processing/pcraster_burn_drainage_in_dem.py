@@ -10,14 +10,35 @@ from qgis.core import (
     QgsProcessing,
     QgsProcessingException,
     QgsProcessingAlgorithm,
-    QgsProcessingMultiStepFeedback,
     QgsProcessingParameterRasterLayer,
     QgsProcessingParameterNumber,
     QgsProcessingParameterBoolean,
     QgsProcessingParameterMultipleLayers,
     QgsProcessingParameterRasterDestination,
     )
-import processing
+
+import os
+import sys
+
+# The shared helpers live next to this script in the scripts folder
+_SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+if _SCRIPT_FOLDER not in sys.path:
+    sys.path.append(_SCRIPT_FOLDER)
+
+import pcraster_lazy as lazy
+from pcraster_blockio import open_raster
+from pcraster_burn import (
+    burned_dem,
+    changed_extent,
+    drainage_expression,
+    feature_hashes,
+    file_fingerprint,
+    filled_dem,
+    load_state,
+    rasterize_layers,
+    save_state,
+    update_burned_dem)
+from pcraster_profiling import Profile
 
 
 class BurnDrainageInDEM(QgsProcessingAlgorithm):
@@ -27,6 +48,7 @@ class BurnDrainageInDEM(QgsProcessingAlgorithm):
     BUFFER_SIZE = 'BUFFER_SIZE'
     SMOOTH_DROP = 'SMOOTH_DROP'
     SHARP_DROP = 'SHARP_DROP'
+    INCREMENTAL = 'INCREMENTAL'
     OUTPUT = 'OUTPUT'
 
     def initAlgorithm(self, config=None):
@@ -35,15 +57,15 @@ class BurnDrainageInDEM(QgsProcessingAlgorithm):
         self.addParameter(QgsProcessingParameterNumber(self.BUFFER_SIZE, 'Buffer distance', type=QgsProcessingParameterNumber.Double, minValue=-1.79769e+308, maxValue=1.79769e+308, defaultValue=100))
         self.addParameter(QgsProcessingParameterNumber(self.SMOOTH_DROP, 'Smooth drop', type=QgsProcessingParameterNumber.Double, minValue=-1.79769e+308, maxValue=1.79769e+308, defaultValue=90))
         self.addParameter(QgsProcessingParameterNumber(self.SHARP_DROP, 'Sharp drop', type=QgsProcessingParameterNumber.Double, defaultValue=30))
+        self.addParameter(QgsProcessingParameterBoolean(self.INCREMENTAL, 'Only update the previous output where drainage changed', defaultValue=False))
         self.addParameter(QgsProcessingParameterRasterDestination(self.OUTPUT, 'Burned DEM', createByDefault=True, defaultValue=None))
 
     def flags(self):
         return QgsProcessingAlgorithm.FlagNoThreading
         
-    def processAlgorithm(self, parameters, context, model_feedback):
-        # Use a multi-step feedback, so that individual child algorithm progress reports are adjusted for the
-        # overall progress through the model
-        feedback = QgsProcessingMultiStepFeedback(7, model_feedback)
+    def processAlgorithm(self, parameters, context, feedback):
+        from pcraster import setclone, setglobaloption
+
         results = {}
         
         dem_layer = self.parameterAsRasterLayer(parameters, self.INPUT_DEM, context)
@@ -57,120 +79,69 @@ class BurnDrainageInDEM(QgsProcessingAlgorithm):
         for layer in drainage_layers:
             if layer.crs() != dem_crs:
                 raise QgsProcessingException('All drainage layers must have the same CRS as the DEM ({})'.format(dem_crs.authid()))
-            
-        # Merge drainage layers
-        alg_params = {
-            'INPUT': parameters[self.DRAINAGE_LAYERS],
-            'UNIONED': True,
-            'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-        }
-        feedback.pushInfo('Merging drainage layers')
-        merged_drainage_layer = processing.run('gdal:buildvirtualvector', alg_params, context=context, feedback=feedback, is_child_algorithm=True)['OUTPUT']
-
-        feedback.setCurrentStep(1)
-        if feedback.isCanceled():
-            return {}
-
-        # Rasterize drainage
-        feedback.pushInfo('Converting drainage to raster')
-        alg_params = {
-            'BURN': 1,
-            'DATA_TYPE': 0,  # byte
-            'EXTENT': parameters[self.INPUT_DEM],
-            'EXTRA': '',
-            'FIELD': '',
-            'HEIGHT': dem_resolution,
-            'INIT': None,
-            'INPUT': merged_drainage_layer,
-            'INVERT': False,
-            'NODATA': 0,
-            'OPTIONS': '',
-            'UNITS': 1,
-            'WIDTH': dem_resolution,
-            'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-        }
-        rasterized_drainage = processing.run('gdal:rasterize', alg_params, context=context, feedback=feedback, is_child_algorithm=True)['OUTPUT']
-
-        feedback.setCurrentStep(2)
-        if feedback.isCanceled():
-            return {}
-
-        # Convert drainage to PCRaster Format
-        feedback.pushInfo('Convert drainage to PCRaster format')
-        alg_params = {
-            'INPUT': rasterized_drainage,
-            'INPUT2': 0,
-            'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-        }
-        pcraster_drainage = processing.run('pcraster:converttopcrasterformat', alg_params, context=context, feedback=feedback, is_child_algorithm=True)['OUTPUT']
-
-        feedback.setCurrentStep(3)
-        if feedback.isCanceled():
-            return {}
-
-        feedback.pushInfo('Convert DEM to PCRaster format')
-        # Convert DEM to PCRaster Format
-        alg_params = {
-            'INPUT': parameters[self.INPUT_DEM],
-            'INPUT2': 3,
-            'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-        }
-        pcraster_dem = processing.run('pcraster:converttopcrasterformat', alg_params, context=context, feedback=feedback, is_child_algorithm=True)['OUTPUT']
-
-        feedback.setCurrentStep(4)
-        if feedback.isCanceled():
-            return {}
-
-        # spatial
-        feedback.pushInfo('Preparing drainage pt 1')
-        alg_params = {
-            'INPUT': 0,
-            'INPUT1': 0,
-            'INPUT2': pcraster_dem,
-            'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-        }
-        dem_spatial = processing.run('pcraster:spatial', alg_params, context=context, feedback=feedback, is_child_algorithm=True)['OUTPUT']
-
-        feedback.setCurrentStep(5)
-        if feedback.isCanceled():
-            return {}
-
-        # cover
-        # This is needed to create a boolean with zeros and ones. Otherwise it has ones and nodata.
-        feedback.pushInfo('Preparing drainage pt 2')
-        alg_params = {
-            'INPUT': pcraster_drainage,
-            'INPUT2': dem_spatial,
-            'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-        }
-        drainage_cover = processing.run('pcraster:cover', alg_params, context=context, feedback=feedback, is_child_algorithm=True)['OUTPUT']
-
-        feedback.setCurrentStep(6)
-        if feedback.isCanceled():
-            return {}
-
-        # burndem
-        # Not all parameters of burndem are asked as input in this model.
-        feedback.pushInfo('Burning DEM')
-        alg_params = {
-            'INPUT': pcraster_dem,
-            'INPUT0': 0,
-            'INPUT1': 0,
-            'INPUT10': parameters[self.SHARP_DROP],
-            'INPUT2': 9999999,
-            'INPUT3': 9999999,
-            'INPUT4': 9999999,
-            'INPUT5': 9999999,
-            'INPUT6': 0,
-            'INPUT7': drainage_cover,
-            'INPUT8': parameters[self.BUFFER_SIZE],
-            'INPUT9': parameters[self.SMOOTH_DROP],
-            'OUTPUT': parameters[self.OUTPUT]
-        }
-        burned_dem = processing.run('script:burndem', alg_params, context=context, feedback=feedback, is_child_algorithm=True)['OUTPUT']
-        return {
-            self.OUTPUT: burned_dem
-            }
+
+        with Profile(self.name(), feedback) as profile:
+            profile.raster(dem_layer.height(), dem_layer.width())
+            dem_path = dem_layer.dataProvider().dataSourceUri()
+            bufferdistance = self.parameterAsDouble(parameters, self.BUFFER_SIZE, context)
+            smoothdrop = self.parameterAsDouble(parameters, self.SMOOTH_DROP, context)
+            sharpdrop = self.parameterAsDouble(parameters, self.SHARP_DROP, context)
+            outputFilePath = self.parameterAsOutputLayer(parameters, self.OUTPUT, context)
+            setglobaloption("lddfill")
+            setglobaloption("lddout")
+            setglobaloption("unittrue")
+
+            # The incremental mode keeps the feature hashes and the filled DEM of
+            # the last run next to the output
+            incremental = self.parameterAsBoolean(parameters, self.INCREMENTAL, context)
+            state_path = outputFilePath + '.burnstate.json'
+            filled_path = outputFilePath + '.filled.tif'
+            if incremental:
+                state = {
+                    'dem': file_fingerprint(dem_path),
+                    'parameters': [bufferdistance, smoothdrop, sharpdrop],
+                    'features': feature_hashes(drainage_layers)
+                }
+                previous = load_state(state_path)
+                if (previous is not None and previous['dem'] == state['dem']
+                        and previous['parameters'] == state['parameters']
+                        and os.path.exists(outputFilePath) and os.path.exists(filled_path)):
+                    extent = changed_extent(previous['features'], state['features'])
+                    if extent is None:
+                        feedback.pushInfo('No drainage features changed')
+                    else:
+                        feedback.pushInfo('Updating the burned DEM within {}'.format(extent))
+                        with profile.phase('update'):
+                            update_burned_dem(outputFilePath, filled_path, drainage_layers, extent,
+                                              bufferdistance, smoothdrop, sharpdrop)
+                    save_state(state_path, state)
+                    results[self.OUTPUT] = outputFilePath
+                    return results
+                feedback.pushInfo('No usable previous run found, burning the whole DEM')
+
+            # Rasterize drainage straight onto the DEM grid in memory, instead of
+            # merging, rasterizing and converting the layers to temporary files
+            feedback.pushInfo('Converting drainage to raster')
+            with profile.phase('rasterize'):
+                drainage = rasterize_layers(drainage_layers, open_raster(dem_path))
+            if feedback.isCanceled():
+                return {}
+
+            # burndem with the lddcreatedem settings of the burndem script defaults
+            feedback.pushInfo('Burning DEM')
+            setclone(dem_path)
+            DEM = lazy.raster(dem_path)
+            DEMFilled = filled_dem(DEM)
+            if incremental:
+                with profile.phase('write filled DEM'):
+                    DEMFilled.save(filled_path, dem_path, 'VS_SCALAR')
+            newDEM = burned_dem(DEMFilled, drainage_expression(drainage, DEM), bufferdistance, smoothdrop, sharpdrop)
+            # The operators run block by block while the result is written
+            with profile.phase('burn and write'):
+                results[self.OUTPUT] = newDEM.save(outputFilePath, dem_path, 'VS_SCALAR', feedback)
+            if incremental:
+                save_state(state_path, state)
+            return results
 
     def name(self):
         return 'burndrainageindem'
@@ -198,12 +169,13 @@ class BurnDrainageInDEM(QgsProcessingAlgorithm):
 
             <h2>Parameters</h2>
 
-            <b>Input DEM</b> (required) - DEM in PCRaster format (scalar)
+            <b>Input DEM</b> (required) - DEM raster layer (scalar)
             <b>Drainage layers</b> (required) - Vector layers to burn into the DEM
             <b>Buffer distance</b> (required) - Distance of gradual drop to drainage (map units)
             <b>Smooth drop</b> (required) - Depth of smooth drop (map units)
             <b>Sharp drop</b> (required) - Depth of sharp drop at drainage added to smooth drop (map units)
-            <b>Burned DEM</b> (required) - Result burned DEM in PCRaster format (scalar)
+            <b>Only update the previous output where drainage changed</b> (optional) - Compare the drainage features with the last run to the same output and only recalculate the area around the changed features
+            <b>Burned DEM</b> (required) - Result burned DEM (scalar)
 
             Authors: Nyall Dawson, Hans van der Kwast
             Based on original algorithm DEM Optimization in <a href="http://spatial-analyst.net/ILWIS/htm/ilwisapp/dem_optimization_functionality.htm">ILWIS</a>
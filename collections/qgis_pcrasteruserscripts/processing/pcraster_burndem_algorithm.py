@@ -11,15 +11,8 @@
 ***************************************************************************
 """
 
-from pcraster import (
-    readmap,
-    setclone,
-    lddcreatedem,
-    spread,
-    ifthenelse,
-    setglobaloption,
-    report
-)
+import os
+import sys
 
 from qgis import processing
 from qgis.PyQt.QtCore import QCoreApplication
@@ -33,6 +26,15 @@ from qgis.core import (
     QgsProcessingParameterRasterLayer,
     QgsProcessingParameterEnum,
     QgsProcessingParameterNumber)
+
+# The shared helpers live next to this script in the scripts folder
+_SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+if _SCRIPT_FOLDER not in sys.path:
+    sys.path.append(_SCRIPT_FOLDER)
+
+import pcraster_lazy as lazy
+from pcraster_burn import burned_dem, filled_dem
+from pcraster_profiling import Profile
 
 class PCRasterBurndemAlgorithm(QgsProcessingAlgorithm):
     """
@@ -256,6 +258,8 @@ class PCRasterBurndemAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         """
 
+        from pcraster import setclone, setglobaloption
+
         input_dem = self.parameterAsRasterLayer(parameters, self.INPUT_DEM, context)
         input_drainage = self.parameterAsRasterLayer(parameters, self.INPUT_DRAINAGE, context)
         input_bufferdistance = self.parameterAsDouble(parameters, self.INPUT_BUFFERDISTANCE, context)
@@ -282,17 +286,19 @@ class PCRasterBurndemAlgorithm(QgsProcessingAlgorithm):
         input_precipitation = self.parameterAsDouble(parameters, self.INPUT_PRECIPITATION, context)
         #output_demburned = self.parameterAsRasterLayer(parameters, self.OUTPUT_DEMFILLED, context)
         setclone(input_dem.dataProvider().dataSourceUri())
-        DEM = readmap(input_dem.dataProvider().dataSourceUri())
-        DEMFilled = lddcreatedem(DEM, input_outflowdepth, input_corearea, input_corevolume, input_precipitation)
-        drainage = readmap(input_drainage.dataProvider().dataSourceUri())
-        distanceToDrainage = spread(drainage, 0, 1)
-        tempDEM = ifthenelse(distanceToDrainage < input_bufferdistance, \
-                            DEMFilled - input_smoothdrop * (input_bufferdistance - distanceToDrainage) / input_bufferdistance, \
-                            DEMFilled)
-        newDEM = ifthenelse(distanceToDrainage == 0.0, tempDEM - input_sharpdrop, tempDEM)
+        # Only the inputs of lddcreatedem and spread are materialised; the
+        # two ifthenelse steps run as one fused block-wise kernel
+        DEM = lazy.raster(input_dem.dataProvider().dataSourceUri())
+        drainage = lazy.raster(input_drainage.dataProvider().dataSourceUri())
+        DEMFilled = filled_dem(DEM, input_outflowdepth, input_corearea, input_corevolume, input_precipitation)
+        newDEM = burned_dem(DEMFilled, drainage, input_bufferdistance, input_smoothdrop, input_sharpdrop)
         
         outputFilePath = self.parameterAsOutputLayer(parameters, self.OUTPUT_DEMBURNED, context)
-        report(newDEM,outputFilePath)
+        with Profile(self.name(), feedback) as profile:
+            profile.raster(input_dem.height(), input_dem.width())
+            # The operators run block by block while the result is written
+            with profile.phase('burn and write'):
+                newDEM.save(outputFilePath, input_dem.dataProvider().dataSourceUri(), 'VS_SCALAR', feedback)
 
         results = {}
         results[self.OUTPUT_DEMBURNED] = outputFilePath
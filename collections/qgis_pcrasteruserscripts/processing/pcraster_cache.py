@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+# On-disk cache of files that are expensive to create, such as downloaded
+# DEM tiles. Entries are addressed by a key tuple and evicted in least
+# recently used order when the cache grows beyond its quota. This module
+# contains no algorithm, so the Processing script provider skips it.
+
+import hashlib
+import os
+import time
+import uuid
+
+from qgis.core import QgsApplication
+
+
+def default_cache_folder(name):
+    """
+    Returns the folder of a named cache in the QGIS profile folder.
+    """
+    return os.path.join(QgsApplication.qgisSettingsDirPath(), 'cache', 'pcraster', name)
+
+
+class DiskCache:
+    """
+    Files in a folder addressed by key tuples. The modification time of a
+    file is its last use, which is what eviction sorts on.
+    """
+
+    def __init__(self, folder, quota):
+        self.folder = folder
+        self.quota = quota
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, key, suffix=''):
+        """
+        Returns the path of the entry of a key, whether it exists or not.
+        """
+        digest = hashlib.sha1(repr(tuple(key)).encode('utf-8')).hexdigest()
+        return os.path.join(self.folder, digest + suffix)
+
+    def get(self, key, suffix=''):
+        """
+        Returns the path of the entry of a key and marks it as used, or None
+        if the key is not cached.
+        """
+        path = self.path(key, suffix)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Not cached, or just evicted by another run
+            return None
+        return path
+
+    def temporary_path(self, suffix=''):
+        """
+        Returns a path to create an entry at. Entries only become visible
+        when they are moved in place by put(), so an interrupted run never
+        leaves a partial entry behind.
+        """
+        return os.path.join(self.folder, 'partial-{}{}'.format(uuid.uuid4().hex, suffix))
+
+    def put(self, key, temporary_path, suffix='', keep=()):
+        """
+        Moves a file created at temporary_path into the cache under a key,
+        evicts old entries beyond the quota, except the paths in keep, and
+        returns the cached path.
+        """
+        path = self.path(key, suffix)
+        os.replace(temporary_path, path)
+        self.evict(keep=(path,) + tuple(keep))
+        return path
+
+    def evict(self, keep=()):
+        """
+        Removes the least recently used entries until the cache fits in its
+        quota. Entries in keep are never removed.
+        """
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.is_file():
+                status = entry.stat()
+                entries.append((status.st_mtime, status.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        # Partial files older than a day are left over from interrupted runs
+        stale = time.time() - 24 * 3600
+        for mtime, size, path in sorted(entries):
+            partial = os.path.basename(path).startswith('partial-')
+            if path in keep or (partial and mtime >= stale):
+                continue
+            if partial or total > self.quota:
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
@@ -11,25 +11,8 @@
 ***************************************************************************
 """
 
-import gc
 import os
-from osgeo import gdal, ogr
-from pcraster import (
-    readmap,
-    streamorder,
-    ifthen,
-    downstream,
-    boolean,
-    ordinal,
-    cover,
-    mapmaximum,
-    uniqueid,
-    cellvalue,
-    catchment,
-    ifthenelse,
-    report,
-    nominal
-)
+import sys
 from qgis import processing
 from qgis.PyQt.QtCore import QCoreApplication
 from qgis.PyQt.QtCore import QCoreApplication, QVariant
@@ -39,20 +22,16 @@ from qgis.core import (
     QgsProcessingParameterFolderDestination,
     QgsProcessingParameterNumber,
     QgsProcessingParameterCrs,
-    QgsProcessingUtils,
     QgsProcessingParameterFeatureSink,
     QgsProcessing,
     QgsFields,
     QgsField,
     QgsWkbTypes,
     QgsProcessingException,
-    QgsVectorLayer,
     QgsFeature,
-    QgsGeometry,
-    QgsMultiPolygon,
-    QgsPolygon,
     QgsCoordinateTransform,
-    QgsProcessingParameterCrs
+    QgsProcessingParameterCrs,
+    QgsFeatureSink
 )
 from qgis.core import (
     QgsProcessingAlgorithm,
@@ -64,6 +43,16 @@ from qgis.core import (
     QgsProcessing
 )
 
+# The shared helpers live next to this script in the scripts folder
+_SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+if _SCRIPT_FOLDER not in sys.path:
+    sys.path.append(_SCRIPT_FOLDER)
+
+from pcraster_blockio import write_field
+from pcraster_polygonize import polygonize_array
+from pcraster_profiling import Profile
+from pcraster_subcatchments import catchment_polygons, subcatchment_topology, topology_features, topology_fields
+
 
 class CalculateVectorSubcatchments(QgsProcessingAlgorithm):
     INPUT = 'INPUT'
@@ -75,6 +64,7 @@ class CalculateVectorSubcatchments(QgsProcessingAlgorithm):
     DEST_CRS = 'DEST_CRS'
 
     OUTPUT = 'OUTPUT'
+    OUTPUT_TOPOLOGY = 'OUTPUT_TOPOLOGY'
 
     def tr(self, string):
         """
@@ -139,6 +129,7 @@ class CalculateVectorSubcatchments(QgsProcessingAlgorithm):
             <b>Output rivers</b> (optional) - Output river raster layer (boolean)
             <b>Output junctions</b> (optional) - Output junctions raster layer (boolean)
             <b>Subcatchments</b> (optional) - Vector layer with all subcatchments
+            <b>Subcatchment topology</b> (optional) - Table with per subcatchment the id, the id of the subcatchment it drains into, its own and upstream area, the outlet coordinates, the Strahler order at the outlet and nested set numbers: the subcatchments upstream of a subcatchment are those with nest_left from its nest_left to its nest_right
 
             Authors: Nyall Dawson, Hans van der Kwast
             </body></html>
@@ -200,134 +191,119 @@ class CalculateVectorSubcatchments(QgsProcessingAlgorithm):
             )
         )
 
-    def processAlgorithm(self, parameters, context, feedback):
-        input_flow_direction = self.parameterAsRasterLayer(parameters, self.INPUT, context)
-
-        if feedback and feedback.isCanceled():
-            return {}
-        flow_direction = readmap(input_flow_direction.dataProvider().dataSourceUri())
-        if feedback and feedback.isCanceled():
-            return {}
-
-        threshold = self.parameterAsInt(parameters, self.THRESHOLD, context)
-
-        feedback.pushInfo('Calculating Strahler orders')
-        StrahlerOrders = streamorder(flow_direction)
-        if feedback and feedback.isCanceled():
-            return {}
-
-        StrahlerRivers = ifthen(StrahlerOrders >= threshold, StrahlerOrders)
-        if feedback and feedback.isCanceled():
-            return {}
-
-        output_rivers = self.parameterAsOutputLayer(parameters, self.OUTPUT_RIVERS, context)
-        if output_rivers:
-            report(StrahlerRivers, output_rivers)
-
-        feedback.pushInfo('Finding outlets')
-        Junctions = ifthen(downstream(flow_direction, StrahlerRivers) != StrahlerRivers, boolean(1))
-        if feedback and feedback.isCanceled():
-            return {}
-
-        output_junctions = self.parameterAsOutputLayer(parameters, self.OUTPUT_JUNCTIONS, context)
-        if output_junctions:
-            report(Junctions, output_junctions)
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.OUTPUT_TOPOLOGY,
+                self.tr('Subcatchment topology'),
+                QgsProcessing.TypeVector,
+                optional=True,
+                createByDefault=False
+            )
+        )
 
-        outlets = ordinal(cover(uniqueid(Junctions), 0))
-        if feedback and feedback.isCanceled():
-            return {}
+    def processAlgorithm(self, parameters, context, feedback):
+        from pcraster import (
+            readmap,
+            streamorder,
+            ifthen,
+            downstream,
+            boolean,
+            ordinal,
+            cover,
+            mapmaximum,
+            uniqueid,
+            cellvalue,
+            pcr2numpy
+        )
 
-        output_outlets = self.parameterAsOutputLayer(parameters, self.OUTPUT_OUTLETS, context)
-        if output_outlets:
-            report(outlets, output_outlets)
+        input_flow_direction = self.parameterAsRasterLayer(parameters, self.INPUT, context)
 
-        feedback.pushInfo('Calculate subcatchments')
+        with Profile(self.name(), feedback) as profile:
+            profile.raster(input_flow_direction.height(), input_flow_direction.width())
+            if feedback and feedback.isCanceled():
+                return {}
+            with profile.phase('read'):
+                flow_direction = readmap(input_flow_direction.dataProvider().dataSourceUri())
+            if feedback and feedback.isCanceled():
+                return {}
 
-        MaximumOutlets = mapmaximum(outlets)
-        MaximumOutletsTuple = cellvalue(MaximumOutlets, 0, 0)
-        MaximumOutletsValue = MaximumOutletsTuple[0]
-        feedback.pushInfo('Total subcatchments: {}'.format(MaximumOutletsValue))
+            threshold = self.parameterAsInt(parameters, self.THRESHOLD, context)
 
-        fields = QgsFields()
-        fields.append(QgsField('catchment_id', QVariant.LongLong))
+            feedback.pushInfo('Calculating Strahler orders')
+            with profile.phase('streamorder'):
+                StrahlerOrders = streamorder(flow_direction)
+            if feedback and feedback.isCanceled():
+                return {}
 
-        dest_crs = self.parameterAsCrs(parameters, self.DEST_CRS, context)
+            StrahlerRivers = ifthen(StrahlerOrders >= threshold, StrahlerOrders)
+            if feedback and feedback.isCanceled():
+                return {}
 
-        (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT, context,
-                                               fields, QgsWkbTypes.MultiPolygon, dest_crs)
-        if sink is None:
-            raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
+            output_rivers = self.parameterAsOutputLayer(parameters, self.OUTPUT_RIVERS, context)
+            if output_rivers:
+                write_field(StrahlerRivers, output_rivers, input_flow_direction.dataProvider().dataSourceUri())
 
-        transform = QgsCoordinateTransform(input_flow_direction.crs(), dest_crs, context.transformContext())
+            feedback.pushInfo('Finding outlets')
+            with profile.phase('outlets'):
+                Junctions = ifthen(downstream(flow_direction, StrahlerRivers) != StrahlerRivers, boolean(1))
+            if feedback and feedback.isCanceled():
+                return {}
 
-        temp_catchment_raster_path = QgsProcessingUtils.generateTempFilename('catchment_raster.map')
-        temp_catchment_vector_path = QgsProcessingUtils.generateTempFilename('catchment_vector.shp')
+            output_junctions = self.parameterAsOutputLayer(parameters, self.OUTPUT_JUNCTIONS, context)
+            if output_junctions:
+                write_field(Junctions, output_junctions, input_flow_direction.dataProvider().dataSourceUri())
 
-        for idx, outlet in enumerate(range(1, MaximumOutletsValue + 1)):
-            feedback.setProgress(idx / MaximumOutletsValue * 100)
+            outlets = ordinal(cover(uniqueid(Junctions), 0))
             if feedback and feedback.isCanceled():
-                break
-
-            gc.collect()
-            feedback.pushInfo('Processing subcatchment {}'.format(outlet))
-            SubCatchment = catchment(flow_direction, ifthenelse(outlets == outlet, nominal(outlet), nominal(0)))
-            if os.path.exists(temp_catchment_raster_path):
-                os.unlink(temp_catchment_raster_path)
-
-            report(SubCatchment, temp_catchment_raster_path)
-            del SubCatchment
-            gc.collect()
-
-            ds_raster = gdal.Open(temp_catchment_raster_path, gdal.GA_ReadOnly)
-            src_band = ds_raster.GetRasterBand(1)
-            # polygonize the result
-            dst_layername = "polygonized"
-            if os.path.exists(temp_catchment_vector_path):
-                os.unlink(temp_catchment_vector_path)
-
-            drv = ogr.GetDriverByName("ESRI Shapefile")
-            catchment_vector_path = temp_catchment_vector_path  # 'c:/temp/catchments/catchment_' + str(outlet) + '.shp'
-            dst_ds = drv.CreateDataSource(catchment_vector_path)
-            dst_layer = dst_ds.CreateLayer(dst_layername, srs=None)
-            field_dn = ogr.FieldDefn("DN", ogr.OFTInteger)
-            dst_layer.CreateField(field_dn)
-
-            gdal.Polygonize(src_band, None, dst_layer, 0, [], callback=None)
-            del src_band
-            del ds_raster
-            del dst_layer
-            del dst_ds
-            gc.collect()
-
-            polygons_layer = QgsVectorLayer(catchment_vector_path)
-            parts = []
-            for f in polygons_layer.getFeatures():
-                if f['DN'] <= 0:
-                    continue
-                part_geometry = f.geometry().makeValid()
-                for part in part_geometry.parts():
-                    parts.append(QgsGeometry(part.clone()))
-            del polygons_layer
-            gc.collect()
-
-            unioned_parts = QgsGeometry.unaryUnion(parts).makeValid()
-            mp = QgsMultiPolygon()
-            for part in unioned_parts.parts():
-                if isinstance(part, QgsPolygon):
-                    mp.addGeometry(part.clone())
-                elif isinstance(part, QgsMultiPolygon):
-                    raise QgsProcessingException('unexpected part type')
-
-            geom = QgsGeometry(mp)
-            geom.transform(transform)
-            out_feature = QgsFeature(fields)
-            out_feature[0] = outlet
-            out_feature.setGeometry(geom)
-            sink.addFeature(out_feature)
-
-        return {
-            self.OUTPUT_RIVERS: output_rivers,
-            self.OUTPUT_JUNCTIONS: output_junctions,
-            self.OUTPUT_OUTLETS: output_outlets,
-            self.OUTPUT: dest_id
-        }
+                return {}
+
+            output_outlets = self.parameterAsOutputLayer(parameters, self.OUTPUT_OUTLETS, context)
+            if output_outlets:
+                write_field(outlets, output_outlets, input_flow_direction.dataProvider().dataSourceUri())
+
+            feedback.pushInfo('Calculate subcatchments')
+
+            MaximumOutlets = mapmaximum(outlets)
+            MaximumOutletsTuple = cellvalue(MaximumOutlets, 0, 0)
+            MaximumOutletsValue = MaximumOutletsTuple[0]
+            feedback.pushInfo('Total subcatchments: {}'.format(MaximumOutletsValue))
+
+            fields = QgsFields()
+            fields.append(QgsField('catchment_id', QVariant.LongLong))
+
+            dest_crs = self.parameterAsCrs(parameters, self.DEST_CRS, context)
+
+            (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT, context,
+                                                   fields, QgsWkbTypes.MultiPolygon, dest_crs)
+            if sink is None:
+                raise QgsProcessingException(self.invalidSinkError(parameters, self.OUTPUT))
+
+            transform = QgsCoordinateTransform(input_flow_direction.crs(), dest_crs, context.transformContext())
+
+            with profile.phase('subcatchments'):
+                network, labels, table = subcatchment_topology(input_flow_direction.dataProvider().dataSourceUri(),
+                                                               pcr2numpy(outlets, 0), pcr2numpy(StrahlerOrders, 0))
+            (topology_sink, topology_id) = self.parameterAsSink(parameters, self.OUTPUT_TOPOLOGY, context,
+                                                                topology_fields(), QgsWkbTypes.NoGeometry)
+            if topology_sink is not None:
+                for feature in topology_features(table, topology_fields(), transform):
+                    topology_sink.addFeature(feature, QgsFeatureSink.FastInsert)
+
+            # Polygonize all subcatchments at once in row bands and dissolve
+            # every catchment from its own and its upstream subcatchments
+            with profile.phase('polygonize'):
+                polygons = polygonize_array(labels, labels > 0, network.geotransform, feedback=feedback)
+                for outlet, geom in catchment_polygons(polygons, table):
+                    geom.transform(transform)
+                    out_feature = QgsFeature(fields)
+                    out_feature[0] = outlet
+                    out_feature.setGeometry(geom)
+                    sink.addFeature(out_feature, QgsFeatureSink.FastInsert)
+
+            return {
+                self.OUTPUT_RIVERS: output_rivers,
+                self.OUTPUT_JUNCTIONS: output_junctions,
+                self.OUTPUT_OUTLETS: output_outlets,
+                self.OUTPUT: dest_id,
+                self.OUTPUT_TOPOLOGY: topology_id
+            }
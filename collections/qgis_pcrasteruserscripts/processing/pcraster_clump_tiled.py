@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+import csv
+import math
+import os
+import sys
+
+import numpy as np
+
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (
+    QgsProcessingException,
+    QgsProcessingAlgorithm,
+    QgsProcessingParameterRasterLayer,
+    QgsProcessingParameterEnum,
+    QgsProcessingParameterFileDestination,
+    QgsProcessingParameterRasterDestination,
+    QgsProcessingUtils)
+
+# The shared helpers live next to this script in the scripts folder
+_SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+if _SCRIPT_FOLDER not in sys.path:
+    sys.path.append(_SCRIPT_FOLDER)
+
+from pcraster_blockio import (
+    RasterWriter,
+    map_blocks,
+    open_raster,
+    read_rows,
+    row_windows,
+    worker_count)
+from pcraster_profiling import Profile
+
+
+def union_find(n, a, b):
+    """
+    Returns the root of each of the n nodes of a graph with edges a-b. Roots
+    are hooked onto the smaller root and paths are compressed until every
+    node points at its root, so the root of a component is its smallest node.
+    """
+    parent = np.arange(n)
+    while len(a):
+        root_a = parent[a]
+        root_b = parent[b]
+        crossing = root_a != root_b
+        if not crossing.any():
+            break
+        a, b = a[crossing], b[crossing]
+        high = np.maximum(root_a[crossing], root_b[crossing])
+        low = np.minimum(root_a[crossing], root_b[crossing])
+        np.minimum.at(parent, high, low)
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+    return parent
+
+
+def neighbour_slices(rows, cols, dr, dc):
+    """
+    Returns the slices selecting the cells and their (dr, dc) neighbours.
+    """
+    first = (slice(0, rows - dr), slice(max(-dc, 0), cols - max(dc, 0)))
+    second = (slice(dr, rows), slice(max(dc, 0), cols - max(-dc, 0)))
+    return first, second
+
+
+def label_components(classes, valid, diagonal):
+    """
+    Labels groups of connected cells with the same class as 1..n in order of
+    their first cell, with 0 for missing cells. Returns the labels and n.
+    """
+    rows, cols = classes.shape
+    index = np.arange(rows * cols).reshape(rows, cols)
+    offsets = [(0, 1), (1, 0)] + ([(1, 1), (1, -1)] if diagonal else [])
+    a, b = [], []
+    for dr, dc in offsets:
+        first, second = neighbour_slices(rows, cols, dr, dc)
+        same = valid[first] & valid[second] & (classes[first] == classes[second])
+        a.append(index[first][same])
+        b.append(index[second][same])
+    roots = union_find(rows * cols, np.concatenate(a), np.concatenate(b))
+    roots, labels = np.unique(roots[valid.ravel()], return_inverse=True)
+    flat = np.zeros(rows * cols, dtype=np.int64)
+    flat[valid.ravel()] = labels + 1
+    return flat.reshape(rows, cols), len(roots)
+
+
+def group_reduce(groups, n, values, ufunc):
+    """
+    Reduces values per group 0..n-1 with a NumPy ufunc.
+    """
+    order = np.argsort(groups, kind='stable')
+    counts = np.bincount(groups, minlength=n)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    return ufunc.reduceat(values[order], starts)
+
+
+class ClumpTile:
+    """
+    Labels one row band of a class raster and collects the per-clump
+    statistics and seam rows needed to merge it with its neighbours.
+    """
+
+    def __init__(self, diagonal, cell_width, cell_height):
+        self.diagonal = diagonal
+        self.cell_width = cell_width
+        self.cell_height = cell_height
+
+    def __call__(self, values, valid):
+        classes = values[1:-1, 1:-1]
+        inner_valid = valid[1:-1, 1:-1]
+        rows, cols = classes.shape
+        labels, n = label_components(classes, inner_valid, self.diagonal)
+
+        # Edges with cells of another class, missing cells or the raster edge
+        perimeter = np.zeros(classes.shape)
+        for dr, dc, length in ((-1, 0, self.cell_width), (1, 0, self.cell_width),
+                               (0, -1, self.cell_height), (0, 1, self.cell_height)):
+            neighbours = values[1 + dr:1 + dr + rows, 1 + dc:1 + dc + cols]
+            neighbours_valid = valid[1 + dr:1 + dr + rows, 1 + dc:1 + dc + cols]
+            perimeter += length * (~neighbours_valid | (neighbours != classes))
+
+        row_index, col_index = np.nonzero(inner_valid)
+        groups = labels[inner_valid] - 1
+        statistics = {
+            'cells': np.bincount(groups, minlength=n),
+            'perimeter': np.bincount(groups, weights=perimeter[inner_valid], minlength=n),
+            'class': np.zeros(n, dtype=classes.dtype),
+            'rowmin': np.zeros(n, dtype=np.int64),
+            'rowmax': np.zeros(n, dtype=np.int64),
+            'colmin': np.zeros(n, dtype=np.int64),
+            'colmax': np.zeros(n, dtype=np.int64),
+        }
+        if n:
+            statistics['class'] = group_reduce(groups, n, classes[inner_valid], np.maximum)
+            statistics['rowmin'] = group_reduce(groups, n, row_index, np.minimum)
+            statistics['rowmax'] = group_reduce(groups, n, row_index, np.maximum)
+            statistics['colmin'] = group_reduce(groups, n, col_index, np.minimum)
+            statistics['colmax'] = group_reduce(groups, n, col_index, np.maximum)
+        seams = (classes[0], inner_valid[0], labels[0], classes[-1], inner_valid[-1], labels[-1])
+        return labels, n, statistics, seams
+
+
+def seam_edges(upper, lower, diagonal):
+    """
+    Returns the pairs of provisional labels that touch across the seam
+    between the last row of one band and the first row of the next.
+    """
+    classes_a, valid_a, labels_a = upper
+    classes_b, valid_b, labels_b = lower
+    cols = len(classes_a)
+    a, b = [], []
+    for dc in ((-1, 0, 1) if diagonal else (0,)):
+        first, second = neighbour_slices(1, cols, 0, dc)
+        first, second = first[1], second[1]
+        same = valid_a[first] & valid_b[second] & (classes_a[first] == classes_b[second])
+        a.append(labels_a[first][same])
+        b.append(labels_b[second][same])
+    return np.concatenate(a), np.concatenate(b)
+
+
+class PCRasterClumpTiledAlgorithm(QgsProcessingAlgorithm):
+    """
+    Labels clumps with a union-find engine that processes row bands in
+    parallel and merges the labels along the band seams.
+    """
+
+    INPUT_RASTER = 'INPUT'
+    INPUT_DIRECTIONS = 'INPUT1'
+    OUTPUT_CLUMP = 'OUTPUT'
+    OUTPUT_AREA = 'OUTPUT_AREA'
+    OUTPUT_TABLE = 'OUTPUT_TABLE'
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return PCRasterClumpTiledAlgorithm()
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'clumptiled'
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr('clump (tiled)')
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return self.tr('PCRaster User Scripts')
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'pcrasteruser'
+
+    def shortHelpString(self):
+        """
+        Returns a localised short helper string for the algorithm. This string
+        should provide a basic description about what the algorithm does and the
+        parameters and outputs associated with it..
+        """
+        return self.tr(
+            """Contiguous groups of cells with the same value (‘clumps’), labelled in parallel tiles
+
+            Clumps are numbered from 1 in the order of their first cell, row by row. The clump area and the statistics table are calculated in the same pass, so no areaarea run is needed afterwards.
+
+            Parameters:
+
+            * <b>Input raster layer</b> (required) - Boolean, nominal or ordinal raster layer
+            * <b>Input directions</b> (required) - diagonal (D8) or non-diagonal (D4)
+            * <b>Output clump raster layer</b> (required) - nominal raster layer with clumps
+            * <b>Output clump area raster layer</b> (optional) - scalar raster layer with the area of the clump of each cell
+            * <b>Output clump table</b> (optional) - CSV table with class, number of cells, area, perimeter and bounding box per clump
+            """
+        )
+
+    def initAlgorithm(self, config=None):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUT_RASTER,
+                self.tr('Input raster layer')
+            )
+        )
+
+        self.directionoption = [self.tr('Diagonal (8 cell)'),self.tr('Non-diagonal (4 cell)')]
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.INPUT_DIRECTIONS,
+                self.tr('Clump direction'),
+                self.directionoption,
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterRasterDestination(
+                self.OUTPUT_CLUMP,
+                self.tr('Clump layer')
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterRasterDestination(
+                self.OUTPUT_AREA,
+                self.tr('Clump area layer'),
+                optional=True,
+                createByDefault=False
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                self.OUTPUT_TABLE,
+                self.tr('Clump table'),
+                self.tr('CSV files (*.csv)'),
+                optional=True
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+
+        input_raster = self.parameterAsRasterLayer(parameters, self.INPUT_RASTER, context)
+        diagonal = self.parameterAsEnum(parameters, self.INPUT_DIRECTIONS, context) == 0
+        path = input_raster.dataProvider().dataSourceUri()
+        class_ds = open_raster(path)
+        geotransform = class_ds.GetGeoTransform()
+        cell_width, cell_height = abs(geotransform[1]), abs(geotransform[5])
+
+        with Profile(self.name(), feedback) as profile:
+            profile.raster(class_ds)
+
+            # Enough bands to keep every worker busy
+            rows = math.ceil(class_ds.RasterYSize / (4 * worker_count()))
+            windows = row_windows(class_ds, min(rows, row_windows(class_ds)[0][1]))
+
+            # Pass 1: label the bands in parallel and store provisional labels
+            feedback.pushInfo('Labelling {} tiles'.format(len(windows)))
+            with profile.phase('label tiles'):
+                provisional_path = QgsProcessingUtils.generateTempFilename('provisional_clumps.tif')
+                # Read back once in pass 2, so no compression or overviews
+                provisional = RasterWriter(provisional_path, class_ds, 'VS_NOMINAL', scratch=True)
+                tile = ClumpTile(diagonal, cell_width, cell_height)
+                offset = 0
+                seams = []
+                tile_statistics = []
+                for i, result in enumerate(map_blocks(path, windows, tile, halo=1)):
+                    if feedback.isCanceled():
+                        return {}
+                    labels, n, statistics, seam = result
+                    yoff = windows[i][0]
+                    provisional.write(labels + offset, labels > 0, yoff)
+                    statistics['rowmin'] += yoff
+                    statistics['rowmax'] += yoff
+                    tile_statistics.append(statistics)
+                    seams.append((seam[:2] + (seam[2] + offset,), seam[3:5] + (seam[5] + offset,)))
+                    offset += n
+                    feedback.setProgress(50 * (i + 1) / len(windows))
+                provisional.close()
+
+            # Merge the labels that touch across the band seams
+            with profile.phase('merge tiles'):
+                a, b = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+                for upper, lower in zip(seams[:-1], seams[1:]):
+                    seam_a, seam_b = seam_edges(upper[1], lower[0], diagonal)
+                    a.append(seam_a)
+                    b.append(seam_b)
+                roots = union_find(offset + 1, np.concatenate(a), np.concatenate(b))
+                roots, final = np.unique(roots[1:], return_inverse=True)
+                clumps = len(roots)
+                if clumps == 0:
+                    raise QgsProcessingException('The input raster has no defined cells')
+                lookup = np.concatenate(([0], final + 1))
+                feedback.pushInfo('Total clumps: {}'.format(clumps))
+
+                groups = final
+                merged = {}
+                for name in ('cells', 'perimeter'):
+                    merged[name] = np.bincount(groups, weights=np.concatenate([s[name] for s in tile_statistics]),
+                                               minlength=clumps)
+                for name, ufunc in (('class', np.maximum), ('rowmin', np.minimum), ('rowmax', np.maximum),
+                                    ('colmin', np.minimum), ('colmax', np.maximum)):
+                    merged[name] = group_reduce(groups, clumps, np.concatenate([s[name] for s in tile_statistics]), ufunc)
+                area = merged['cells'] * cell_width * cell_height
+
+            # Pass 2: replace the provisional labels by the final clump numbers
+            outputFilePath = self.parameterAsOutputLayer(parameters, self.OUTPUT_CLUMP, context)
+            output_area = self.parameterAsOutputLayer(parameters, self.OUTPUT_AREA, context)
+            with profile.phase('relabel'):
+                clump_writer = RasterWriter(outputFilePath, class_ds, 'VS_NOMINAL')
+                area_writer = RasterWriter(output_area, class_ds, 'VS_SCALAR') if output_area else None
+                provisional_ds = open_raster(provisional_path)
+                for i, (yoff, ysize) in enumerate(windows):
+                    if feedback.isCanceled():
+                        return {}
+                    labels, valid = read_rows(provisional_ds, yoff, ysize)
+                    labels = lookup[np.where(valid, labels, 0)]
+                    clump_writer.write(labels, valid, yoff)
+                    if area_writer:
+                        area_writer.write(area[np.maximum(labels - 1, 0)], valid, yoff)
+                    feedback.setProgress(50 + 50 * (i + 1) / len(windows))
+
+                results = {}
+                results[self.OUTPUT_CLUMP] = clump_writer.close()
+                if area_writer:
+                    results[self.OUTPUT_AREA] = area_writer.close()
+
+            output_table = self.parameterAsFileOutput(parameters, self.OUTPUT_TABLE, context)
+            if output_table:
+                with profile.phase('write table'):
+                    with open(output_table, 'w', newline='') as csvfile:
+                        csv_writer = csv.writer(csvfile)
+                        csv_writer.writerow(['clump', 'class', 'cells', 'area', 'perimeter', 'xmin', 'ymin', 'xmax', 'ymax'])
+                        for clump in range(clumps):
+                            csv_writer.writerow([
+                                clump + 1, merged['class'][clump], int(merged['cells'][clump]), area[clump],
+                                merged['perimeter'][clump],
+                                geotransform[0] + merged['colmin'][clump] * geotransform[1],
+                                geotransform[3] + (merged['rowmax'][clump] + 1) * geotransform[5],
+                                geotransform[0] + (merged['colmax'][clump] + 1) * geotransform[1],
+                                geotransform[3] + merged['rowmin'][clump] * geotransform[5]])
+                    results[self.OUTPUT_TABLE] = output_table
+
+            return results
@@ -11,13 +11,8 @@
 ***************************************************************************
 """
 
-from pcraster import (
-    readmap,
-    setclone,
-    scalar,
-    nominal,
-    report
-)
+import os
+import sys
 
 from qgis import processing
 from qgis.PyQt.QtCore import QCoreApplication
@@ -29,6 +24,14 @@ from qgis.core import (
     QgsProcessingParameterMultipleLayers,
     QgsProcessingParameterRasterDestination)
 
+# The shared helpers live next to this script in the scripts folder
+_SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+if _SCRIPT_FOLDER not in sys.path:
+    sys.path.append(_SCRIPT_FOLDER)
+
+from pcraster_blockio import write_field
+from pcraster_profiling import Profile
+
 class combineAlgorithm(QgsProcessingAlgorithm):
     INPUT_RASTER = 'INPUT'
     INPUT_RASTERS = 'INPUT1'
@@ -120,24 +123,32 @@ class combineAlgorithm(QgsProcessingAlgorithm):
         return arr * (2 ** index)
     
     def processAlgorithm(self, parameters, context, feedback):
+        from pcraster import readmap, setclone, scalar, nominal
+
         input_rasters = []
-        for layer in self.parameterAsLayerList(parameters, self.INPUT_RASTERS, context):
+        layers = self.parameterAsLayerList(parameters, self.INPUT_RASTERS, context)
+        for layer in layers:
             input_rasters.append(layer.source())
         output_raster = self.parameterAsRasterLayer(parameters, self.OUTPUT_RASTER, context)
-        setclone(input_rasters[0])
+        with Profile(self.name(), feedback) as profile:
+            profile.raster(layers[0].height(), layers[0].width())
+            setclone(input_rasters[0])
         
-        combined_map = scalar(0)
+            combined_map = scalar(0)
         
-        # Iterate through input raster maps
-        for index, input_map in enumerate(input_rasters):
-            input_data = readmap(input_map)
-            contribution = self.combine_values(scalar(input_data), index)
-            combined_map = scalar(combined_map) + scalar(contribution)
-            combined_map = nominal(combined_map)
+            # Iterate through input raster maps
+            for index, input_map in enumerate(input_rasters):
+                with profile.phase('read {}'.format(index + 1)):
+                    input_data = readmap(input_map)
+                with profile.phase('combine {}'.format(index + 1)):
+                    contribution = self.combine_values(scalar(input_data), index)
+                    combined_map = scalar(combined_map) + scalar(contribution)
+                    combined_map = nominal(combined_map)
         
-        outputFilePath = self.parameterAsOutputLayer(parameters, self.OUTPUT_RASTER, context)
+            outputFilePath = self.parameterAsOutputLayer(parameters, self.OUTPUT_RASTER, context)
 
-        report(combined_map,outputFilePath)
+            with profile.phase('write'):
+                write_field(combined_map, outputFilePath, input_rasters[0])
         
 #        self.set_output_crs(output_file=outputFilePath, crs=input_raster.crs(), feedback=feedback, context=context)
 
@@ -11,16 +11,10 @@
 ***************************************************************************
 """
 
-from pcraster import (
-    readmap,
-    setclone,
-    uniqueid,
-    nominal,
-    lddcreate,
-    subcatchment,
-    areaminimum,
-    report
-)
+import os
+import sys
+
+import numpy as np
 
 from qgis import processing
 from qgis.PyQt.QtCore import QCoreApplication
@@ -31,12 +25,27 @@ from qgis.core import (
     QgsProcessingParameterCrs,
     QgsProcessingParameterRasterDestination)
 
+# The shared helpers live next to this script in the scripts folder
+_SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+if _SCRIPT_FOLDER not in sys.path:
+    sys.path.append(_SCRIPT_FOLDER)
+
+from pcraster_blockio import (
+    RasterWriter,
+    check_same_grid,
+    open_raster,
+    read_rows)
+from pcraster_ldd import StreamNetwork
+from pcraster_profiling import Profile
+
 #from pcraster_tools.processing.algorithm import PCRasterAlgorithm
 
 class PCRasterHandAlgorithm(QgsProcessingAlgorithm):
     INPUT_DEM = 'INPUT1'
     INPUT_DRAINAGE = 'INPUT2'
     OUTPUT_RASTER = 'OUTPUT'
+    OUTPUT_DISTANCE = 'OUTPUT_DISTANCE'
+    OUTPUT_DRAINAGE_ID = 'OUTPUT_DRAINAGE_ID'
 
     def tr(self, string):
         """
@@ -90,12 +99,15 @@ class PCRasterHandAlgorithm(QgsProcessingAlgorithm):
         return self.tr(
             """Calculates Height Above Nearest Drainage (HAND)
           
+            Every cell is compared with the first drainage cell on its flow path over the LDD derived from the DEM. Cells that do not drain to a drainage cell get missing values.
           
             Parameters:
             
             * <b>Input DEM layer</b> (required) - scalar raster layer
             * <b>Input drainage layer</b> (required) - boolean raster layer
             * <b>Output HAND layer</b> (required) - Output layer with Height Above the Nearest Drainage
+            * <b>Output distance to drainage layer</b> (optional) - scalar raster layer with the distance to the drainage cell along the flow path
+            * <b>Output nearest drainage layer</b> (optional) - nominal raster layer with the number of the drainage cell, numbered like uniqueid
             """
         )
 
@@ -127,21 +139,78 @@ class PCRasterHandAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterRasterDestination(
+                self.OUTPUT_DISTANCE,
+                self.tr("Output distance to drainage raster layer"),
+                optional=True,
+                createByDefault=False
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterRasterDestination(
+                self.OUTPUT_DRAINAGE_ID,
+                self.tr("Output nearest drainage raster layer"),
+                optional=True,
+                createByDefault=False
+            )
+        )
+
     def processAlgorithm(self, parameters, context, feedback):
+        from pcraster import readmap, setclone, lddcreate, pcr2numpy
+
         input_dem = self.parameterAsRasterLayer(parameters, self.INPUT_DEM, context)
         input_drainage = self.parameterAsRasterLayer(parameters, self.INPUT_DRAINAGE, context)
 
-        setclone(input_dem.dataProvider().dataSourceUri())
-        DEM = readmap(input_dem.dataProvider().dataSourceUri())
-        drainage = readmap(input_drainage.dataProvider().dataSourceUri())
-        flowdir = lddcreate(DEM,1e31,1e31,1e31,1e31)
-        drainageID = nominal(uniqueid(drainage))
-        catchments = subcatchment(flowdir,drainageID)
-        drainageZ = areaminimum(DEM,catchments)
-        hand = DEM - drainageZ
-        outputFilePath = self.parameterAsOutputLayer(parameters, self.OUTPUT_RASTER, context)
-        report(hand,outputFilePath)
-        results = {}
-        results[self.OUTPUT_RASTER] = outputFilePath
+        dem_ds = open_raster(input_dem.dataProvider().dataSourceUri())
+        drainage_ds = open_raster(input_drainage.dataProvider().dataSourceUri())
+        check_same_grid(dem_ds, drainage_ds)
+        with Profile(self.name(), feedback) as profile:
+            profile.raster(dem_ds)
+
+            with profile.phase('read'):
+                setclone(input_dem.dataProvider().dataSourceUri())
+                DEM = readmap(input_dem.dataProvider().dataSourceUri())
+            with profile.phase('lddcreate'):
+                flowdir = lddcreate(DEM,1e31,1e31,1e31,1e31)
+            if feedback.isCanceled():
+                return {}
+
+            # Hand the elevation of every drainage cell up its flow paths in one
+            # pass instead of labelling subcatchments and taking zonal minima
+            with profile.phase('compute'):
+                ldd = pcr2numpy(flowdir, 0)
+                network = StreamNetwork(ldd, ldd != 0, dem_ds.GetGeoTransform())
+                dem, dem_valid = read_rows(dem_ds, 0, dem_ds.RasterYSize)
+                drainage, drainage_valid = read_rows(drainage_ds, 0, drainage_ds.RasterYSize)
+                drainage = (drainage_valid & dem_valid & (drainage != 0)).ravel()
+                target, distance = network.nearest_drainage(drainage)
+                drains = target >= 0
+                dem = dem.ravel().astype(np.float64)
+                hand = np.zeros(dem.shape)
+                hand[drains] = dem[drains] - dem[target[drains]]
+                drains = drains.reshape(ldd.shape)
+
+            results = {}
+            with profile.phase('write'):
+                outputFilePath = self.parameterAsOutputLayer(parameters, self.OUTPUT_RASTER, context)
+                writer = RasterWriter(outputFilePath, dem_ds, 'VS_SCALAR')
+                writer.write(hand.reshape(ldd.shape), drains, 0)
+                results[self.OUTPUT_RASTER] = writer.close()
+
+                output_distance = self.parameterAsOutputLayer(parameters, self.OUTPUT_DISTANCE, context)
+                if output_distance:
+                    writer = RasterWriter(output_distance, dem_ds, 'VS_SCALAR')
+                    writer.write(distance.reshape(ldd.shape), drains, 0)
+                    results[self.OUTPUT_DISTANCE] = writer.close()
+
+                output_drainage_id = self.parameterAsOutputLayer(parameters, self.OUTPUT_DRAINAGE_ID, context)
+                if output_drainage_id:
+                    # Drainage cells are numbered from 1 row by row, like uniqueid
+                    numbers = np.cumsum(drainage)
+                    writer = RasterWriter(output_drainage_id, dem_ds, 'VS_NOMINAL')
+                    writer.write(numbers[np.maximum(target, 0)].reshape(ldd.shape), drains, 0)
+                    results[self.OUTPUT_DRAINAGE_ID] = writer.close()
 
         return results
@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+import os
+import re
+import sys
+
+import numpy as np
+
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (
+    QgsCoordinateTransform,
+    QgsFeatureRequest,
+    QgsProcessing,
+    QgsProcessingAlgorithm,
+    QgsProcessingException,
+    QgsProcessingParameterBoolean,
+    QgsProcessingParameterEnum,
+    QgsProcessingParameterFeatureSource,
+    QgsProcessingParameterField,
+    QgsProcessingParameterFile,
+    QgsProcessingParameterFolderDestination,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterRasterLayer)
+
+# The shared helpers live next to this script in the scripts folder
+_SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+if _SCRIPT_FOLDER not in sys.path:
+    sys.path.append(_SCRIPT_FOLDER)
+
+from pcraster_blockio import (
+    RasterWriter,
+    map_ordered,
+    open_raster,
+    read_rows,
+    row_windows)
+from pcraster_cache import DiskCache, default_cache_folder
+from pcraster_interpolate import (
+    PointIndex,
+    WeightsWriter,
+    idw_all_points,
+    idw_weights,
+    load_weights,
+    weights_key)
+from pcraster_profiling import Profile
+
+
+def read_points(source, fields, crs, transform_context):
+    """
+    Returns the x and y coordinates of the points of a feature source in a
+    CRS and a (points, fields) array of their values, NaN where a value is
+    NULL or not numeric.
+    """
+    transform = QgsCoordinateTransform(source.sourceCrs(), crs, transform_context)
+    request = QgsFeatureRequest().setSubsetOfAttributes(fields, source.fields())
+    x, y, values = [], [], []
+    for feature in source.getFeatures(request):
+        if not feature.hasGeometry():
+            continue
+        row = []
+        for field in fields:
+            try:
+                row.append(float(feature[field]))
+            except (TypeError, ValueError):
+                row.append(np.nan)
+        geometry = feature.geometry()
+        for point in geometry.asMultiPoint() if geometry.isMultipart() else [geometry.asPoint()]:
+            point = transform.transform(point)
+            x.append(point.x())
+            y.append(point.y())
+            values.append(row)
+    return np.array(x), np.array(y), np.array(values, dtype=np.float64).reshape(len(values), len(fields))
+
+
+class PCRasterIDWAlgorithm(QgsProcessingAlgorithm):
+    """
+    Interpolates one or more value fields of a point layer with inverse
+    distance weighting, finding the neighbours of every cell on a KD-tree.
+    """
+
+    INPUT_MASK = 'INPUT'
+    INPUT_POINTS = 'INPUT_POINTS'
+    INPUT_FIELDS = 'INPUT_FIELDS'
+    INPUT_IDP = 'INPUT_IDP'
+    INPUT_UNITS = 'INPUT_UNITS'
+    INPUT_RADIUS = 'INPUT_RADIUS'
+    INPUT_MAXNR = 'INPUT_MAXNR'
+    INPUT_CACHE = 'INPUT_CACHE'
+    INPUT_CACHE_FOLDER = 'INPUT_CACHE_FOLDER'
+    INPUT_CACHE_SIZE = 'INPUT_CACHE_SIZE'
+    OUTPUT_FOLDER = 'OUTPUT_FOLDER'
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return PCRasterIDWAlgorithm()
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'idwpoints'
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr('inverse distance interpolation of point fields')
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return self.tr('PCRaster User Scripts')
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'pcrasteruser'
+
+    def shortHelpString(self):
+        """
+        Returns a localised short helper string for the algorithm. This string
+        should provide a basic description about what the algorithm does and the
+        parameters and outputs associated with it..
+        """
+        return self.tr(
+            """Interpolate value fields of a point layer using inverse distance weighting
+
+            Like inversedistance, but the neighbours of every cell are found on a KD-tree instead of by scanning all points, and the cells are processed in row bands in parallel. The weights of a band are calculated once and reused for every selected field, so many readings of the same stations, e.g. one field per hour, are interpolated in one run. When all points are used, with radius 0 and no maximum number of points, no weights are stored: the averages are calculated directly for blocks of cells. Points with a NULL value in a field are left out for that field only; as in inversedistance, the maximum number of points counts only points with a value. To find them, the KD-tree search returns as many more neighbours as a field has NULL values at most, so fields with many NULL values make the search slower. SciPy is used for the KD-tree when it is installed; without it the neighbours are found by brute force.
+
+            With the weights cache, the sparse weights of every cell are stored on disk, keyed by the mask, the station locations, the power, the radius, the maximum number of points and, with a maximum number of points, the largest number of NULL values in a field. A later run with the same stations, e.g. the next timestep, reads them memory-mapped and only multiplies them with the new values; a run whose fields have a different largest number of NULL values calculates new weights.
+
+            Parameters:
+
+            * <b>Mask layer</b> (required) - boolean raster layer; cells that are true are interpolated
+            * <b>Points</b> (required) - point layer with the stations
+            * <b>Value fields</b> (required) - numeric fields to interpolate
+            * <b>Power</b> (required) - power of the weight function (default 2)
+            * <b>Units</b> (required) - unit of radius in map units or cells
+            * <b>Radius</b> (required) - select only the points at a distance less or equal to the cell. Default 0 includes all points.
+            * <b>Maximum number of closest points</b> (required) - the maximum number of points used in the computation. Default 0 includes all points.
+            * <b>Cache the interpolation weights</b> (optional) - reuse the weights of earlier runs with the same mask and stations; needs a radius or a maximum number of closest points
+            * <b>Weights cache folder</b> (optional) - folder of the weights cache; by default in the QGIS profile folder
+            * <b>Weights cache size (MB)</b> (optional) - the least recently used weights are removed beyond this size
+            * <b>Output folder</b> (required) - folder with a scalar raster &lt;field&gt;.tif per value field
+            """
+        )
+
+    def initAlgorithm(self, config=None):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUT_MASK,
+                self.tr('Mask layer')
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.INPUT_POINTS,
+                self.tr('Points'),
+                [QgsProcessing.TypeVectorPoint]
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterField(
+                self.INPUT_FIELDS,
+                self.tr('Value fields'),
+                parentLayerParameterName=self.INPUT_POINTS,
+                type=QgsProcessingParameterField.Numeric,
+                allowMultiple=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.INPUT_IDP,
+                self.tr('Power'),
+                type=QgsProcessingParameterNumber.Double,
+                defaultValue=2
+            )
+        )
+
+        self.unitoption = [self.tr('Map units'), self.tr('Cells')]
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.INPUT_UNITS,
+                self.tr('Units'),
+                self.unitoption,
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.INPUT_RADIUS,
+                self.tr('Radius'),
+                type=QgsProcessingParameterNumber.Double,
+                minValue=0,
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.INPUT_MAXNR,
+                self.tr('Maximum number of closest points'),
+                minValue=0,
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.INPUT_CACHE,
+                self.tr('Cache the interpolation weights'),
+                defaultValue=False
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.INPUT_CACHE_FOLDER,
+                self.tr('Weights cache folder'),
+                behavior=QgsProcessingParameterFile.Folder,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.INPUT_CACHE_SIZE,
+                self.tr('Weights cache size (MB)'),
+                minValue=0,
+                defaultValue=2048
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                self.OUTPUT_FOLDER,
+                self.tr('Output folder')
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+
+        input_mask = self.parameterAsRasterLayer(parameters, self.INPUT_MASK, context)
+        mask_ds = open_raster(input_mask.dataProvider().dataSourceUri())
+        with Profile(self.name(), feedback) as profile:
+            profile.raster(mask_ds)
+            geotransform = mask_ds.GetGeoTransform()
+            with profile.phase('read mask'):
+                mask, mask_valid = read_rows(mask_ds, 0, mask_ds.RasterYSize)
+                mask = mask_valid & (mask != 0)
+
+            fields = self.parameterAsFields(parameters, self.INPUT_FIELDS, context)
+            if not fields:
+                raise QgsProcessingException('Select at least one value field')
+            source = self.parameterAsSource(parameters, self.INPUT_POINTS, context)
+            with profile.phase('read points'):
+                x, y, values = read_points(source, fields, input_mask.crs(), context.transformContext())
+            feedback.pushInfo('Points: {}'.format(len(x)))
+
+            power = self.parameterAsDouble(parameters, self.INPUT_IDP, context)
+            radius = self.parameterAsDouble(parameters, self.INPUT_RADIUS, context)
+            if self.parameterAsEnum(parameters, self.INPUT_UNITS, context) == 1:
+                radius *= abs(geotransform[1])
+            maxnr = self.parameterAsInt(parameters, self.INPUT_MAXNR, context)
+            index = PointIndex(x, y)
+            # Without a radius or a maximum number of points every cell has a
+            # weight for every point, too many to store
+            all_points = radius <= 0 and (maxnr <= 0 or maxnr >= len(x))
+            # With a maximum number of points, as many more neighbours are
+            # searched as a field has NULL values at most, so every cell still
+            # finds the closest points with a value
+            spare = int(np.isnan(values).sum(axis=0).max(initial=0)) if maxnr > 0 else 0
+
+            output_folder = self.parameterAsString(parameters, self.OUTPUT_FOLDER, context)
+            os.makedirs(output_folder, exist_ok=True)
+            writers = [RasterWriter(os.path.join(output_folder, re.sub(r'[^\w.-]', '_', field) + '.tif'),
+                                    mask_ds, 'VS_SCALAR')
+                       for field in fields]
+
+            # Cached weights cover all mask cells in row order, so the weights of
+            # a band start after the mask cells of the rows above it
+            first_cell = np.r_[0, np.cumsum(mask.sum(axis=1))]
+            cache, cached, weights_writer = None, None, None
+            if self.parameterAsBoolean(parameters, self.INPUT_CACHE, context):
+                if all_points:
+                    raise QgsProcessingException('Caching the interpolation weights needs a radius or a maximum number '
+                                                 'of closest points below the number of points')
+                cache = DiskCache(self.parameterAsFile(parameters, self.INPUT_CACHE_FOLDER, context) or
+                                  default_cache_folder('idw'),
+                                  self.parameterAsInt(parameters, self.INPUT_CACHE_SIZE, context) * 1024 * 1024)
+                key = weights_key(mask, geotransform, x, y, power, radius, maxnr, spare)
+                cached = load_weights(cache, key)
+                if cached is None:
+                    weights_writer = WeightsWriter(cache)
+                else:
+                    feedback.pushInfo('Using cached interpolation weights')
+
+            def interpolate(window):
+                yoff, ysize = window
+                cells = np.flatnonzero(mask[yoff:yoff + ysize])
+                if all_points:
+                    rows, cols = np.divmod(cells, mask.shape[1])
+                    return cells, None, idw_all_points(index,
+                                                       geotransform[0] + (cols + 0.5) * geotransform[1],
+                                                       geotransform[3] + (yoff + rows + 0.5) * geotransform[5],
+                                                       values, power)
+                if cached is not None:
+                    weights = cached.rows(first_cell[yoff], first_cell[yoff + ysize])
+                else:
+                    rows, cols = np.divmod(cells, mask.shape[1])
+                    weights = idw_weights(index,
+                                          geotransform[0] + (cols + 0.5) * geotransform[1],
+                                          geotransform[3] + (yoff + rows + 0.5) * geotransform[5],
+                                          power, radius, maxnr, spare)
+                return cells, weights, weights.apply(values, maxnr)
+
+            with profile.phase('interpolate'):
+                windows = row_windows(mask_ds)
+                for i, (cells, weights, result) in enumerate(map_ordered(interpolate, windows)):
+                    if feedback.isCanceled():
+                        if weights_writer is not None:
+                            weights_writer.discard()
+                        return {}
+                    if weights_writer is not None:
+                        weights_writer.append(weights)
+                    yoff, ysize = windows[i]
+                    for column, writer in enumerate(writers):
+                        band = np.full((ysize, mask.shape[1]), np.nan)
+                        band.flat[cells] = result[:, column]
+                        writer.write(band, ~np.isnan(band), yoff)
+                    feedback.setProgress(100 * (i + 1) / len(windows))
+                if weights_writer is not None:
+                    weights_writer.close(key)
+
+                for writer in writers:
+                    writer.close()
+
+            results = {}
+            results[self.OUTPUT_FOLDER] = output_folder
+
+            return results
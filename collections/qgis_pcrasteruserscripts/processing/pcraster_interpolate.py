@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+# Point to raster interpolation with neighbour queries on a KD-tree. The
+# neighbours of the target cells are stored as row-compressed (CSR) sparse
+# weights, so one set of weights serves any number of value columns of the
+# same points. Weights can be stored in a DiskCache as raw CSR arrays that
+# are memory-mapped when they are used again. This module contains no
+# algorithm, so the Processing script provider skips it.
+
+import hashlib
+import os
+
+import numpy as np
+
+# Number of target to point distances per block when SciPy is not installed
+# and neighbours are found by brute force, or when every point is used
+BRUTE_FORCE_DISTANCES = 1 << 24
+
+# Arrays of cached weights and their data types
+WEIGHT_ARRAYS = (('indptr', np.int64), ('indices', np.int64), ('data', np.float64))
+
+
+class SparseWeights:
+    """
+    Weights of the points for every target cell in CSR layout: the weights
+    of target i are data[indptr[i]:indptr[i + 1]] for the points
+    indices[indptr[i]:indptr[i + 1]]. An infinite weight marks a point on
+    top of the target.
+    """
+
+    def __init__(self, indptr, indices, data):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def rows(self, start, stop):
+        """
+        Returns the weights of the targets from start up to stop. Memory
+        mapped arrays are only read for those targets.
+        """
+        first, last = int(self.indptr[start]), int(self.indptr[stop])
+        return SparseWeights(np.asarray(self.indptr[start:stop + 1]) - first,
+                             self.indices[first:last], self.data[first:last])
+
+    def apply(self, values, maxnr=0):
+        """
+        Returns the weighted average of the point values for every target,
+        for a (points, columns) array of values with NaN for missing values.
+        Missing values are left out of the average; targets without any
+        defined value get NaN. Unless maxnr is 0, only the maxnr nearest
+        points with a defined value are used, which needs the points of
+        every target ordered by distance. A target on top of one or more
+        points with a defined value only gets those points.
+        """
+        values = np.asarray(values, dtype=np.float64).reshape(len(values), -1)
+        target = np.repeat(np.arange(len(self)), np.diff(self.indptr))
+        exact = np.isinf(self.data)
+        result = np.empty((len(self), values.shape[1]))
+        for column in range(values.shape[1]):
+            neighbour_values = values[self.indices, column]
+            defined = ~np.isnan(neighbour_values)
+            if maxnr > 0:
+                # Number of defined points of the target up to and including this one
+                rank = np.cumsum(defined)
+                rank -= np.r_[0, rank][self.indptr[:-1]][target]
+                defined &= rank <= maxnr
+            on_point = np.bincount(target[exact & defined], minlength=len(self)) > 0
+            weights = np.where(defined, np.where(on_point[target], exact, self.data), 0.0)
+            total = np.bincount(target, weights * np.where(defined, neighbour_values, 0.0), len(self))
+            weight = np.bincount(target, weights, len(self))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result[:, column] = np.where(weight > 0, total / weight, np.nan)
+        return result
+
+
+class PointIndex:
+    """
+    Neighbour queries on point coordinates. A KD-tree is used when SciPy is
+    installed; otherwise distances are calculated in blocks by brute force.
+    SciPy is only imported here, so loading the scripts does not import it.
+    """
+
+    def __init__(self, x, y):
+        self.points = np.column_stack([x, y]).astype(np.float64)
+        try:
+            from scipy.spatial import cKDTree
+        except ImportError:
+            cKDTree = None
+        self.tree = cKDTree(self.points) if cKDTree is not None and len(self.points) else None
+
+    def neighbours(self, x, y, radius=0, maxnr=0):
+        """
+        Returns the CSR indptr, point indices and distances of the points
+        within radius of every target, or at any distance when radius is 0,
+        limited to the maxnr nearest points unless maxnr is 0. With maxnr,
+        the points of every target are ordered by distance.
+        """
+        targets = np.column_stack([x, y]).astype(np.float64)
+        radius = radius if radius > 0 else np.inf
+        if len(self.points) == 0 or len(targets) == 0:
+            return np.zeros(len(targets) + 1, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+        if self.tree is None:
+            return self._brute_force(targets, radius, maxnr)
+
+        if maxnr > 0:
+            k = min(int(maxnr), len(self.points))
+            distances, indices = self.tree.query(targets, k=k, distance_upper_bound=radius)
+            return _compress(distances.reshape(len(targets), k), indices.reshape(len(targets), k))
+        if np.isfinite(radius):
+            found = self.tree.query_ball_point(targets, radius)
+            counts = np.fromiter((len(points) for points in found), dtype=np.int64, count=len(found))
+            indices = np.fromiter((i for points in found for i in points), dtype=np.int64, count=counts.sum())
+            target = np.repeat(np.arange(len(targets)), counts)
+            distances = np.hypot(*(targets[target] - self.points[indices]).T)
+            return np.r_[0, np.cumsum(counts)], indices, distances
+        # Every point is a neighbour of every target
+        return self._brute_force(targets, radius, maxnr)
+
+    def _brute_force(self, targets, radius, maxnr):
+        block = max(BRUTE_FORCE_DISTANCES // len(self.points), 1)
+        parts = []
+        for start in range(0, len(targets), block):
+            part = targets[start:start + block]
+            distances = np.hypot(part[:, None, 0] - self.points[None, :, 0], part[:, None, 1] - self.points[None, :, 1])
+            indices = np.broadcast_to(np.arange(len(self.points)), distances.shape)
+            if 0 < maxnr < len(self.points):
+                nearest = np.argpartition(distances, int(maxnr) - 1, axis=1)[:, :int(maxnr)]
+                nearest = np.take_along_axis(nearest, np.argsort(np.take_along_axis(distances, nearest, axis=1),
+                                                                 axis=1, kind='stable'), axis=1)
+                distances = np.take_along_axis(distances, nearest, axis=1)
+                indices = nearest
+            parts.append(_compress(np.where(distances <= radius, distances, np.inf), indices))
+        indptr = np.r_[0, np.cumsum(np.concatenate([np.diff(part[0]) for part in parts]))]
+        return indptr, np.concatenate([part[1] for part in parts]), np.concatenate([part[2] for part in parts])
+
+
+def _compress(distances, indices):
+    """
+    Returns the CSR layout of (targets, k) distance and index arrays, in
+    which an infinite distance marks a missing neighbour.
+    """
+    found = np.isfinite(distances)
+    return np.r_[0, np.cumsum(found.sum(axis=1))], indices[found].astype(np.int64), distances[found]
+
+
+def idw_weights(index, x, y, power=2.0, radius=0, maxnr=0, spare=0):
+    """
+    Returns the inverse distance weights of the points of a PointIndex for
+    target cells at x, y, like inversedistance: the weight of a point is one
+    over its distance to the power, and infinite for a point on top of the
+    target. With maxnr, spare more neighbours than maxnr are kept so that
+    apply() can still find maxnr points with a defined value when up to
+    spare of them are missing.
+    """
+    nearest = maxnr + spare if maxnr > 0 else 0
+    indptr, indices, distances = index.neighbours(x, y, radius, nearest)
+    with np.errstate(divide='ignore'):
+        data = np.where(distances == 0, np.inf, distances ** -float(power))
+    return SparseWeights(indptr, indices, data)
+
+
+def idw_all_points(index, x, y, values, power=2.0):
+    """
+    Returns the inverse distance weighted average of the values of all
+    points of a PointIndex for every target at x, y, for a (points, columns)
+    array of values with NaN for missing values, like idw_weights() with no
+    radius and no maximum number of points followed by apply(). The weights
+    are never stored: the averages are calculated for blocks of targets, so
+    memory does not grow with the number of targets times points.
+    """
+    values = np.asarray(values, dtype=np.float64).reshape(len(index.points), -1)
+    targets = np.column_stack([x, y]).astype(np.float64)
+    result = np.full((len(targets), values.shape[1]), np.nan)
+    if len(index.points) == 0:
+        return result
+    defined = (~np.isnan(values)).astype(np.float64)
+    filled = np.where(defined > 0, values, 0.0)
+    block = max(BRUTE_FORCE_DISTANCES // len(index.points), 1)
+    for start in range(0, len(targets), block):
+        part = targets[start:start + block]
+        weights = np.hypot(part[:, None, 0] - index.points[None, :, 0], part[:, None, 1] - index.points[None, :, 1])
+        # A target on top of one or more points with a defined value only
+        # gets those points
+        exact = (weights == 0).astype(np.float64)
+        with np.errstate(divide='ignore'):
+            np.power(weights, -float(power), out=weights)
+        weights[exact > 0] = 0.0
+        total = weights @ filled
+        weight = weights @ defined
+        exact_total = exact @ filled
+        exact_weight = exact @ defined
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result[start:start + block] = np.where(exact_weight > 0, exact_total / exact_weight,
+                                                   np.where(weight > 0, total / weight, np.nan))
+    return result
+
+
+def nearest_points(index, x, y):
+    """
+    Returns the index of the nearest point of a PointIndex for every target
+    at x, y and the distance to it, or -1 and NaN when there are no points.
+    """
+    indptr, indices, distances = index.neighbours(x, y, maxnr=1)
+    nearest = np.full(len(indptr) - 1, -1, dtype=np.int64)
+    distance = np.full(len(indptr) - 1, np.nan)
+    found = np.diff(indptr) > 0
+    nearest[found] = indices
+    distance[found] = distances
+    return nearest, distance
+
+
+def weights_key(mask, geotransform, x, y, power, radius, maxnr, spare=0):
+    """
+    Returns the cache key of the inverse distance weights of the true cells
+    of a mask array for the points at x, y.
+    """
+    points = np.column_stack([x, y]).astype(np.float64)
+    return ('idw',
+            hashlib.sha1(np.packbits(mask).tobytes()).hexdigest(), mask.shape, tuple(geotransform),
+            hashlib.sha1(points.tobytes()).hexdigest(), float(power), float(radius), int(maxnr), int(spare))
+
+
+def load_weights(cache, key):
+    """
+    Returns the cached weights of a key with memory-mapped arrays, or None
+    when they are not cached.
+    """
+    paths = [cache.get(key + (name,)) for name, _ in WEIGHT_ARRAYS]
+    if None in paths:
+        return None
+    return SparseWeights(*[np.memmap(path, dtype=dtype, mode='r') if os.path.getsize(path) else np.zeros(0, dtype)
+                           for path, (_, dtype) in zip(paths, WEIGHT_ARRAYS)])
+
+
+class WeightsWriter:
+    """
+    Appends the weights of consecutive blocks of targets to temporary files
+    in a cache and adds them to the cache under a key when closed.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.paths = [cache.temporary_path() for _ in WEIGHT_ARRAYS]
+        self.files = [open(path, 'wb') for path in self.paths]
+        self.offset = 0
+        np.zeros(1, dtype=np.int64).tofile(self.files[0])
+
+    def append(self, weights):
+        np.asarray(weights.indptr[1:] + self.offset, dtype=np.int64).tofile(self.files[0])
+        np.asarray(weights.indices, dtype=np.int64).tofile(self.files[1])
+        np.asarray(weights.data, dtype=np.float64).tofile(self.files[2])
+        self.offset += int(weights.indptr[-1])
+
+    def close(self, key):
+        for weights_file in self.files:
+            weights_file.close()
+        cached = []
+        for (name, _), path in zip(WEIGHT_ARRAYS, self.paths):
+            cached.append(self.cache.put(key + (name,), path, keep=tuple(cached) + tuple(self.paths)))
+        return cached
+
+    def discard(self):
+        for weights_file, path in zip(self.files, self.paths):
+            weights_file.close()
+            os.remove(path)
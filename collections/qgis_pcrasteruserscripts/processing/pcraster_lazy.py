@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+# Lazy expressions over PCRaster maps. Local operators only record a graph;
+# when a result is saved, every chain of local operators is fused into one
+# kernel that is evaluated block by block with numexpr (or NumPy when numexpr
+# is not installed). Only the inputs of global operators such as spread,
+# accuflux or horizontan, which are run by PCRaster, and the saved results
+# are materialised as full maps. Missing values are NaN inside the kernels.
+# Building expressions does not need PCRaster; it is imported when a global
+# operator or a PCRaster field is evaluated. This module contains no
+# algorithm, so the Processing script provider skips it.
+
+import numpy as np
+
+from pcraster_blockio import (
+    RasterWriter,
+    open_raster,
+    read_rows,
+    row_windows,
+    valuescale)
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+# numexpr handles at most this many input arrays per kernel
+MAX_KERNEL_INPUTS = 30
+
+# PCRaster value scale types by GDAL value scale
+PCRASTER_TYPES = {
+    'VS_BOOLEAN': 'Boolean',
+    'VS_NOMINAL': 'Nominal',
+    'VS_ORDINAL': 'Ordinal',
+    'VS_SCALAR': 'Scalar',
+    'VS_DIRECTION': 'Directional',
+    'VS_LDD': 'Ldd',
+}
+
+NUMPY_FUNCTIONS = {
+    'where': np.where,
+    'sqrt': np.sqrt,
+    'exp': np.exp,
+    'log': np.log,
+    'log10': np.log10,
+    'abs': np.abs,
+    'sin': np.sin,
+    'cos': np.cos,
+    'tan': np.tan,
+    'arcsin': np.arcsin,
+    'arccos': np.arccos,
+    'arctan': np.arctan,
+    'floor': np.floor,
+    'ceil': np.ceil,
+    'nan': np.nan,
+}
+
+
+def _wrap(value):
+    if isinstance(value, Expression):
+        return value
+    return Expression('constant', value=float(value), valuescale='VS_SCALAR')
+
+
+class Expression:
+    """
+    Node of a lazy expression graph. Leaves are rasters on disk, constants or
+    materialised arrays; other nodes are local or global operators.
+    """
+
+    __hash__ = object.__hash__
+
+    def __init__(self, kind, *args, **attributes):
+        self.kind = kind
+        self.args = args
+        self.value = attributes.get('value')
+        self.template = attributes.get('template')
+        self.valuescale = attributes.get('valuescale', 'VS_SCALAR')
+        self.function = attributes.get('function')
+
+    def _binary(self, template, other, valuescale='VS_SCALAR', reverse=False):
+        other = _wrap(other)
+        args = (other, self) if reverse else (self, other)
+        return Expression('local', *args, template=template, valuescale=valuescale)
+
+    def __add__(self, other):
+        return self._binary('({0} + {1})', other)
+
+    def __radd__(self, other):
+        return self._binary('({0} + {1})', other, reverse=True)
+
+    def __sub__(self, other):
+        return self._binary('({0} - {1})', other)
+
+    def __rsub__(self, other):
+        return self._binary('({0} - {1})', other, reverse=True)
+
+    def __mul__(self, other):
+        return self._binary('({0} * {1})', other)
+
+    def __rmul__(self, other):
+        return self._binary('({0} * {1})', other, reverse=True)
+
+    def __truediv__(self, other):
+        return self._binary('where({1} == 0, nan, {0} / {1})', other)
+
+    def __rtruediv__(self, other):
+        return self._binary('where({1} == 0, nan, {0} / {1})', other, reverse=True)
+
+    def __pow__(self, other):
+        return self._binary('({0} ** {1})', other)
+
+    def __rpow__(self, other):
+        return self._binary('({0} ** {1})', other, reverse=True)
+
+    def __neg__(self):
+        return Expression('local', self, template='(-{0})', valuescale=self.valuescale)
+
+    def _compare(self, operator, other):
+        return self._binary(
+            'where(({0} != {0}) | ({1} != {1}), nan, where({0} %s {1}, 1.0, 0.0))' % operator,
+            other, 'VS_BOOLEAN')
+
+    def __lt__(self, other):
+        return self._compare('<', other)
+
+    def __le__(self, other):
+        return self._compare('<=', other)
+
+    def __gt__(self, other):
+        return self._compare('>', other)
+
+    def __ge__(self, other):
+        return self._compare('>=', other)
+
+    def __eq__(self, other):
+        return self._compare('==', other)
+
+    def __ne__(self, other):
+        return self._compare('!=', other)
+
+    def __and__(self, other):
+        return self._binary(
+            'where(({0} != {0}) | ({1} != {1}), nan, where(({0} != 0) & ({1} != 0), 1.0, 0.0))',
+            other, 'VS_BOOLEAN')
+
+    def __or__(self, other):
+        return self._binary(
+            'where(({0} != {0}) | ({1} != {1}), nan, where(({0} != 0) | ({1} != 0), 1.0, 0.0))',
+            other, 'VS_BOOLEAN')
+
+    def __invert__(self):
+        return Expression('local', self, template='where({0} != {0}, nan, where({0} == 0, 1.0, 0.0))',
+                          valuescale='VS_BOOLEAN')
+
+    def save(self, path, clone, valuescale=None, feedback=None):
+        """
+        Evaluates the expression block by block and writes it to path on the
+        grid of the clone raster. Returns the path.
+        """
+        template = open_raster(clone)
+        kernel = Kernel(self, template)
+        writer = RasterWriter(path, template, valuescale or self.valuescale)
+        windows = row_windows(template)
+        for i, (yoff, ysize) in enumerate(windows):
+            if feedback is not None:
+                if feedback.isCanceled():
+                    break
+                feedback.setProgress(100 * (i + 1) / len(windows))
+            values = kernel.evaluate(yoff, ysize)
+            writer.write(values, ~np.isnan(values), yoff)
+        return writer.close()
+
+
+def raster(path):
+    """
+    Returns a lazy leaf reading a raster on disk.
+    """
+    return Expression('raster', value=path, valuescale=valuescale(open_raster(path)))
+
+
+def field(pcraster_field, scale='VS_SCALAR'):
+    """
+    Returns a lazy leaf for a PCRaster field that was computed eagerly.
+    """
+    return Expression('array', value=_to_array(pcraster_field), valuescale=scale)
+
+
+def array(values, scale='VS_SCALAR', missing=None):
+    """
+    Returns a lazy leaf for a NumPy array on the grid of the clone. Cells
+    equal to missing become missing values.
+    """
+    values = values.astype(np.float64)
+    if missing is not None:
+        values[values == missing] = np.nan
+    return Expression('array', value=values, valuescale=scale)
+
+
+def _to_array(pcraster_field):
+    import pcraster
+
+    return pcraster.pcr2numpy(pcraster.scalar(pcraster_field), np.nan).astype(np.float64)
+
+
+def local(template, *args, valuescale='VS_SCALAR'):
+    """
+    Returns a local operator node. The template is a numexpr expression with
+    {0}, {1}, ... for the arguments.
+    """
+    return Expression('local', *[_wrap(a) for a in args], template=template, valuescale=valuescale)
+
+
+def ifthenelse(condition, true_expression, false_expression):
+    true_expression = _wrap(true_expression)
+    return local('where({0} != {0}, nan, where({0} != 0, {1}, {2}))',
+                 condition, true_expression, false_expression, valuescale=true_expression.valuescale)
+
+
+def ifthen(condition, expression):
+    expression = _wrap(expression)
+    return local('where({0} == 1, {1}, nan)', condition, expression, valuescale=expression.valuescale)
+
+
+def cover(expression, other):
+    expression = _wrap(expression)
+    return local('where({0} == {0}, {0}, {1})', expression, other, valuescale=expression.valuescale)
+
+
+def scalar(expression):
+    return local('{0}', expression, valuescale='VS_SCALAR')
+
+
+def boolean(expression):
+    return local('where({0} != {0}, nan, where({0} != 0, 1.0, 0.0))', expression, valuescale='VS_BOOLEAN')
+
+
+def max(expression, other):
+    return local('where(({0} != {0}) | ({1} != {1}), nan, where({0} > {1}, {0}, {1}))', expression, other)
+
+
+def min(expression, other):
+    return local('where(({0} != {0}) | ({1} != {1}), nan, where({0} < {1}, {0}, {1}))', expression, other)
+
+
+def sqrt(expression):
+    return local('sqrt({0})', expression)
+
+
+def exp(expression):
+    return local('exp({0})', expression)
+
+
+def ln(expression):
+    return local('log({0})', expression)
+
+
+def log10(expression):
+    return local('log10({0})', expression)
+
+
+def sin(expression):
+    return local('sin({0} * 0.017453292519943295)', expression)
+
+
+def cos(expression):
+    return local('cos({0} * 0.017453292519943295)', expression)
+
+
+def tan(expression):
+    return local('tan({0} * 0.017453292519943295)', expression)
+
+
+# Like PCRaster, the inverse functions return directional values in degrees
+def asin(expression):
+    return local('(arcsin({0}) * 57.29577951308232 + 360.0) % 360.0', expression, valuescale='VS_DIRECTION')
+
+
+def acos(expression):
+    return local('(arccos({0}) * 57.29577951308232 + 360.0) % 360.0', expression, valuescale='VS_DIRECTION')
+
+
+def atan(expression):
+    return local('(arctan({0}) * 57.29577951308232 + 360.0) % 360.0', expression, valuescale='VS_DIRECTION')
+
+
+def apply(function, *args, valuescale='VS_SCALAR'):
+    """
+    Returns a node for a global PCRaster operator. Expression arguments are
+    materialised as PCRaster fields before the operator runs; other
+    arguments are passed on unchanged.
+    """
+    return Expression('global', *args, function=function, valuescale=valuescale)
+
+
+def to_field(expression, clone):
+    """
+    Evaluates an expression to a PCRaster field. PCRaster must already use
+    the clone raster.
+    """
+    import pcraster
+
+    values = Kernel(expression, open_raster(clone)).evaluate_full()
+    scale = expression.valuescale
+    data_type = getattr(pcraster, PCRASTER_TYPES[scale])
+    if scale in ('VS_SCALAR', 'VS_DIRECTION'):
+        return pcraster.numpy2pcr(data_type, np.where(np.isnan(values), -1e31, values), -1e31)
+    missing = 255 if scale in ('VS_BOOLEAN', 'VS_LDD') else -2147483648
+    values = np.where(np.isnan(values), missing, values).astype(np.int64)
+    return pcraster.numpy2pcr(data_type, values, missing)
+
+
+class Kernel:
+    """
+    Fuses the local operators of an expression into one kernel on the grid
+    of a template dataset. Global operator nodes are evaluated by PCRaster
+    the first time the kernel needs them and replaced by their result.
+    """
+
+    def __init__(self, expression, template):
+        self.template = template
+        self.inputs = []
+        self.names = {}
+        self.datasets = {}
+        self.source = self._compile(expression)
+
+    def _compile(self, node):
+        if node.kind == 'constant':
+            return repr(node.value)
+        if node.kind == 'local':
+            return node.template.format(*[self._compile(arg) for arg in node.args])
+        key = node.value if node.kind == 'raster' else id(node)
+        if key not in self.names:
+            self.names[key] = 'v{}'.format(len(self.inputs))
+            self.inputs.append((self.names[key], node))
+        return self.names[key]
+
+    def _materialise(self, node):
+        if node.kind == 'global' and node.value is None:
+            args = [to_field(arg, self.template.GetDescription()) if isinstance(arg, Expression) else arg
+                    for arg in node.args]
+            node.value = _to_array(node.function(*args))
+        return node.value
+
+    def evaluate(self, yoff, ysize):
+        """
+        Evaluates the kernel for a row band and returns a float64 array with
+        NaN for missing values.
+        """
+        arrays = {}
+        for name, node in self.inputs:
+            if node.kind == 'raster':
+                if node.value not in self.datasets:
+                    self.datasets[node.value] = open_raster(node.value)
+                values, valid = read_rows(self.datasets[node.value], yoff, ysize)
+                arrays[name] = np.where(valid, values, np.nan).astype(np.float64)
+            else:
+                arrays[name] = self._materialise(node)[yoff:yoff + ysize]
+        with np.errstate(all='ignore'):
+            if numexpr is not None and len(arrays) <= MAX_KERNEL_INPUTS:
+                result = numexpr.evaluate(self.source, local_dict=dict(arrays, nan=np.nan))
+            else:
+                namespace = dict(NUMPY_FUNCTIONS)
+                namespace.update(arrays)
+                result = eval(self.source, {'__builtins__': {}}, namespace)
+        return np.broadcast_to(np.asarray(result, dtype=np.float64), (ysize, self.template.RasterXSize))
+
+    def evaluate_full(self):
+        """
+        Evaluates the kernel for the whole grid of the template dataset.
+        """
+        return np.concatenate([self.evaluate(yoff, ysize) for yoff, ysize in row_windows(self.template)])
@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+# Drainage network operations on PCRaster local drain direction (LDD) arrays.
+# The network is stored as the flat index of the downstream cell of every
+# cell and processed in topological levels: the first level holds the cells
+# without upstream cells and every following level the cells whose upstream
+# cells are all in earlier levels. Each level is one vectorised NumPy step.
+# This module contains no algorithm, so the Processing script provider
+# skips it.
+
+import numpy as np
+
+# Row and column offsets of the LDD codes, which follow the numeric keypad:
+# 7 8 9 / 4 5 6 / 1 2 3, with 5 for a pit
+LDD_ROWS = np.array([0, 1, 1, 1, 0, 0, 0, -1, -1, -1])
+LDD_COLS = np.array([0, -1, 0, 1, -1, 0, 1, -1, 0, 1])
+
+
+def downstream_index(ldd, valid):
+    """
+    Returns the flat index of the downstream cell of every cell of an LDD
+    array, or -1 for pits, missing cells and cells that drain to a missing
+    cell or out of the array.
+    """
+    rows, cols = ldd.shape
+    codes = np.where(valid, ldd, 5).astype(np.int64)
+    codes[(codes < 1) | (codes > 9)] = 5
+    row = np.arange(rows)[:, None] + LDD_ROWS[codes]
+    col = np.arange(cols)[None, :] + LDD_COLS[codes]
+    inside = (codes != 5) & (row >= 0) & (row < rows) & (col >= 0) & (col < cols)
+    index = np.where(inside, row * cols + col, -1).ravel()
+    drains = np.flatnonzero(index >= 0)
+    index[drains[~valid.ravel()[index[drains]]]] = -1
+    return index
+
+
+def topological_levels(downstream, valid):
+    """
+    Returns a list of arrays with the flat indices of the cells of every
+    topological level, from the sources to the outlets.
+    """
+    indegree = np.bincount(downstream[downstream >= 0], minlength=len(downstream))
+    frontier = np.flatnonzero((indegree == 0) & valid)
+    levels = []
+    while len(frontier):
+        levels.append(frontier)
+        targets = downstream[frontier]
+        targets, counts = np.unique(targets[targets >= 0], return_counts=True)
+        indegree[targets] -= counts
+        frontier = targets[indegree[targets] == 0]
+    return levels
+
+
+class StreamNetwork:
+    """
+    Drainage network of an LDD array on the grid of a geotransform.
+    """
+
+    def __init__(self, ldd, valid, geotransform):
+        self.shape = ldd.shape
+        self.geotransform = geotransform
+        self.valid = valid.ravel()
+        self.downstream = downstream_index(ldd, valid)
+        self.levels = topological_levels(self.downstream, self.valid)
+
+    def cell_area(self):
+        return abs(self.geotransform[1] * self.geotransform[5])
+
+    def accumulate(self, weights):
+        """
+        Returns the total of the weights of every cell and all cells upstream
+        of it, like accuflux. Missing cells get NaN.
+        """
+        total = np.where(self.valid, np.broadcast_to(weights, self.shape).ravel(), np.nan).astype(np.float64)
+        for frontier in self.levels:
+            targets = self.downstream[frontier]
+            drains = targets >= 0
+            np.add.at(total, targets[drains], total[frontier[drains]])
+        return total
+
+    def strahler(self):
+        """
+        Returns the Strahler order of every cell, like streamorder. Missing
+        cells get 0.
+        """
+        order = np.zeros(len(self.downstream), dtype=np.int64)
+        highest = np.zeros(len(self.downstream), dtype=np.int64)
+        count = np.zeros(len(self.downstream), dtype=np.int64)
+        for frontier in self.levels:
+            # Upstream cells are final, so the order of the level is known
+            order[frontier] = np.where(highest[frontier] == 0, 1, highest[frontier] + (count[frontier] > 1))
+            targets = self.downstream[frontier]
+            drains = targets >= 0
+            targets, values = targets[drains], order[frontier[drains]]
+            previous = highest[targets]
+            np.maximum.at(highest, targets, values)
+            count[targets[highest[targets] > previous]] = 0
+            np.add.at(count, targets[values == highest[targets]], 1)
+        return order
+
+    def shreve(self):
+        """
+        Returns the Shreve magnitude of every cell: the number of sources
+        upstream of it. Missing cells get NaN.
+        """
+        upstream = np.bincount(self.downstream[self.downstream >= 0], minlength=len(self.downstream))
+        return self.accumulate((upstream == 0).reshape(self.shape))
+
+    def step_length(self):
+        """
+        Returns the distance from every cell to its downstream cell, or 0 for
+        pits and cells without a downstream cell.
+        """
+        length = np.zeros(len(self.downstream))
+        cells = np.flatnonzero(self.downstream >= 0)
+        row, col = np.divmod(cells, self.shape[1])
+        down_row, down_col = np.divmod(self.downstream[cells], self.shape[1])
+        length[cells] = np.hypot((down_row - row) * self.geotransform[5], (down_col - col) * self.geotransform[1])
+        return length
+
+    def nearest_drainage(self, drainage):
+        """
+        Follows the flow path of every cell to the first drainage cell on it,
+        handing the result of each cell up to its upstream cells in one pass
+        from the outlets to the sources. Returns the flat index of that
+        drainage cell and the distance to it along the flow path, or -1 and
+        NaN for cells that do not drain to a drainage cell.
+        """
+        drainage = drainage.ravel() & self.valid
+        target = np.where(drainage, np.arange(len(self.downstream)), -1)
+        distance = np.where(drainage, 0.0, np.nan)
+        step = self.step_length()
+        for frontier in reversed(self.levels):
+            frontier = frontier[~drainage[frontier]]
+            targets = self.downstream[frontier]
+            drains = targets >= 0
+            frontier, targets = frontier[drains], targets[drains]
+            target[frontier] = target[targets]
+            distance[frontier] = distance[targets] + step[frontier]
+        return target, distance
+
+    def spread_downstream(self, cells, zones, friction=1.0, initial=0.0):
+        """
+        Spreads from the source cells down their flow paths, like spreadldd
+        and spreadlddzone restricted to the downstream direction. A step
+        costs its length times the mean friction of the two cells. Returns
+        per cell the smallest friction distance from a source upstream, the
+        zone of that source and the length of its path, or NaN, 0 and NaN
+        for cells without a source upstream. Only the cells below the
+        sources are visited: apart from allocating the three result arrays,
+        every step only works on the cells of the frontier.
+        """
+        n = len(self.downstream)
+        friction = np.asarray(friction, dtype=np.float64)
+        # A constant friction is broadcast without a copy of the grid
+        friction = friction.reshape(-1) if friction.ndim else np.broadcast_to(friction, (n,))
+        distance = np.full(n, np.inf)
+        length = np.full(n, np.nan)
+        zone = np.zeros(n, dtype=np.int64)
+        cells = np.asarray(cells, dtype=np.int64)
+        keep = self.valid[cells]
+        cells, zones = cells[keep], np.asarray(zones, dtype=np.int64)[keep]
+        start = np.broadcast_to(np.asarray(initial, dtype=np.float64), cells.shape)
+        # A cell listed more than once starts from its smallest initial
+        # distance; the first of equal ones gives the zone
+        order = np.lexsort((np.arange(len(cells)), start))
+        chosen = order[np.unique(cells[order], return_index=True)[1]]
+        frontier = cells[chosen]
+        distance[frontier] = start[chosen]
+        length[frontier] = 0.0
+        zone[frontier] = zones[chosen]
+        step = self.step_length()
+
+        while len(frontier):
+            targets = self.downstream[frontier]
+            drains = targets >= 0
+            frontier, targets = frontier[drains], targets[drains]
+            candidate = distance[frontier] + step[frontier] * (friction[frontier] + friction[targets]) / 2
+            # Several cells may drain into one target; the smallest wins, and
+            # the first of equal ones
+            order = np.lexsort((np.arange(len(targets)), candidate, targets))
+            first = order[np.unique(targets[order], return_index=True)[1]]
+            frontier, targets, candidate = frontier[first], targets[first], candidate[first]
+            better = candidate < distance[targets]
+            frontier, targets, candidate = frontier[better], targets[better], candidate[better]
+            distance[targets] = candidate
+            length[targets] = length[frontier] + step[frontier]
+            zone[targets] = zone[frontier]
+            frontier = targets
+        return np.where(np.isfinite(distance), distance, np.nan), zone, length
+
+    def cell_centres(self, cells):
+        """
+        Returns the x and y coordinates of the centres of flat cell indices.
+        """
+        row, col = np.divmod(cells, self.shape[1])
+        return (self.geotransform[0] + (col + 0.5) * self.geotransform[1],
+                self.geotransform[3] + (row + 0.5) * self.geotransform[5])
+
+    def segments(self, streams, order=None, upstream_area=None):
+        """
+        Splits the cells where streams is True into segments that run from a
+        source or confluence to the next confluence or outlet. Returns a
+        dictionary with, per segment, the Strahler order, the upstream area
+        at its end, the index of the downstream segment (-1 at an outlet),
+        the length and the first and last stream cell ('head' and 'last'),
+        together with the vertex cells of all segments: segment
+        i runs over vertices[start[i]:start[i + 1]]. The confluence that ends
+        a segment is also the first vertex of the segment below it, except
+        for an outlet confluence, which is a segment of one vertex. The
+        Strahler order and upstream area are calculated when not given.
+        """
+        streams = streams.ravel() & self.valid
+        if order is None:
+            order = self.strahler()
+        if upstream_area is None:
+            upstream_area = self.accumulate(self.cell_area())
+        n = len(self.downstream)
+
+        # Sources and confluences have no or more than one upstream stream cell
+        cells = np.flatnonzero(streams)
+        if len(cells) == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            return {'order': empty, 'upstream_area': np.zeros(0), 'downstream': empty, 'length': np.zeros(0),
+                    'head': empty, 'last': empty, 'vertices': empty, 'start': np.zeros(1, dtype=np.int64)}
+        targets = self.downstream[cells]
+        into_stream = targets >= 0
+        into_stream[into_stream] = streams[targets[into_stream]]
+        upstream_count = np.bincount(targets[into_stream], minlength=n)
+        head = streams & (upstream_count != 1)
+        heads = np.flatnonzero(head)
+        segment = np.full(n, -1, dtype=np.int64)
+        segment[heads] = np.arange(len(heads))
+
+        # Other stream cells inherit the segment of their single upstream cell
+        position = np.zeros(n, dtype=np.int64)
+        for level, frontier in enumerate(self.levels):
+            position[frontier] = level
+            frontier = frontier[streams[frontier]]
+            targets = self.downstream[frontier]
+            follows = targets >= 0
+            follows[follows] = streams[targets[follows]] & ~head[targets[follows]]
+            segment[targets[follows]] = segment[frontier[follows]]
+
+        cells = cells[np.lexsort((position[cells], segment[cells]))]
+        ids = segment[cells]
+        start = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+        last = cells[np.r_[start[1:], len(cells)] - 1]
+        end = self.downstream[last]
+        end[end >= 0] = np.where(streams[end[end >= 0]], end[end >= 0], -1)
+
+        # Append the confluence below every segment as its last vertex
+        vertices = np.insert(cells, np.r_[start[1:], len(cells)][end >= 0], end[end >= 0])
+        counts = np.diff(np.r_[start, len(cells)]) + (end >= 0)
+        start = np.r_[0, np.cumsum(counts)]
+        x, y = self.cell_centres(vertices)
+        steps = np.hypot(np.diff(x), np.diff(y))
+        steps[start[1:-1] - 1] = 0
+        length = np.add.reduceat(np.r_[steps, 0], start[:-1])
+        length[counts == 1] = 0
+
+        # An outlet that is also a confluence forms a segment of one vertex;
+        # the segments draining to it are treated as ending at the outlet
+        downstream = np.where(end >= 0, segment[np.maximum(end, 0)], -1)
+        downstream[downstream >= 0] = np.where(counts[downstream[downstream >= 0]] > 1, downstream[downstream >= 0], -1)
+
+        return {
+            'order': order[heads],
+            'upstream_area': upstream_area[last],
+            'downstream': downstream,
+            'length': length,
+            'head': heads,
+            'last': last,
+            'vertices': vertices,
+            'start': start,
+        }
+
+    def subcatchments(self, outlets, order=None):
+        """
+        Labels every cell with the id of the first outlet on its flow path,
+        like subcatchment, where outlets holds an id above 0 at the outlet
+        cells. The topology of the subcatchments is collected in the same
+        pass from the outlets to the sources. Returns the flat labels, 0 for
+        cells that do not drain to an outlet, and a dictionary with per
+        subcatchment the id, the id of the subcatchment it drains into (0 at
+        an outlet of the network), the area, the outlet cell and the
+        Strahler order at the outlet, sorted by id. When an id is on more
+        than one cell, its most downstream cell is the outlet.
+        """
+        outlets = np.where(self.valid, outlets.ravel(), 0).astype(np.int64)
+        labels = outlets.copy()
+        outlet_cells = np.flatnonzero(outlets > 0)
+        below = np.zeros(len(outlet_cells), dtype=np.int64)
+        position = np.zeros(len(outlet_cells), dtype=np.int64)
+        for level, frontier in enumerate(reversed(self.levels)):
+            targets = self.downstream[frontier]
+            drains = targets >= 0
+            is_outlet = outlets[frontier] > 0
+            # An outlet keeps its id and records the label below it
+            inherit = drains & ~is_outlet
+            labels[frontier[inherit]] = labels[targets[inherit]]
+            if is_outlet.any():
+                found = np.searchsorted(outlet_cells, frontier[is_outlet])
+                below[found] = np.where(drains[is_outlet], labels[np.maximum(targets[is_outlet], 0)], 0)
+                position[found] = level
+        if order is None:
+            order = self.strahler()
+
+        # Levels are counted from the outlets, so the lowest one is furthest
+        # downstream
+        ids = outlets[outlet_cells]
+        sort = np.lexsort((position, ids))
+        sort = sort[np.r_[True, ids[sort][1:] != ids[sort][:-1]]]
+        area = np.bincount(labels, minlength=ids.max() + 1 if len(ids) else 1) * self.cell_area()
+        return labels, {
+            'id': ids[sort],
+            'downstream_id': below[sort],
+            'area': area[ids[sort]],
+            'outlet': outlet_cells[sort],
+            'order': order[outlet_cells[sort]],
+        }
+
+def nested_sets(ids, downstream_ids):
+    """
+    Numbers a tree of subcatchments in depth first order, from the outlets of
+    the network up. Returns the left and right numbers of every subcatchment:
+    the subcatchments upstream of subcatchment i, including i itself, are
+    those with a left number from left[i] to right[i], so upstream
+    aggregation becomes a range query on a table.
+    """
+    ids = np.asarray(ids)
+    position = {int(value): i for i, value in enumerate(ids)}
+    children = [[] for _ in ids]
+    roots = []
+    for i, below in enumerate(downstream_ids):
+        parent = position.get(int(below))
+        (roots if parent is None else children[parent]).append(i)
+    left = np.zeros(len(ids), dtype=np.int64)
+    right = np.zeros(len(ids), dtype=np.int64)
+    number = 0
+    for root in roots:
+        stack = [(root, False)]
+        while stack:
+            node, done = stack.pop()
+            if done:
+                right[node] = number - 1
+                continue
+            left[node] = number
+            number += 1
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(children[node]))
+    return left, right
+
+
+def topology_table(network, topology):
+    """
+    Completes the topology of StreamNetwork.subcatchments() to a table: adds
+    the nested set numbers, the upstream area of every subcatchment and the
+    coordinates of its outlet cell.
+    """
+    table = dict(topology)
+    left, right = nested_sets(topology['id'], topology['downstream_id'])
+    # Upstream subcatchments are a contiguous run in nested set order
+    total = np.r_[0.0, np.cumsum(topology['area'][np.argsort(left)])]
+    table['upstream_area'] = total[right + 1] - total[left]
+    table['nest_left'], table['nest_right'] = left, right
+    table['outlet_x'], table['outlet_y'] = network.cell_centres(topology['outlet'])
+    return table
+
+
+def snap_points(accumulation, valid, rows, cols, tolerance, cell_width, cell_height):
+    """
+    Moves every (row, col) point to the cell with the largest accumulation
+    within tolerance map units of it; ties go to the nearest cell. Only the
+    window around each point is searched. Returns the snapped rows and
+    columns, with -1 for points without a defined cell within tolerance.
+    """
+    height, width = accumulation.shape
+    row_radius = int(tolerance // cell_height)
+    col_radius = int(tolerance // cell_width)
+    offset_rows, offset_cols = np.mgrid[-row_radius:row_radius + 1, -col_radius:col_radius + 1]
+    distance = np.hypot(offset_rows * cell_height, offset_cols * cell_width)
+    inside = distance <= tolerance
+    offset_rows, offset_cols, distance = offset_rows[inside], offset_cols[inside], distance[inside]
+
+    snapped_rows = np.full(len(rows), -1, dtype=np.int64)
+    snapped_cols = np.full(len(rows), -1, dtype=np.int64)
+    for i, (row, col) in enumerate(zip(rows, cols)):
+        candidate_rows, candidate_cols = row + offset_rows, col + offset_cols
+        keep = (candidate_rows >= 0) & (candidate_rows < height) & (candidate_cols >= 0) & (candidate_cols < width)
+        candidate_rows, candidate_cols, candidate_distance = candidate_rows[keep], candidate_cols[keep], distance[keep]
+        keep = valid[candidate_rows, candidate_cols]
+        if not keep.any():
+            continue
+        candidate_rows, candidate_cols, candidate_distance = candidate_rows[keep], candidate_cols[keep], candidate_distance[keep]
+        best = np.lexsort((candidate_distance, -accumulation[candidate_rows, candidate_cols]))[0]
+        snapped_rows[i], snapped_cols[i] = candidate_rows[best], candidate_cols[best]
+    return snapped_rows, snapped_cols
@@ -11,20 +11,8 @@
 ***************************************************************************
 """
 
-from pcraster import (
-    readmap,
-    setclone,
-    scalar,
-    order,
-    cellvalue,
-    cellarea,
-    maptotal,
-    maparea,
-    roundoff,
-    ifthenelse,
-    mapmaximum,
-    report
-)
+import os
+import sys
 
 from qgis import processing
 from qgis.PyQt.QtCore import QCoreApplication
@@ -34,13 +22,26 @@ from qgis.core import (
     QgsProcessingParameterRasterLayer,
     QgsProcessingParameterNumber,
     QgsProcessingParameterCrs,
-    QgsProcessingParameterRasterDestination)
+    QgsProcessingParameterRasterDestination,
+    QgsProcessingOutputNumber)
+
+# The shared helpers live next to this script in the scripts folder
+_SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+if _SCRIPT_FOLDER not in sys.path:
+    sys.path.append(_SCRIPT_FOLDER)
+
+from pcraster_blockio import (
+    broadcast,
+    map_statistics,
+    open_raster)
+from pcraster_profiling import Profile
 
 #from pcraster_tools.processing.algorithm import PCRasterAlgorithm
 
 class mapaverageAlgorithm(QgsProcessingAlgorithm):
     INPUT_RASTER = 'INPUT'
     OUTPUT_RASTER = 'OUTPUT'
+    OUTPUT_AVERAGE = 'AVERAGE'
 
     def tr(self, string):
         """
@@ -99,6 +100,7 @@ class mapaverageAlgorithm(QgsProcessingAlgorithm):
             
             * <b>Input raster</b> (required) - raster layer
             * <b>Output raster</b> (required) - Scalar raster with result
+            * <b>Map average</b> - the average as a number
             """
         )
 
@@ -123,18 +125,23 @@ class mapaverageAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        self.addOutput(QgsProcessingOutputNumber(self.OUTPUT_AVERAGE, self.tr('Map average')))
+
     def processAlgorithm(self, parameters, context, feedback):
         input_raster = self.parameterAsRasterLayer(parameters, self.INPUT_RASTER, context)
-        output_raster = self.parameterAsRasterLayer(parameters, self.OUTPUT_RASTER, context)
-        setclone(input_raster.dataProvider().dataSourceUri())
-        InputRaster = readmap(input_raster.dataProvider().dataSourceUri())
-        Total = maptotal(scalar(InputRaster))
-        NumCells = maparea(InputRaster) / cellarea()
-        Mean = Total / NumCells
-        outputFilePath = self.parameterAsOutputLayer(parameters, self.OUTPUT_RASTER, context)
-
-        report(Mean,outputFilePath)
-        
+        with Profile(self.name(), feedback) as profile:
+            profile.raster(input_raster.height(), input_raster.width())
+            # Total and number of cells come from the same pass over the raster
+            with profile.phase('statistics'):
+                statistics = map_statistics(input_raster.dataProvider().dataSourceUri(), feedback)
+                if statistics is None:
+                    return {}
+            Mean = statistics['average']
+            outputFilePath = self.parameterAsOutputLayer(parameters, self.OUTPUT_RASTER, context)
+
+            with profile.phase('write'):
+                broadcast(outputFilePath, open_raster(input_raster.dataProvider().dataSourceUri()), Mean)
+
 #        self.set_output_crs(output_file=outputFilePath, crs=input_raster.crs(), feedback=feedback, context=context)
 
-        return {self.OUTPUT_RASTER: outputFilePath}
+        return {self.OUTPUT_RASTER: outputFilePath, self.OUTPUT_AVERAGE: Mean}
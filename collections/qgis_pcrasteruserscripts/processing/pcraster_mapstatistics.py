@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+import os
+import sys
+
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (
+    QgsProcessingAlgorithm,
+    QgsProcessingParameterRasterLayer,
+    QgsProcessingParameterRasterDestination,
+    QgsProcessingOutputNumber)
+
+# The shared helpers live next to this script in the scripts folder
+_SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+if _SCRIPT_FOLDER not in sys.path:
+    sys.path.append(_SCRIPT_FOLDER)
+
+from pcraster_blockio import (
+    broadcast,
+    map_statistics,
+    open_raster,
+    valuescale)
+from pcraster_profiling import Profile
+
+
+class PCRasterMapStatisticsAlgorithm(QgsProcessingAlgorithm):
+    """
+    Calculates maptotal, mapminimum, mapmaximum, maparea and mapaverage of a
+    raster in one multi-threaded block-wise pass and returns them as numbers.
+    """
+
+    INPUT_RASTER = 'INPUT'
+    OUTPUT_COUNT = 'COUNT'
+    OUTPUT_TOTAL = 'TOTAL'
+    OUTPUT_MINIMUM = 'MINIMUM'
+    OUTPUT_MAXIMUM = 'MAXIMUM'
+    OUTPUT_AREA = 'AREA'
+    OUTPUT_AVERAGE = 'AVERAGE'
+    OUTPUT_TOTAL_RASTER = 'OUTPUT_TOTAL'
+    OUTPUT_MINIMUM_RASTER = 'OUTPUT_MINIMUM'
+    OUTPUT_MAXIMUM_RASTER = 'OUTPUT_MAXIMUM'
+    OUTPUT_AREA_RASTER = 'OUTPUT_AREA'
+    OUTPUT_AVERAGE_RASTER = 'OUTPUT_AVERAGE'
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return PCRasterMapStatisticsAlgorithm()
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'mapstatistics'
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr('mapstatistics')
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return self.tr('PCRaster User Scripts')
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'pcrasteruser'
+
+    def shortHelpString(self):
+        """
+        Returns a localised short helper string for the algorithm. This string
+        should provide a basic description about what the algorithm does and the
+        parameters and outputs associated with it..
+        """
+        return self.tr(
+            """Total, minimum, maximum, area and average of all cell values of a raster layer
+
+            The values are returned as numeric outputs, so they can be used in models without writing a raster. Rasters filled with a value, like maptotal, mapminimum, mapmaximum and maparea write them, are only created when requested.
+
+            Parameters:
+
+            * <b>Input raster</b> (required) - raster layer
+            * <b>Output ... raster</b> (optional) - Scalar raster with the value in every cell
+            """
+        )
+
+    def initAlgorithm(self, config=None):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUT_RASTER,
+                self.tr('Raster layer')
+            )
+        )
+
+        for output, description in ((self.OUTPUT_TOTAL_RASTER, 'Output map total raster layer'),
+                                    (self.OUTPUT_MINIMUM_RASTER, 'Output map minimum raster layer'),
+                                    (self.OUTPUT_MAXIMUM_RASTER, 'Output map maximum raster layer'),
+                                    (self.OUTPUT_AREA_RASTER, 'Output map area raster layer'),
+                                    (self.OUTPUT_AVERAGE_RASTER, 'Output map average raster layer')):
+            self.addParameter(
+                QgsProcessingParameterRasterDestination(
+                    output,
+                    self.tr(description),
+                    optional=True,
+                    createByDefault=False
+                )
+            )
+
+        for output, description in ((self.OUTPUT_COUNT, 'Number of cells'),
+                                    (self.OUTPUT_TOTAL, 'Map total'),
+                                    (self.OUTPUT_MINIMUM, 'Map minimum'),
+                                    (self.OUTPUT_MAXIMUM, 'Map maximum'),
+                                    (self.OUTPUT_AREA, 'Map area'),
+                                    (self.OUTPUT_AVERAGE, 'Map average')):
+            self.addOutput(QgsProcessingOutputNumber(output, self.tr(description)))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+
+        input_raster = self.parameterAsRasterLayer(parameters, self.INPUT_RASTER, context)
+        with Profile(self.name(), feedback) as profile:
+            profile.raster(input_raster.height(), input_raster.width())
+            with profile.phase('statistics'):
+                statistics = map_statistics(input_raster.dataProvider().dataSourceUri(), feedback)
+                if statistics is None:
+                    return {}
+            feedback.pushInfo('Total cells: {}'.format(statistics['count']))
+
+            results = {}
+            results[self.OUTPUT_COUNT] = statistics['count']
+            results[self.OUTPUT_TOTAL] = statistics['total']
+            results[self.OUTPUT_MINIMUM] = statistics['minimum']
+            results[self.OUTPUT_MAXIMUM] = statistics['maximum']
+            results[self.OUTPUT_AREA] = statistics['area']
+            results[self.OUTPUT_AVERAGE] = statistics['average']
+
+            with profile.phase('write'):
+                template = open_raster(input_raster.dataProvider().dataSourceUri())
+                for output, statistic, scale in ((self.OUTPUT_TOTAL_RASTER, 'total', 'VS_SCALAR'),
+                                                 (self.OUTPUT_MINIMUM_RASTER, 'minimum', valuescale(template)),
+                                                 (self.OUTPUT_MAXIMUM_RASTER, 'maximum', valuescale(template)),
+                                                 (self.OUTPUT_AREA_RASTER, 'area', 'VS_SCALAR'),
+                                                 (self.OUTPUT_AVERAGE_RASTER, 'average', 'VS_SCALAR')):
+                    outputFilePath = self.parameterAsOutputLayer(parameters, output, context)
+                    if outputFilePath:
+                        results[output] = broadcast(outputFilePath, template, statistics[statistic], scale)
+
+            return results
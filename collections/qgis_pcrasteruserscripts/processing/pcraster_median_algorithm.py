@@ -11,20 +11,8 @@
 ***************************************************************************
 """
 
-from pcraster import (
-    readmap,
-    setclone,
-    scalar,
-    order,
-    cellvalue,
-    cellarea,
-    maptotal,
-    maparea,
-    roundoff,
-    ifthenelse,
-    mapmaximum,
-    report
-)
+import os
+import sys
 
 from qgis import processing
 from qgis.PyQt.QtCore import QCoreApplication
@@ -36,6 +24,14 @@ from qgis.core import (
     QgsProcessingParameterCrs,
     QgsProcessingParameterRasterDestination)
 
+# The shared helpers live next to this script in the scripts folder
+_SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+if _SCRIPT_FOLDER not in sys.path:
+    sys.path.append(_SCRIPT_FOLDER)
+
+from pcraster_blockio import write_field
+from pcraster_profiling import Profile
+
 #from pcraster_tools.processing.algorithm import PCRasterAlgorithm
 
 class MedianAlgorithm(QgsProcessingAlgorithm):
@@ -124,20 +120,40 @@ class MedianAlgorithm(QgsProcessingAlgorithm):
         )
 
     def processAlgorithm(self, parameters, context, feedback):
+        from pcraster import (
+            readmap,
+            setclone,
+            scalar,
+            order,
+            cellvalue,
+            cellarea,
+            maptotal,
+            maparea,
+            roundoff,
+            ifthenelse,
+            mapmaximum
+        )
+
         input_raster = self.parameterAsRasterLayer(parameters, self.INPUT_RASTER, context)
         output_raster = self.parameterAsRasterLayer(parameters, self.OUTPUT_RASTER, context)
-        setclone(input_raster.dataProvider().dataSourceUri())
-        InputRaster = readmap(input_raster.dataProvider().dataSourceUri())
-        OrderMap = order(InputRaster)
-        Total = cellvalue(maptotal(scalar(InputRaster)), 0, 0)
-        NumCells = cellvalue(maparea(InputRaster) / cellarea(), 0, 0)
-        mean = Total[0] / NumCells[0]
-        Mid = roundoff(mean)
-        MidMap = ifthenelse(OrderMap == Mid, InputRaster, 0)
-        Median = mapmaximum(MidMap)
-        outputFilePath = self.parameterAsOutputLayer(parameters, self.OUTPUT_RASTER, context)
-
-        report(Median,outputFilePath)
+        with Profile(self.name(), feedback) as profile:
+            profile.raster(input_raster.height(), input_raster.width())
+            with profile.phase('read'):
+                setclone(input_raster.dataProvider().dataSourceUri())
+                InputRaster = readmap(input_raster.dataProvider().dataSourceUri())
+            with profile.phase('order'):
+                OrderMap = order(InputRaster)
+            with profile.phase('compute'):
+                Total = cellvalue(maptotal(scalar(InputRaster)), 0, 0)
+                NumCells = cellvalue(maparea(InputRaster) / cellarea(), 0, 0)
+                mean = Total[0] / NumCells[0]
+                Mid = roundoff(mean)
+                MidMap = ifthenelse(OrderMap == Mid, InputRaster, 0)
+                Median = mapmaximum(MidMap)
+            outputFilePath = self.parameterAsOutputLayer(parameters, self.OUTPUT_RASTER, context)
+
+            with profile.phase('write'):
+                write_field(Median, outputFilePath, input_raster.dataProvider().dataSourceUri())
         
 #        self.set_output_crs(output_file=outputFilePath, crs=input_raster.crs(), feedback=feedback, context=context)
 
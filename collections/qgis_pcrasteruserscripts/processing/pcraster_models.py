@@ -0,0 +1,483 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+# Running the children of a .model3 model one by one outside the model
+# runner, so that their results can be served from a DiskCache. The outputs
+# of a child are cached under its algorithm id and its parameters, where an
+# input file is represented by a hash of its contents; a child whose inputs
+# did not change is not run again. Children without a data dependency
+# between them can run at the same time in qgis_process worker processes.
+# This module contains no algorithm, so the Processing script provider
+# skips it.
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from qgis import processing
+from qgis.core import (
+    Qgis,
+    QgsApplication,
+    QgsExpression,
+    QgsMapLayer,
+    QgsProcessingException,
+    QgsProcessingModelAlgorithm,
+    QgsProcessingModelChildParameterSource,
+    QgsProcessingUtils)
+
+# Providers whose algorithms only depend on their parameters and input files
+CACHED_PROVIDERS = ('pcraster',)
+
+# Bytes read at a time when hashing an input file
+HASH_BLOCK = 1 << 20
+
+# qgis_process reads the parameters as JSON from stdin since QGIS 3.24
+QGIS_PROCESS_JSON_INPUT = 32400
+
+# Seconds between checks for cancellation while a worker process runs
+POLL_INTERVAL = 0.5
+
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+def load_model(path):
+    """
+    Returns the model algorithm of a .model3 file.
+    """
+    model = QgsProcessingModelAlgorithm()
+    if not model.fromFile(path):
+        raise QgsProcessingException('Could not read the model {}'.format(path))
+    return model
+
+
+def active_children(model):
+    """
+    Returns the active children of a model by child id.
+    """
+    return {child_id: child for child_id, child in model.childAlgorithms().items() if child.isActive()}
+
+
+def child_dependencies(model):
+    """
+    Returns the ids of the children every active child directly depends on,
+    through one of its inputs or a declared dependency.
+    """
+    children = active_children(model)
+    dependencies = {}
+    for child_id, child in children.items():
+        upstream = set()
+        for sources in child.parameterSources().values():
+            for source in sources:
+                if source.source() == QgsProcessingModelChildParameterSource.ChildOutput:
+                    upstream.add(source.outputChildId())
+        for dependency in child.dependencies():
+            # A plain id before QGIS 3.20, a QgsProcessingModelChildDependency since
+            upstream.add(getattr(dependency, 'childId', dependency))
+        dependencies[child_id] = {upstream_id for upstream_id in upstream if upstream_id in children}
+    return dependencies
+
+
+def execution_order(dependencies):
+    """
+    Returns the child ids in an order in which every child comes after the
+    children it depends on.
+    """
+    remaining = {child_id: set(upstream) for child_id, upstream in dependencies.items()}
+    order = []
+    while remaining:
+        ready = sorted(child_id for child_id, upstream in remaining.items() if not upstream)
+        if not ready:
+            raise QgsProcessingException('The model has a cycle between {}'.format(', '.join(sorted(remaining))))
+        for child_id in ready:
+            del remaining[child_id]
+        for upstream in remaining.values():
+            upstream.difference_update(ready)
+        order.extend(ready)
+    return order
+
+
+def model_parameters(model, parameters):
+    """
+    Returns the parameters of a model run with the defaults of the model
+    inputs that are not given.
+    """
+    values = {definition.name(): definition.defaultValue() for definition in model.parameterDefinitions()}
+    values.update(parameters)
+    return values
+
+
+def output_parameter(child_id, output_name):
+    """
+    Returns the name of the model parameter with the destination of a model
+    output, as the model runner names it.
+    """
+    return '{}:{}'.format(child_id, output_name)
+
+
+def source_value(source, parameters, results, expression_context):
+    """
+    Returns the value of one parameter source of a child.
+    """
+    kind = source.source()
+    if kind == QgsProcessingModelChildParameterSource.StaticValue:
+        return source.staticValue()
+    if kind == QgsProcessingModelChildParameterSource.ModelParameter:
+        return parameters.get(source.parameterName())
+    if kind == QgsProcessingModelChildParameterSource.ChildOutput:
+        return results[source.outputChildId()].get(source.outputName())
+    if kind == QgsProcessingModelChildParameterSource.Expression:
+        return QgsExpression(source.expression()).evaluate(expression_context)
+    if kind == QgsProcessingModelChildParameterSource.ExpressionText:
+        return QgsExpression.replaceExpressionText(source.expressionText(), expression_context)
+    return None
+
+
+def child_parameters(model, child, parameters, results, context, output_folder=None):
+    """
+    Returns the parameters to run a child with. Destinations of model
+    outputs come from the model parameters or else go to output_folder;
+    other destinations are files in the temporary folder, so they outlive
+    the process that writes them.
+    """
+    expression_context = model.createExpressionContext(parameters, context)
+    values = {}
+    for name, sources in child.parameterSources().items():
+        resolved = [source_value(source, parameters, results, expression_context) for source in sources]
+        values[name] = resolved[0] if len(resolved) == 1 else resolved
+
+    outputs = {output.childOutputName(): output for output in child.modelOutputs().values()}
+    for definition in child.algorithm().destinationParameterDefinitions():
+        name = definition.name()
+        destination = None
+        if name in outputs:
+            destination = parameters.get(output_parameter(child.childId(), outputs[name].name()))
+            if not destination and output_folder:
+                destination = os.path.join(output_folder, '{}.{}'.format(
+                    outputs[name].name().replace(':', '_'), definition.defaultFileExtension()))
+        values[name] = destination or QgsProcessingUtils.generateTempFilename(
+            '{}.{}'.format(name, definition.defaultFileExtension()))
+    return values
+
+
+def file_digest(path):
+    """
+    Returns the SHA-1 of the contents of a file. Digests are remembered per
+    path, size and modification time for the lifetime of the process.
+    """
+    status = os.stat(path)
+    memo = (os.path.abspath(path), status.st_size, status.st_mtime_ns)
+    with _digests_lock:
+        if memo in _digests:
+            return _digests[memo]
+    digest = hashlib.sha1()
+    with open(path, 'rb') as input_file:
+        for block in iter(lambda: input_file.read(HASH_BLOCK), b''):
+            digest.update(block)
+    with _digests_lock:
+        _digests[memo] = digest.hexdigest()
+    return _digests[memo]
+
+
+def key_value(value):
+    """
+    Returns a value that stands for a parameter value in a cache key. Input
+    files are represented by the hash of their contents, so a key does not
+    change when the same data is found at another path.
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(key_value(item) for item in value)
+    if isinstance(value, QgsMapLayer):
+        value = value.source()
+    if isinstance(value, str):
+        path = value.split('|')[0]
+        if path and os.path.isfile(path):
+            return ('file', file_digest(path), value[len(path):])
+        return value
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return repr(value)
+
+
+class ResultCache:
+    """
+    Outputs of children in a DiskCache. Every output file is an entry of
+    its own, and a JSON manifest that lists them is added last, so a child
+    is only cached when all of its outputs are.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def caches(self, child):
+        return child.algorithmId().split(':')[0] in CACHED_PROVIDERS
+
+    def key(self, child, values):
+        """
+        Returns the cache key of a child run with the parameter values,
+        leaving out the destinations.
+        """
+        destinations = {definition.name() for definition in child.algorithm().destinationParameterDefinitions()}
+        return (child.algorithmId(),) + tuple(sorted((name, key_value(value)) for name, value in values.items()
+                                                     if name not in destinations))
+
+    def load(self, key, values):
+        """
+        Copies the cached outputs of a key to the destinations in values and
+        returns the results, or None when the key is not cached.
+        """
+        manifest_path = self.cache.get(key + ('manifest',), '.json')
+        if manifest_path is None:
+            return None
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+        cached = {}
+        for name, (kind, value) in manifest.items():
+            if kind == 'file':
+                cached[name] = self.cache.get(key + (name,), value)
+                if cached[name] is None:
+                    return None
+        results = {}
+        for name, (kind, value) in manifest.items():
+            if kind != 'file':
+                results[name] = value
+                continue
+            destination = values.get(name)
+            if not isinstance(destination, str) or destination == 'TEMPORARY_OUTPUT':
+                destination = QgsProcessingUtils.generateTempFilename(name + value)
+            shutil.copyfile(cached[name], destination)
+            results[name] = destination
+        return results
+
+    def store(self, key, results):
+        """
+        Adds the outputs of a child run to the cache. Outputs that are files
+        are copied; other outputs are kept in the manifest.
+        """
+        manifest, paths = {}, []
+        for name, value in results.items():
+            if isinstance(value, str) and os.path.isfile(value):
+                suffix = os.path.splitext(value)[1]
+                temporary_path = self.cache.temporary_path(suffix)
+                shutil.copyfile(value, temporary_path)
+                paths.append(self.cache.put(key + (name,), temporary_path, suffix, keep=paths))
+                manifest[name] = ('file', suffix)
+            elif value is None or isinstance(value, (bool, int, float, str)):
+                manifest[name] = ('value', value)
+        temporary_path = self.cache.temporary_path('.json')
+        with open(temporary_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+        self.cache.put(key + ('manifest',), temporary_path, '.json', keep=paths)
+
+
+def model_outputs(model, results):
+    """
+    Returns the values of the outputs of a model from the child results.
+    """
+    outputs = {}
+    for child_id, child in active_children(model).items():
+        for output in child.modelOutputs().values():
+            if child_id in results:
+                outputs[output_parameter(child_id, output.name())] = results[child_id].get(output.childOutputName())
+    return outputs
+
+
+def run_model(model, parameters, context, feedback, cache=None, output_folder=None):
+    """
+    Runs the active children of a model in dependency order. Children of
+    the CACHED_PROVIDERS are served from a ResultCache when their inputs did
+    not change. Returns the results per child id and a list of timings with
+    the child id, algorithm id, whether it came from the cache, and its
+    start and wall time in seconds from the start of the run.
+    """
+    parameters = model_parameters(model, parameters)
+    children = active_children(model)
+    order = execution_order(child_dependencies(model))
+    results, timings = {}, []
+    started = time.perf_counter()
+    for i, child_id in enumerate(order):
+        if feedback.isCanceled():
+            break
+        child = children[child_id]
+        start = time.perf_counter()
+        values = child_parameters(model, child, parameters, results, context, output_folder)
+        key = cache.key(child, values) if cache is not None and cache.caches(child) else None
+        cached = cache.load(key, values) if key is not None else None
+        if cached is not None:
+            results[child_id] = cached
+        else:
+            feedback.pushInfo('{}: running {}'.format(child.description(), child.algorithmId()))
+            results[child_id] = processing.run(child.algorithmId(), values, context=context, feedback=feedback,
+                                               is_child_algorithm=True)
+            if key is not None:
+                cache.store(key, results[child_id])
+        timings.append(report_timing(feedback, child, cached is not None, start - started,
+                                     time.perf_counter() - start))
+        feedback.setProgress(100 * (i + 1) / len(order))
+    return results, timings
+
+
+def report_timing(feedback, child, cached, start, seconds):
+    """
+    Pushes the wall time of a child to the feedback and returns its timing.
+    """
+    feedback.pushInfo('{}: {} in {:.2f} s'.format(child.description(), 'served from the cache' if cached else 'done',
+                                                   seconds))
+    return {'child': child.childId(), 'algorithm': child.algorithmId(), 'cached': cached,
+            'start': start, 'seconds': seconds}
+
+
+def qgis_process_path():
+    """
+    Returns the path of the qgis_process executable of this installation,
+    or None when it cannot be found.
+    """
+    names = ['qgis_process-qgis.bat', 'qgis_process.exe'] if sys.platform == 'win32' else ['qgis_process']
+    for name in names:
+        path = os.path.join(QgsApplication.applicationDirPath(), name)
+        if os.path.isfile(path):
+            return path
+    for name in names:
+        path = shutil.which(name)
+        if path:
+            return path
+    return None
+
+
+def json_value(value):
+    """
+    Returns a parameter value as it can be passed to qgis_process in JSON.
+    """
+    if isinstance(value, (list, tuple)):
+        return [json_value(item) for item in value]
+    if isinstance(value, QgsMapLayer):
+        return value.source()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def run_child_process(executable, algorithm_id, values, canceled):
+    """
+    Runs one algorithm in a qgis_process worker process and returns its
+    results. The process is killed when canceled() returns True.
+    """
+    inputs = json.dumps({'inputs': {name: json_value(value) for name, value in values.items()}})
+    worker = subprocess.Popen([executable, '--json', 'run', algorithm_id, '-'], stdin=subprocess.PIPE,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    while True:
+        try:
+            output, errors = worker.communicate(inputs, timeout=POLL_INTERVAL)
+            break
+        except subprocess.TimeoutExpired:
+            # The input has been sent on the first call
+            inputs = None
+            if canceled():
+                worker.kill()
+                worker.communicate()
+                raise QgsProcessingException('{} was canceled'.format(algorithm_id))
+    if worker.returncode != 0:
+        raise QgsProcessingException('{} failed: {}'.format(algorithm_id, errors.strip() or output.strip()))
+    try:
+        return json.loads(output)['results']
+    except (ValueError, KeyError):
+        raise QgsProcessingException('{} returned no results: {}'.format(algorithm_id, output.strip()))
+
+
+def run_model_parallel(model, parameters, context, feedback, cache=None, output_folder=None, max_workers=None):
+    """
+    Runs the active children of a model like run_model, but a child starts
+    as soon as the children it depends on are done, each in a qgis_process
+    worker process of its own, with at most max_workers at the same time.
+    Falls back to run_model before QGIS 3.24 or when qgis_process is not
+    found. When a child fails, the children that are still running are
+    killed before the error is raised.
+    """
+    if Qgis.QGIS_VERSION_INT < QGIS_PROCESS_JSON_INPUT:
+        feedback.reportError('Parallel children need QGIS 3.24 or later, the children are run one by one')
+        return run_model(model, parameters, context, feedback, cache, output_folder)
+    executable = qgis_process_path()
+    if executable is None:
+        feedback.reportError('qgis_process was not found, the children are run one by one')
+        return run_model(model, parameters, context, feedback, cache, output_folder)
+
+    parameters = model_parameters(model, parameters)
+    children = active_children(model)
+    dependencies = child_dependencies(model)
+    # Fails on a cycle before anything runs
+    execution_order(dependencies)
+    pending = {child_id: set(upstream) for child_id, upstream in dependencies.items()}
+    results, timings = {}, []
+    started = time.perf_counter()
+    failed = threading.Event()
+
+    def canceled():
+        return failed.is_set() or feedback.isCanceled()
+
+    def finish(child_id):
+        for upstream in pending.values():
+            upstream.discard(child_id)
+        feedback.setProgress(100 * len(results) / len(dependencies))
+
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 1) as executor:
+        running = {}
+        while pending or running:
+            if feedback.isCanceled():
+                break
+            # Cached children finish at once and may make others ready, so
+            # this repeats until no child is ready
+            ready = sorted(child_id for child_id, upstream in pending.items() if not upstream)
+            for child_id in ready:
+                child = children[child_id]
+                del pending[child_id]
+                start = time.perf_counter()
+                values = child_parameters(model, child, parameters, results, context, output_folder)
+                key = cache.key(child, values) if cache is not None and cache.caches(child) else None
+                cached = cache.load(key, values) if key is not None else None
+                if cached is not None:
+                    results[child_id] = cached
+                    timings.append(report_timing(feedback, child, True, start - started, time.perf_counter() - start))
+                    finish(child_id)
+                    continue
+                feedback.pushInfo('{}: running {}'.format(child.description(), child.algorithmId()))
+                future = executor.submit(run_child_process, executable, child.algorithmId(), values, canceled)
+                running[future] = (child_id, key, start)
+            if ready:
+                continue
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                child_id, key, start = running.pop(future)
+                child = children[child_id]
+                try:
+                    results[child_id] = future.result()
+                except Exception:
+                    # Kill the other workers instead of waiting for them
+                    # when the executor shuts down
+                    failed.set()
+                    for other in running:
+                        other.cancel()
+                    raise
+                if key is not None:
+                    cache.store(key, results[child_id])
+                timings.append(report_timing(feedback, child, False, start - started, time.perf_counter() - start))
+                finish(child_id)
+    return results, timings
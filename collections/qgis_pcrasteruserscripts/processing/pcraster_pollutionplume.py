@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+import os
+import re
+import sys
+import threading
+
+import numpy as np
+
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
+from qgis.core import (
+    QgsCoordinateTransform,
+    QgsFeature,
+    QgsFeatureSink,
+    QgsField,
+    QgsFields,
+    QgsProcessing,
+    QgsProcessingAlgorithm,
+    QgsProcessingException,
+    QgsProcessingParameterFeatureSink,
+    QgsProcessingParameterFeatureSource,
+    QgsProcessingParameterField,
+    QgsProcessingParameterFolderDestination,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterRasterLayer,
+    QgsWkbTypes)
+
+# The shared helpers live next to this script in the scripts folder
+_SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+if _SCRIPT_FOLDER not in sys.path:
+    sys.path.append(_SCRIPT_FOLDER)
+
+from pcraster_blockio import (
+    RasterWriter,
+    cell_area,
+    check_same_grid,
+    map_ordered,
+    open_raster,
+    read_rows)
+from pcraster_ldd import StreamNetwork
+from pcraster_profiling import Profile
+
+
+def scenario_label(value, used):
+    """
+    Returns a name for the files of a scenario that is safe in a file name
+    and not yet in used, and adds it to used.
+    """
+    base = re.sub(r'[^\w.-]+', '_', str(value)).strip('_') or 'scenario'
+    label, suffix = base, 1
+    while label in used:
+        suffix += 1
+        label = '{}_{}'.format(base, suffix)
+    used.add(label)
+    return label
+
+
+class PCRasterPollutionPlumeAlgorithm(QgsProcessingAlgorithm):
+    """
+    Runs the downstream spread of many source scenarios over one flow
+    direction and friction raster, which are read only once.
+    """
+
+    INPUT_LDD = 'INPUT'
+    INPUT_FRICTION = 'INPUT_FRICTION'
+    INPUT_SOURCES = 'INPUT_SOURCES'
+    INPUT_SCENARIO = 'INPUT_SCENARIO'
+    INPUT_FIELD = 'INPUT_FIELD'
+    INPUT_INITIAL = 'INPUT_INITIAL'
+    OUTPUT_FOLDER = 'OUTPUT_FOLDER'
+    OUTPUT_SUMMARY = 'OUTPUT_SUMMARY'
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return PCRasterPollutionPlumeAlgorithm()
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'pollutionplumes'
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr('Pollution plumes')
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return self.tr('PCRaster User Scripts')
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'pcrasteruser'
+
+    def shortHelpString(self):
+        """
+        Returns a localised short helper string for the algorithm. This string
+        should provide a basic description about what the algorithm does and the
+        parameters and outputs associated with it..
+        """
+        return self.tr(
+            """Downstream pollution plumes of many source scenarios
+
+            Every scenario spreads from its source points down the flow directions, like spreadldd and spreadlddzone in the pollution model, but only downstream of the sources. The flow directions and friction are read once and the scenarios run in parallel, and every scenario writes its maps as soon as it is done, so dozens of candidate source locations are compared without running the model for each of them.
+
+            Parameters:
+
+            * <b>Input flow direction raster</b> (required) - LDD raster layer
+            * <b>Friction raster</b> (optional) - scalar raster with the friction per unit distance on the grid of the flow directions; 1 everywhere by default
+            * <b>Pollution sources</b> (required) - point layer with the sources of all scenarios
+            * <b>Scenario field</b> (optional) - field that groups the sources into scenarios; without it every source is a scenario
+            * <b>Zone field</b> (optional) - whole number field with the zone of a source, 1 or higher; by default the sources are numbered from 1
+            * <b>Initial friction distance</b> (required) - friction distance at the sources
+            * <b>Output folder</b> (required) - folder for a scalar raster distance_&lt;scenario&gt;.tif with the friction distance from the nearest source upstream and a nominal raster zone_&lt;scenario&gt;.tif with the zone of that source, per scenario
+            * <b>Plume summary</b> (required) - table with the number of sources, the number and area of the affected cells, the largest friction distance and the downstream reach length of every scenario
+            """
+        )
+
+    def initAlgorithm(self, config=None):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUT_LDD,
+                self.tr('Input flow direction raster')
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUT_FRICTION,
+                self.tr('Friction raster'),
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.INPUT_SOURCES,
+                self.tr('Pollution sources'),
+                [QgsProcessing.TypeVectorPoint]
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterField(
+                self.INPUT_SCENARIO,
+                self.tr('Scenario field'),
+                parentLayerParameterName=self.INPUT_SOURCES,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterField(
+                self.INPUT_FIELD,
+                self.tr('Zone field'),
+                parentLayerParameterName=self.INPUT_SOURCES,
+                type=QgsProcessingParameterField.Numeric,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.INPUT_INITIAL,
+                self.tr('Initial friction distance'),
+                type=QgsProcessingParameterNumber.Double,
+                minValue=0,
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                self.OUTPUT_FOLDER,
+                self.tr('Output folder')
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.OUTPUT_SUMMARY,
+                self.tr('Plume summary'),
+                QgsProcessing.TypeVector
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+
+        output_folder = self.parameterAsString(parameters, self.OUTPUT_FOLDER, context)
+        os.makedirs(output_folder, exist_ok=True)
+
+        input_ldd = self.parameterAsRasterLayer(parameters, self.INPUT_LDD, context)
+        ldd_ds = open_raster(input_ldd.dataProvider().dataSourceUri())
+        with Profile(self.name(), feedback) as profile:
+            profile.raster(ldd_ds)
+            geotransform = ldd_ds.GetGeoTransform()
+            with profile.phase('read'):
+                ldd, valid = read_rows(ldd_ds, 0, ldd_ds.RasterYSize)
+
+                friction = 1.0
+                input_friction = self.parameterAsRasterLayer(parameters, self.INPUT_FRICTION, context)
+                if input_friction is not None:
+                    friction_ds = open_raster(input_friction.dataProvider().dataSourceUri())
+                    check_same_grid(ldd_ds, friction_ds)
+                    friction, friction_valid = read_rows(friction_ds, 0, friction_ds.RasterYSize)
+                    friction = friction.astype(np.float64)
+                    valid = valid & friction_valid
+                network = StreamNetwork(ldd, valid, geotransform)
+            initial = self.parameterAsDouble(parameters, self.INPUT_INITIAL, context)
+
+            # Sources are grouped into scenarios in the order they are first met
+            source = self.parameterAsSource(parameters, self.INPUT_SOURCES, context)
+            scenario_field = self.parameterAsString(parameters, self.INPUT_SCENARIO, context)
+            zone_field = self.parameterAsString(parameters, self.INPUT_FIELD, context)
+            transform = QgsCoordinateTransform(source.sourceCrs(), input_ldd.crs(), context.transformContext())
+            height, width = ldd.shape
+            scenarios = {}
+            number = 0
+            for feature in source.getFeatures():
+                if not feature.hasGeometry():
+                    continue
+                number += 1
+                zone = number
+                if zone_field:
+                    try:
+                        zone = int(feature[zone_field])
+                    except (TypeError, ValueError):
+                        feedback.reportError('Feature {} has no zone and is skipped'.format(feature.id()))
+                        continue
+                    if zone < 1:
+                        feedback.reportError('Feature {} has zone {}, zones start at 1; it is skipped'.format(
+                            feature.id(), zone))
+                        continue
+                point = transform.transform(feature.geometry().centroid().asPoint())
+                row = int((point.y() - geotransform[3]) // geotransform[5])
+                col = int((point.x() - geotransform[0]) // geotransform[1])
+                if not (0 <= row < height and 0 <= col < width and valid[row, col]):
+                    feedback.reportError('Feature {} is not on a defined flow direction cell'.format(feature.id()))
+                    continue
+                key = feature[scenario_field] if scenario_field else number
+                cells, zones = scenarios.setdefault(key, ([], []))
+                cells.append(row * width + col)
+                zones.append(zone)
+            if not scenarios:
+                raise QgsProcessingException('None of the sources is on a defined flow direction cell')
+            feedback.pushInfo('Scenarios: {}'.format(len(scenarios)))
+
+            fields = QgsFields()
+            fields.append(QgsField('scenario', QVariant.String))
+            fields.append(QgsField('sources', QVariant.Int))
+            fields.append(QgsField('affected_cells', QVariant.Int))
+            fields.append(QgsField('affected_area', QVariant.Double))
+            fields.append(QgsField('max_distance', QVariant.Double))
+            fields.append(QgsField('reach_length', QVariant.Double))
+            (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT_SUMMARY, context, fields,
+                                                   QgsWkbTypes.NoGeometry)
+
+            area = cell_area(ldd_ds)
+            used = set()
+            items = [(scenario_label(key, used), cells, zones) for key, (cells, zones) in scenarios.items()]
+            # GDAL datasets must not be shared between threads
+            local = threading.local()
+
+            def spread(item):
+                # Every scenario writes its maps in its own worker and only
+                # returns its summary, so at most one set of full grids per
+                # worker is held at a time
+                label, cells, zones = item
+                if feedback.isCanceled():
+                    return None
+                distance, zone, length = network.spread_downstream(cells, zones, friction, initial)
+                affected = zone > 0
+                template = getattr(local, 'ds', None)
+                if template is None:
+                    template = local.ds = open_raster(input_ldd.dataProvider().dataSourceUri())
+                writer = RasterWriter(os.path.join(output_folder, 'distance_{}.tif'.format(label)), template, 'VS_SCALAR')
+                writer.write(distance.reshape(ldd.shape), affected.reshape(ldd.shape), 0)
+                writer.close()
+                writer = RasterWriter(os.path.join(output_folder, 'zone_{}.tif'.format(label)), template, 'VS_NOMINAL')
+                writer.write(zone.reshape(ldd.shape), affected.reshape(ldd.shape), 0)
+                writer.close()
+                count = int(affected.sum())
+                return [label, len(set(cells)), count, float(count * area),
+                        float(np.nanmax(distance)), float(np.nanmax(length))]
+
+            with profile.phase('spread and write'):
+                for i, attributes in enumerate(map_ordered(spread, items)):
+                    if feedback.isCanceled():
+                        return {}
+                    summary = QgsFeature(fields)
+                    summary.setAttributes(attributes)
+                    sink.addFeature(summary, QgsFeatureSink.FastInsert)
+                    feedback.setProgress(100 * (i + 1) / len(items))
+
+            results = {}
+            results[self.OUTPUT_FOLDER] = output_folder
+            results[self.OUTPUT_SUMMARY] = dest_id
+
+            return results
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+# Polygonizing labelled rasters in row bands. The bands are polygonized in a
+# thread pool and the polygons of a label that cross band seams are
+# dissolved once the last band holding that label is done, so finished
+# polygons can be written while later bands are still being processed.
+# This module contains no algorithm, so the Processing script provider
+# skips it.
+
+import numpy as np
+from osgeo import gdal, ogr
+
+from qgis.core import (
+    QgsGeometry,
+    QgsMultiPolygon,
+    QgsPolygon)
+
+from pcraster_blockio import BLOCK_CELLS, map_ordered
+
+
+class BandPolygonizer:
+    """
+    Polygonizes the integer labels of one row band with gdal.Polygonize.
+    Coordinates are relative to the top of the band, so the same instance
+    serves every band. Returns a list of (label, WKB) pairs.
+    """
+
+    def __init__(self, geotransform, eight_connected=False):
+        self.geotransform = (geotransform[0], geotransform[1], 0.0, 0.0, 0.0, geotransform[5])
+        self.options = ['8CONNECTED=8'] if eight_connected else []
+
+    def __call__(self, values, select):
+        rows, cols = values.shape
+        driver = gdal.GetDriverByName('MEM')
+        source = driver.Create('', cols, rows, 1, gdal.GDT_Int32)
+        source.SetGeoTransform(self.geotransform)
+        source.GetRasterBand(1).WriteArray(np.where(select, values, 0).astype(np.int32))
+        mask = driver.Create('', cols, rows, 1, gdal.GDT_Byte)
+        mask.GetRasterBand(1).WriteArray(select.astype(np.uint8))
+
+        target = ogr.GetDriverByName('Memory').CreateDataSource('polygons')
+        layer = target.CreateLayer('polygons')
+        layer.CreateField(ogr.FieldDefn('DN', ogr.OFTInteger))
+        gdal.Polygonize(source.GetRasterBand(1), mask.GetRasterBand(1), layer, 0, self.options)
+        return [(feature.GetField(0), bytes(feature.GetGeometryRef().ExportToWkb())) for feature in layer]
+
+
+def as_multipolygon(geometry):
+    """
+    Returns a valid geometry as a multipolygon of its polygon parts.
+    """
+    multipolygon = QgsMultiPolygon()
+    for part in geometry.makeValid().parts():
+        if isinstance(part, QgsPolygon):
+            multipolygon.addGeometry(part.clone())
+    return QgsGeometry(multipolygon)
+
+
+def dissolve(parts):
+    """
+    Returns the multipolygon of the parts of one label; parts that come from
+    different bands share an edge on the seam and are unioned.
+    """
+    if len(parts) == 1:
+        return as_multipolygon(parts[0])
+    return as_multipolygon(QgsGeometry.unaryUnion(parts))
+
+
+def merge_bands(results, windows, last_band, geotransform, feedback=None):
+    """
+    Yields (label, multipolygon) as soon as the last band holding a label has
+    been polygonized. results yields the BandPolygonizer output of the
+    windows in order and last_band maps every label to the index of the last
+    window it occurs in.
+    """
+    pending = {}
+    for i, ((yoff, ysize), polygons) in enumerate(zip(windows, results)):
+        if feedback is not None and feedback.isCanceled():
+            return
+        for label, wkb in polygons:
+            geometry = QgsGeometry()
+            geometry.fromWkb(wkb)
+            geometry.translate(0, geotransform[3] + yoff * geotransform[5])
+            pending.setdefault(label, []).append(geometry)
+        for label in [label for label in pending if last_band[label] <= i]:
+            yield label, dissolve(pending.pop(label))
+        if feedback is not None:
+            feedback.setProgress(100 * (i + 1) / len(windows))
+
+
+def polygonize_array(values, select, geotransform, eight_connected=False, feedback=None, max_workers=None):
+    """
+    Polygonizes the cells of an integer array where select is True, in row
+    bands of about BLOCK_CELLS cells, and yields (label, multipolygon) per
+    label in the order they are finished.
+    """
+    rows = max(BLOCK_CELLS // max(values.shape[1], 1), 1)
+    windows = [(yoff, min(rows, values.shape[0] - yoff)) for yoff in range(0, values.shape[0], rows)]
+
+    labels = np.where(select, values, 0)
+    last_row = np.full(labels.max() + 1 if labels.size else 1, -1)
+    np.maximum.at(last_row, labels[select], np.nonzero(select)[0])
+    last_band = {label: int(row // rows) for label, row in enumerate(last_row) if row >= 0}
+
+    polygonizer = BandPolygonizer(geotransform, eight_connected)
+    results = map_ordered(
+        lambda window: polygonizer(values[window[0]:window[0] + window[1]],
+                                   select[window[0]:window[0] + window[1]]),
+        windows, max_workers)
+    yield from merge_bands(results, windows, last_band, geotransform, feedback)
@@ -10,23 +10,8 @@
 *                                                                         *
 ***************************************************************************
 """
-from pcraster import (
-    readmap,
-    setclone,
-    scalar,
-    atan,
-    aspect,
-    cos,
-    acos,
-    sin,
-    horizontan,
-    ifthenelse,
-    sqrt,
-    slope,
-    asin,
-    directional,
-    report
-)
+import os
+import sys
 
 from qgis import processing
 from qgis.PyQt.QtCore import QCoreApplication
@@ -38,6 +23,14 @@ from qgis.core import (
     QgsProcessingParameterCrs,
     QgsProcessingParameterRasterDestination,
     QgsProcessingParameterNumber)
+
+# The shared helpers live next to this script in the scripts folder
+_SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+if _SCRIPT_FOLDER not in sys.path:
+    sys.path.append(_SCRIPT_FOLDER)
+
+from pcraster_blockio import write_field
+from pcraster_profiling import Profile
 
 class PotRadAlgorithm(QgsProcessingAlgorithm):
     """
@@ -226,6 +219,21 @@ class PotRadAlgorithm(QgsProcessingAlgorithm):
         DOY Day of Year (non-spatial)
         Time Time in hours (non-spatial)"""
    
+        from pcraster import (
+            scalar,
+            atan,
+            aspect,
+            cos,
+            acos,
+            sin,
+            horizontan,
+            ifthenelse,
+            sqrt,
+            slope,
+            asin,
+            directional
+        )
+
         # constants
         pi = 3.1415 # pi
         Sc = 1367.0 # Solar constant (Gates, 1980) [W/m2]
@@ -287,36 +295,44 @@ class PotRadAlgorithm(QgsProcessingAlgorithm):
 
     def writePCRastermaps(self,pcrastermap,outputraster,parameters,context):
         outputFilePath = self.parameterAsOutputLayer(parameters, outputraster, context)
-        report(pcrastermap,outputFilePath)
+        input_raster = self.parameterAsRasterLayer(parameters, self.INPUT_DEM, context)
+        write_field(pcrastermap, outputFilePath, input_raster.dataProvider().dataSourceUri())
         return outputFilePath
         
     def processAlgorithm(self, parameters, context, feedback):
         """
         Here is where the processing itself takes place.
         """
+        from pcraster import readmap, setclone
+
         # set clone
         input_raster = self.parameterAsRasterLayer(parameters, self.INPUT_DEM, context)
-        setclone(input_raster.dataProvider().dataSourceUri())
-        
-        # read DEM
-        DEM = readmap(input_raster.dataProvider().dataSourceUri())
+        with Profile(self.name(), feedback) as profile:
+            profile.raster(input_raster.height(), input_raster.width())
+            with profile.phase('read'):
+                setclone(input_raster.dataProvider().dataSourceUri())
+
+                # read DEM
+                DEM = readmap(input_raster.dataProvider().dataSourceUri())
 
 
-        # read parameters
-        Trans = self.parameterAsDouble(parameters, self.INPUT_TRANS, context)
-        Lat = self.parameterAsDouble(parameters, self.INPUT_LAT, context)
-        DOY = self.parameterAsDouble(parameters, self.INPUT_DOY, context)
-        Time = self.parameterAsDouble(parameters, self.INPUT_TIME, context)
+            # read parameters
+            Trans = self.parameterAsDouble(parameters, self.INPUT_TRANS, context)
+            Lat = self.parameterAsDouble(parameters, self.INPUT_LAT, context)
+            DOY = self.parameterAsDouble(parameters, self.INPUT_DOY, context)
+            Time = self.parameterAsDouble(parameters, self.INPUT_TIME, context)
 
 
-        # Calculate radiation
-        Rswd = self.Rswd(DEM, Lat, Trans, DOY, Time)
+            # Calculate radiation
+            with profile.phase('compute'):
+                Rswd = self.Rswd(DEM, Lat, Trans, DOY, Time)
         
-        # Write output rasters
-        results = {}
-        results[self.OUTPUT_DIF] = self.writePCRastermaps(Rswd[0],self.OUTPUT_DIF,parameters,context)
-        results[self.OUTPUT_DIR] = self.writePCRastermaps(Rswd[1],self.OUTPUT_DIR,parameters,context)
-        results[self.OUTPUT_TOT] = self.writePCRastermaps(Rswd[2],self.OUTPUT_TOT,parameters,context)
+            # Write output rasters
+            results = {}
+            with profile.phase('write'):
+                results[self.OUTPUT_DIF] = self.writePCRastermaps(Rswd[0],self.OUTPUT_DIF,parameters,context)
+                results[self.OUTPUT_DIR] = self.writePCRastermaps(Rswd[1],self.OUTPUT_DIR,parameters,context)
+                results[self.OUTPUT_TOT] = self.writePCRastermaps(Rswd[2],self.OUTPUT_TOT,parameters,context)
 
         
         return results
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+# Timing and memory instrumentation of the phases of a script, typically
+# reading the input maps, the PCRaster operators and writing the results.
+# Every phase reports its wall time and the peak resident memory of the
+# process after it to the feedback. When the environment variable
+# PCRASTER_PROFILE_LOG names a file, the profile of every run is appended
+# to it as one line of JSON, so the logs of nightly runs can be compared.
+# This module contains no algorithm, so the Processing script provider
+# skips it.
+
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Environment variable with the path of the JSON lines log
+PROFILE_LOG = 'PCRASTER_PROFILE_LOG'
+
+_log_lock = threading.Lock()
+
+
+def peak_rss():
+    """
+    Returns the peak resident memory of the process in bytes, or None when
+    it cannot be determined on this platform.
+    """
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return peak if sys.platform == 'darwin' else peak * 1024
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+    return None
+
+
+def format_bytes(size):
+    """
+    Returns a size in bytes as a short human readable string.
+    """
+    if size is None:
+        return 'unknown'
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return '{:.0f} {}'.format(size, unit)
+        size /= 1024
+    return '{:.1f} TB'.format(size)
+
+
+class Profile:
+    """
+    Profile of one run of a script, from its creation. Use it as a context
+    manager around processAlgorithm, so a run that is canceled or fails is
+    reported and logged as well, and time the phases with phase():
+
+        with Profile('twi', feedback) as profile:
+            profile.raster(layer.height(), layer.width())
+            with profile.phase('read'):
+                DEM = readmap(path)
+
+    The peak memory is that of the whole process since it started, so a
+    phase only shows a higher peak when it needed more memory than any
+    earlier phase.
+    """
+
+    def __init__(self, algorithm, feedback=None, log=None):
+        self.algorithm = algorithm
+        self.feedback = feedback
+        self.log = log if log is not None else os.environ.get(PROFILE_LOG)
+        self.rows = None
+        self.cols = None
+        self.phases = []
+        self.start = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        self.finish(failed=error_type is not None)
+        return False
+
+    def raster(self, rows, cols=None):
+        """
+        Records the raster dimensions of the run, from rows and cols, a GDAL
+        dataset or anything with a shape, like a NumPy array.
+        """
+        if cols is None:
+            if hasattr(rows, 'RasterYSize'):
+                rows, cols = rows.RasterYSize, rows.RasterXSize
+            else:
+                rows, cols = rows.shape[:2]
+        self.rows, self.cols = int(rows), int(cols)
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Times the code in the with block as a phase called name.
+        """
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            seconds = time.perf_counter() - start
+            peak = peak_rss()
+            self.phases.append({'name': name, 'seconds': seconds, 'peak_rss': peak})
+            if self.feedback is not None:
+                self.feedback.pushInfo('{}: {:.2f} s, peak memory {}'.format(name, seconds, format_bytes(peak)))
+
+    def record(self, failed=False):
+        """
+        Returns the profile as a dictionary.
+        """
+        cells = self.rows * self.cols if self.rows is not None else None
+        seconds = time.perf_counter() - self.start
+        return {
+            'time': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'algorithm': self.algorithm,
+            'rows': self.rows,
+            'cols': self.cols,
+            'cells': cells,
+            'seconds': seconds,
+            'cells_per_second': cells / seconds if cells and seconds > 0 else None,
+            'peak_rss': peak_rss(),
+            'failed': failed,
+            'phases': self.phases,
+        }
+
+    def finish(self, failed=False):
+        """
+        Reports the totals to the feedback and appends the profile to the
+        log, if there is one. Returns the profile as a dictionary.
+        """
+        record = self.record(failed)
+        if self.feedback is not None:
+            size = '' if record['cells'] is None else ' on {} x {} cells'.format(self.rows, self.cols)
+            self.feedback.pushInfo('{}: {:.2f} s{}, peak memory {}'.format(
+                self.algorithm, record['seconds'], size, format_bytes(record['peak_rss'])))
+        if self.log:
+            line = json.dumps(record) + '\n'
+            with _log_lock, open(self.log, 'a') as log_file:
+                log_file.write(line)
+        return record
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+import json
+import os
+import sys
+
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
+from qgis.core import (
+    QgsFeature,
+    QgsFeatureSink,
+    QgsField,
+    QgsFields,
+    QgsProcessing,
+    QgsProcessingAlgorithm,
+    QgsProcessingException,
+    QgsProcessingParameterFeatureSink,
+    QgsProcessingParameterFile,
+    QgsProcessingParameterFolderDestination,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterString,
+    QgsWkbTypes)
+
+# The shared helpers live next to this script in the scripts folder
+_SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+if _SCRIPT_FOLDER not in sys.path:
+    sys.path.append(_SCRIPT_FOLDER)
+
+from pcraster_cache import DiskCache, default_cache_folder
+from pcraster_models import (
+    ResultCache,
+    load_model,
+    model_outputs,
+    run_model,
+    run_model_parallel)
+from pcraster_profiling import Profile
+
+
+class PCRasterRunModelAlgorithm(QgsProcessingAlgorithm):
+    """
+    Runs a .model3 model child by child, or independent children at the
+    same time, and serves the PCRaster children whose inputs did not change
+    from a result cache.
+    """
+
+    INPUT_MODEL = 'INPUT'
+    INPUT_PARAMETERS = 'INPUT_PARAMETERS'
+    INPUT_CACHE = 'INPUT_CACHE'
+    INPUT_CACHE_SIZE = 'INPUT_CACHE_SIZE'
+    INPUT_WORKERS = 'INPUT_WORKERS'
+    OUTPUT_FOLDER = 'OUTPUT_FOLDER'
+    OUTPUT_TIMINGS = 'OUTPUT_TIMINGS'
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return PCRasterRunModelAlgorithm()
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'runmodelcached'
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr('Run model with result cache')
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return self.tr('PCRaster User Scripts')
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'pcrasteruser'
+
+    def shortHelpString(self):
+        """
+        Returns a localised short helper string for the algorithm. This string
+        should provide a basic description about what the algorithm does and the
+        parameters and outputs associated with it..
+        """
+        return self.tr(
+            """Runs a model and reuses the results of unchanged PCRaster steps
+
+            The children of the model are run one by one in the order of their dependencies. The outputs of every PCRaster child are cached under the algorithm, its parameters and the contents of its input files. When the model is run again, for instance with another Strahler order threshold, the children whose inputs did not change are copied from the cache and only the steps downstream of the change are run.
+
+            With more than one worker, children that do not depend on each other, like the reprojection of the outlets and the flow directions of the DEM, run at the same time in qgis_process worker processes. This needs QGIS 3.24 or later; older versions run the children one by one. When a child fails, the other running children are stopped. A child starts as soon as the children it depends on are done. The wall time of every child is reported.
+
+            Parameters:
+
+            * <b>Model</b> (required) - .model3 file
+            * <b>Model parameters</b> (optional) - JSON object with the values of the model inputs by name, for instance {"DEM": "/data/dem.tif", "threshold": 5}; inputs that are not given get their default. Model outputs are named like childid:output
+            * <b>Result cache folder</b> (optional) - folder of the cache; by default a folder in the QGIS profile
+            * <b>Result cache size</b> (required) - largest size of the cache in MB; the least recently used results are removed beyond it
+            * <b>Parallel workers</b> (required) - number of children that may run at the same time; 1 runs the children one by one in QGIS itself
+            * <b>Output folder</b> (required) - folder for the model outputs that are not given in the model parameters
+            * <b>Child timings</b> (optional) - table with the start and wall time in seconds of every child and whether it came from the cache
+            """
+        )
+
+    def initAlgorithm(self, config=None):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.INPUT_MODEL,
+                self.tr('Model'),
+                extension='model3'
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterString(
+                self.INPUT_PARAMETERS,
+                self.tr('Model parameters'),
+                multiLine=True,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.INPUT_CACHE,
+                self.tr('Result cache folder'),
+                behavior=QgsProcessingParameterFile.Folder,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.INPUT_CACHE_SIZE,
+                self.tr('Result cache size (MB)'),
+                type=QgsProcessingParameterNumber.Integer,
+                minValue=1,
+                defaultValue=2048
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.INPUT_WORKERS,
+                self.tr('Parallel workers'),
+                type=QgsProcessingParameterNumber.Integer,
+                minValue=1,
+                defaultValue=1
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                self.OUTPUT_FOLDER,
+                self.tr('Output folder')
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.OUTPUT_TIMINGS,
+                self.tr('Child timings'),
+                QgsProcessing.TypeVector,
+                optional=True,
+                createByDefault=False
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+
+        model = load_model(self.parameterAsFile(parameters, self.INPUT_MODEL, context))
+        text = self.parameterAsString(parameters, self.INPUT_PARAMETERS, context).strip()
+        try:
+            model_parameters = json.loads(text) if text else {}
+        except ValueError as error:
+            raise QgsProcessingException('The model parameters are not valid JSON: {}'.format(error))
+        if not isinstance(model_parameters, dict):
+            raise QgsProcessingException('The model parameters must be a JSON object')
+
+        output_folder = self.parameterAsString(parameters, self.OUTPUT_FOLDER, context)
+        os.makedirs(output_folder, exist_ok=True)
+        cache = ResultCache(DiskCache(self.parameterAsFile(parameters, self.INPUT_CACHE, context) or
+                                      default_cache_folder('models'),
+                                      self.parameterAsInt(parameters, self.INPUT_CACHE_SIZE, context) * 1024 * 1024))
+
+        with Profile(self.name(), feedback) as profile:
+            workers = self.parameterAsInt(parameters, self.INPUT_WORKERS, context)
+            with profile.phase('model'):
+                if workers > 1:
+                    child_results, timings = run_model_parallel(model, model_parameters, context, feedback, cache,
+                                                                output_folder, workers)
+                else:
+                    child_results, timings = run_model(model, model_parameters, context, feedback, cache, output_folder)
+            if feedback.isCanceled():
+                return {}
+            for name, value in model_outputs(model, child_results).items():
+                feedback.pushInfo('{}: {}'.format(name, value))
+
+            results = {}
+            results[self.OUTPUT_FOLDER] = output_folder
+
+            fields = QgsFields()
+            fields.append(QgsField('child', QVariant.String))
+            fields.append(QgsField('algorithm', QVariant.String))
+            fields.append(QgsField('cached', QVariant.Bool))
+            fields.append(QgsField('start', QVariant.Double))
+            fields.append(QgsField('seconds', QVariant.Double))
+            (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT_TIMINGS, context, fields,
+                                                   QgsWkbTypes.NoGeometry)
+            if sink is not None:
+                for timing in timings:
+                    row = QgsFeature(fields)
+                    row.setAttributes([timing[field.name()] for field in fields])
+                    sink.addFeature(row, QgsFeatureSink.FastInsert)
+                results[self.OUTPUT_TIMINGS] = dest_id
+
+            return results
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+import os
+import sys
+
+import numpy as np
+
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
+from qgis.core import (
+    QgsCoordinateTransform,
+    QgsFeature,
+    QgsFeatureSink,
+    QgsField,
+    QgsFields,
+    QgsGeometry,
+    QgsPointXY,
+    QgsProcessing,
+    QgsProcessingAlgorithm,
+    QgsProcessingException,
+    QgsProcessingParameterFeatureSink,
+    QgsProcessingParameterFeatureSource,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterRasterDestination,
+    QgsProcessingParameterRasterLayer,
+    QgsWkbTypes)
+
+# The shared helpers live next to this script in the scripts folder
+_SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+if _SCRIPT_FOLDER not in sys.path:
+    sys.path.append(_SCRIPT_FOLDER)
+
+from pcraster_blockio import (
+    RasterWriter,
+    open_raster,
+    read_rows)
+from pcraster_ldd import StreamNetwork, snap_points
+from pcraster_profiling import Profile
+
+
+class PCRasterSnapOutletsAlgorithm(QgsProcessingAlgorithm):
+    """
+    Snaps outlet points to the cell with the largest upstream area within a
+    tolerance, searching only the cells around every point.
+    """
+
+    INPUT_LDD = 'INPUT'
+    INPUT_POINTS = 'INPUT_POINTS'
+    INPUT_ACCUMULATION = 'INPUT_ACCUMULATION'
+    INPUT_TOLERANCE = 'INPUT_TOLERANCE'
+    OUTPUT = 'OUTPUT'
+    OUTPUT_RASTER = 'OUTPUT_RASTER'
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return PCRasterSnapOutletsAlgorithm()
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'snapoutlets'
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr('snap outlets')
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return self.tr('PCRaster User Scripts')
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'pcrasteruser'
+
+    def shortHelpString(self):
+        """
+        Returns a localised short helper string for the algorithm. This string
+        should provide a basic description about what the algorithm does and the
+        parameters and outputs associated with it..
+        """
+        return self.tr(
+            """Snap outlet points to the drainage network
+
+            Every point is moved to the cell with the largest upstream area within the snapping tolerance. Ties go to the nearest cell. Points without a defined cell within the tolerance are skipped. When several points snap to the same cell only the first one is kept, with a warning for the others.
+
+            Parameters:
+
+            * <b>Input flow direction raster</b> (required) - LDD raster layer
+            * <b>Outlet points</b> (required) - point layer with the outlets
+            * <b>Upstream area raster</b> (optional) - accumulated flux raster layer, e.g. from accuflux; it is calculated from the flow direction when not given
+            * <b>Snapping tolerance</b> (required) - search distance in map units
+            * <b>Snapped outlets</b> (required) - point layer with the snapped outlets, the attributes of the input points and the upstream area
+            * <b>Output outlet raster</b> (optional) - nominal raster with the number of the outlet at every snapped cell
+            """
+        )
+
+    def initAlgorithm(self, config=None):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUT_LDD,
+                self.tr('Input flow direction raster')
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.INPUT_POINTS,
+                self.tr('Outlet points'),
+                [QgsProcessing.TypeVectorPoint]
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUT_ACCUMULATION,
+                self.tr('Upstream area raster'),
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.INPUT_TOLERANCE,
+                self.tr('Snapping tolerance (map units)'),
+                type=QgsProcessingParameterNumber.Double,
+                minValue=0,
+                defaultValue=250
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.OUTPUT,
+                self.tr('Snapped outlets'),
+                QgsProcessing.TypeVectorPoint
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterRasterDestination(
+                self.OUTPUT_RASTER,
+                self.tr('Output outlet raster'),
+                optional=True,
+                createByDefault=False
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+
+        input_ldd = self.parameterAsRasterLayer(parameters, self.INPUT_LDD, context)
+        ldd_ds = open_raster(input_ldd.dataProvider().dataSourceUri())
+        with Profile(self.name(), feedback) as profile:
+            profile.raster(ldd_ds)
+            geotransform = ldd_ds.GetGeoTransform()
+            with profile.phase('read'):
+                ldd, valid = read_rows(ldd_ds, 0, ldd_ds.RasterYSize)
+
+            input_accumulation = self.parameterAsRasterLayer(parameters, self.INPUT_ACCUMULATION, context)
+            with profile.phase('upstream area'):
+                if input_accumulation is not None:
+                    accumulation_ds = open_raster(input_accumulation.dataProvider().dataSourceUri())
+                    if (accumulation_ds.RasterXSize, accumulation_ds.RasterYSize) != (ldd_ds.RasterXSize, ldd_ds.RasterYSize):
+                        raise QgsProcessingException('The upstream area raster must have the grid of the flow direction raster')
+                    accumulation, accumulation_valid = read_rows(accumulation_ds, 0, accumulation_ds.RasterYSize)
+                    accumulation = np.where(accumulation_valid & valid, accumulation, np.nan).astype(np.float64)
+                else:
+                    feedback.pushInfo('Calculating upstream area')
+                    network = StreamNetwork(ldd, valid, geotransform)
+                    accumulation = network.accumulate(network.cell_area()).reshape(ldd.shape)
+            if feedback.isCanceled():
+                return {}
+
+            source = self.parameterAsSource(parameters, self.INPUT_POINTS, context)
+            transform = QgsCoordinateTransform(source.sourceCrs(), input_ldd.crs(), context.transformContext())
+            features, rows, cols = [], [], []
+            for feature in source.getFeatures():
+                if not feature.hasGeometry():
+                    continue
+                point = transform.transform(feature.geometry().centroid().asPoint())
+                features.append(feature)
+                rows.append(int((point.y() - geotransform[3]) // geotransform[5]))
+                cols.append(int((point.x() - geotransform[0]) // geotransform[1]))
+            tolerance = self.parameterAsDouble(parameters, self.INPUT_TOLERANCE, context)
+            with profile.phase('snap'):
+                rows, cols = snap_points(accumulation, ~np.isnan(accumulation), np.array(rows, dtype=np.int64),
+                                         np.array(cols, dtype=np.int64), tolerance, abs(geotransform[1]), abs(geotransform[5]))
+
+            fields = QgsFields(source.fields())
+            fields.append(QgsField('outlet', QVariant.Int))
+            fields.append(QgsField('upstream_area', QVariant.Double))
+            (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT, context, fields,
+                                                   QgsWkbTypes.Point, input_ldd.crs())
+            outlets = np.full(ldd.shape, -2147483648, dtype=np.int64)
+            outlet = 0
+            for feature, row, col in zip(features, rows, cols):
+                if row < 0:
+                    feedback.reportError('Feature {} has no cells within the snapping tolerance'.format(feature.id()))
+                    continue
+                # The outlet raster has room for one outlet per cell
+                if outlets[row, col] > 0:
+                    feedback.reportError('Feature {} snaps to the cell of outlet {} and is skipped'.format(
+                        feature.id(), outlets[row, col]))
+                    continue
+                outlet += 1
+                outlets[row, col] = outlet
+                snapped = QgsFeature(fields)
+                snapped.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(
+                    geotransform[0] + (col + 0.5) * geotransform[1],
+                    geotransform[3] + (row + 0.5) * geotransform[5])))
+                snapped.setAttributes(feature.attributes() + [outlet, float(accumulation[row, col])])
+                sink.addFeature(snapped, QgsFeatureSink.FastInsert)
+            feedback.pushInfo('Snapped outlets: {}'.format(outlet))
+
+            results = {}
+            results[self.OUTPUT] = dest_id
+
+            output_raster = self.parameterAsOutputLayer(parameters, self.OUTPUT_RASTER, context)
+            if output_raster:
+                with profile.phase('write'):
+                    writer = RasterWriter(output_raster, ldd_ds, 'VS_NOMINAL')
+                    writer.write(outlets, outlets > 0, 0)
+                    results[self.OUTPUT_RASTER] = writer.close()
+
+            return results
@@ -11,19 +11,8 @@
 ***************************************************************************
 """
 
-from pcraster import (
-    readmap,
-    setclone,
-    scalar,
-    lddcreate,
-    accuflux,
-    cellarea,
-    slope,
-    atan,
-    ln,
-    tan,
-    report
-)
+import os
+import sys
 
 from math import pi
 
@@ -37,6 +26,14 @@ from qgis.core import (
     QgsProcessingParameterCrs,
     QgsProcessingParameterRasterDestination)
 
+# The shared helpers live next to this script in the scripts folder
+_SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+if _SCRIPT_FOLDER not in sys.path:
+    sys.path.append(_SCRIPT_FOLDER)
+
+from pcraster_blockio import write_field
+from pcraster_profiling import Profile
+
 #from pcraster_tools.processing.algorithm import PCRasterAlgorithm
 
 class spiAlgorithm(QgsProcessingAlgorithm):
@@ -125,23 +122,43 @@ class spiAlgorithm(QgsProcessingAlgorithm):
         )
 
     def processAlgorithm(self, parameters, context, feedback):
+        from pcraster import (
+            readmap,
+            setclone,
+            scalar,
+            lddcreate,
+            accuflux,
+            cellarea,
+            slope,
+            atan,
+            ln,
+            tan
+        )
+
         input_raster = self.parameterAsRasterLayer(parameters, self.INPUT_RASTER, context)
         output_raster = self.parameterAsRasterLayer(parameters, self.OUTPUT_RASTER, context)
-        setclone(input_raster.dataProvider().dataSourceUri())
-        DEM = readmap(input_raster.dataProvider().dataSourceUri())
-        feedback.pushInfo('Calculate flowdirection')
-        LDD = lddcreate(DEM,1e31,1e31,1e31,1e31)
-        feedback.pushInfo('Calculate Specific Catchment Area')
-        SCA = accuflux(LDD,1) * cellarea()
-        feedback.pushInfo('Calculate slope')
-        slopefraction = slope(DEM)
-        slopedegrees = atan(slopefraction)
-        sloperadians = scalar(slopedegrees) * (pi/180)
-        feedback.pushInfo('Calculate SPI')
-        SPI = ln(SCA * tan(sloperadians))
-        outputFilePath = self.parameterAsOutputLayer(parameters, self.OUTPUT_RASTER, context)
-
-        report(SPI,outputFilePath)
+        with Profile(self.name(), feedback) as profile:
+            profile.raster(input_raster.height(), input_raster.width())
+            with profile.phase('read'):
+                setclone(input_raster.dataProvider().dataSourceUri())
+                DEM = readmap(input_raster.dataProvider().dataSourceUri())
+            feedback.pushInfo('Calculate flowdirection')
+            with profile.phase('lddcreate'):
+                LDD = lddcreate(DEM,1e31,1e31,1e31,1e31)
+            feedback.pushInfo('Calculate Specific Catchment Area')
+            with profile.phase('accuflux'):
+                SCA = accuflux(LDD,1) * cellarea()
+            feedback.pushInfo('Calculate slope')
+            with profile.phase('compute'):
+                slopefraction = slope(DEM)
+                slopedegrees = atan(slopefraction)
+                sloperadians = scalar(slopedegrees) * (pi/180)
+                feedback.pushInfo('Calculate SPI')
+                SPI = ln(SCA * tan(sloperadians))
+            outputFilePath = self.parameterAsOutputLayer(parameters, self.OUTPUT_RASTER, context)
+
+            with profile.phase('write'):
+                write_field(SPI, outputFilePath, input_raster.dataProvider().dataSourceUri())
         
 #        self.set_output_crs(output_file=outputFilePath, crs=input_raster.crs(), feedback=feedback, context=context)
 
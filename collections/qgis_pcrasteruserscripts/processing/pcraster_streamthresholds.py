@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+import os
+import re
+import sys
+
+import numpy as np
+
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
+from qgis.core import (
+    QgsFeature,
+    QgsFeatureSink,
+    QgsField,
+    QgsFields,
+    QgsGeometry,
+    QgsPointXY,
+    QgsProcessing,
+    QgsProcessingAlgorithm,
+    QgsProcessingException,
+    QgsProcessingParameterEnum,
+    QgsProcessingParameterFeatureSink,
+    QgsProcessingParameterFolderDestination,
+    QgsProcessingParameterRasterDestination,
+    QgsProcessingParameterRasterLayer,
+    QgsProcessingParameterString,
+    QgsWkbTypes)
+
+# The shared helpers live next to this script in the scripts folder
+_SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+if _SCRIPT_FOLDER not in sys.path:
+    sys.path.append(_SCRIPT_FOLDER)
+
+from pcraster_blockio import (
+    RasterWriter,
+    open_raster,
+    read_rows)
+from pcraster_ldd import StreamNetwork
+from pcraster_profiling import Profile
+
+
+def parse_thresholds(text):
+    """
+    Returns the sorted, distinct thresholds of a comma separated list in
+    which an item may also be a range like 3-8 of whole numbers.
+    """
+    thresholds = set()
+    for item in text.replace(';', ',').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        match = re.match(r'^(\d+)\s*-\s*(\d+)$', item)
+        if match:
+            thresholds.update(range(int(match.group(1)), int(match.group(2)) + 1))
+            continue
+        try:
+            thresholds.add(float(item))
+        except ValueError:
+            raise QgsProcessingException('Invalid threshold: {}'.format(item))
+    if not thresholds:
+        raise QgsProcessingException('Give at least one threshold')
+    return sorted(thresholds)
+
+
+class PCRasterStreamThresholdsAlgorithm(QgsProcessingAlgorithm):
+    """
+    Extracts the stream network of an LDD for a list of thresholds from one
+    calculation of Strahler order, Shreve magnitude and upstream area.
+    """
+
+    INPUT_LDD = 'INPUT'
+    INPUT_METRIC = 'INPUT_METRIC'
+    INPUT_THRESHOLDS = 'INPUT_THRESHOLDS'
+    OUTPUT_FOLDER = 'OUTPUT_FOLDER'
+    OUTPUT_STREAMS = 'OUTPUT_STREAMS'
+    OUTPUT_JUNCTIONS = 'OUTPUT_JUNCTIONS'
+    OUTPUT_STRAHLER = 'OUTPUT_STRAHLER'
+    OUTPUT_SHREVE = 'OUTPUT_SHREVE'
+    OUTPUT_ACCUMULATION = 'OUTPUT_ACCUMULATION'
+
+    METRICS = ['Strahler order', 'Shreve magnitude', 'Upstream area']
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return PCRasterStreamThresholdsAlgorithm()
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'streamthresholds'
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr('stream networks for multiple thresholds')
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return self.tr('PCRaster User Scripts')
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'pcrasteruser'
+
+    def shortHelpString(self):
+        """
+        Returns a localised short helper string for the algorithm. This string
+        should provide a basic description about what the algorithm does and the
+        parameters and outputs associated with it..
+        """
+        return self.tr(
+            """Stream networks of a flow direction raster for a list of thresholds
+
+            Strahler order, Shreve magnitude and upstream area are calculated once, after which the streams and junctions of every threshold are extracted from them. This replaces separate runs of streamorder with a different threshold each.
+
+            Parameters:
+
+            * <b>Input flow direction raster</b> (required) - LDD raster layer
+            * <b>Threshold on</b> (required) - Strahler order, Shreve magnitude or upstream area in map units squared
+            * <b>Thresholds</b> (required) - comma separated list of thresholds; whole number ranges like 3-8 are expanded. Cells with a value of at least the threshold are streams
+            * <b>Output folder</b> (required) - folder for an ordinal raster streams_&lt;threshold&gt;.tif with the Strahler order of the streams and a nominal raster junctions_&lt;threshold&gt;.tif with the segment number at the last cell of every segment, per threshold
+            * <b>Streams</b> (required) - line layer with the stream segments of all thresholds
+            * <b>Junction outlets</b> (required) - point layer with the last cell of every stream segment of all thresholds
+            * <b>Output Strahler order raster</b> (optional) - ordinal raster
+            * <b>Output Shreve magnitude raster</b> (optional) - scalar raster
+            * <b>Output upstream area raster</b> (optional) - scalar raster in map units squared
+            """
+        )
+
+    def initAlgorithm(self, config=None):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUT_LDD,
+                self.tr('Input flow direction raster')
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.INPUT_METRIC,
+                self.tr('Threshold on'),
+                self.METRICS,
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterString(
+                self.INPUT_THRESHOLDS,
+                self.tr('Thresholds'),
+                defaultValue='3-8'
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                self.OUTPUT_FOLDER,
+                self.tr('Output folder')
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.OUTPUT_STREAMS,
+                self.tr('Streams'),
+                QgsProcessing.TypeVectorLine
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.OUTPUT_JUNCTIONS,
+                self.tr('Junction outlets'),
+                QgsProcessing.TypeVectorPoint
+            )
+        )
+
+        for output, description in ((self.OUTPUT_STRAHLER, 'Output Strahler order raster'),
+                                    (self.OUTPUT_SHREVE, 'Output Shreve magnitude raster'),
+                                    (self.OUTPUT_ACCUMULATION, 'Output upstream area raster')):
+            self.addParameter(
+                QgsProcessingParameterRasterDestination(
+                    output,
+                    self.tr(description),
+                    optional=True,
+                    createByDefault=False
+                )
+            )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+
+        thresholds = parse_thresholds(self.parameterAsString(parameters, self.INPUT_THRESHOLDS, context))
+        metric = self.parameterAsEnum(parameters, self.INPUT_METRIC, context)
+        output_folder = self.parameterAsString(parameters, self.OUTPUT_FOLDER, context)
+        os.makedirs(output_folder, exist_ok=True)
+
+        input_ldd = self.parameterAsRasterLayer(parameters, self.INPUT_LDD, context)
+        ldd_ds = open_raster(input_ldd.dataProvider().dataSourceUri())
+        with Profile(self.name(), feedback) as profile:
+            profile.raster(ldd_ds)
+            with profile.phase('read'):
+                ldd, valid = read_rows(ldd_ds, 0, ldd_ds.RasterYSize)
+                network = StreamNetwork(ldd, valid, ldd_ds.GetGeoTransform())
+
+            # The only passes over the network; every threshold reuses them
+            feedback.pushInfo('Calculating Strahler order, Shreve magnitude and upstream area')
+            with profile.phase('stream orders'):
+                strahler = network.strahler()
+                shreve = network.shreve()
+                accumulation = network.accumulate(network.cell_area())
+                values = (strahler, shreve, accumulation)[metric]
+            if feedback.isCanceled():
+                return {}
+
+            results = {}
+            with profile.phase('write'):
+                for output, grid, scale in ((self.OUTPUT_STRAHLER, strahler, 'VS_ORDINAL'),
+                                            (self.OUTPUT_SHREVE, shreve, 'VS_SCALAR'),
+                                            (self.OUTPUT_ACCUMULATION, accumulation, 'VS_SCALAR')):
+                    outputFilePath = self.parameterAsOutputLayer(parameters, output, context)
+                    if outputFilePath:
+                        writer = RasterWriter(outputFilePath, ldd_ds, scale)
+                        writer.write(grid.reshape(ldd.shape), valid, 0)
+                        results[output] = writer.close()
+
+            stream_fields = QgsFields()
+            stream_fields.append(QgsField('threshold', QVariant.Double))
+            stream_fields.append(QgsField('segment', QVariant.Int))
+            stream_fields.append(QgsField('downstream', QVariant.Int))
+            stream_fields.append(QgsField('strahler', QVariant.Int))
+            stream_fields.append(QgsField('shreve', QVariant.Double))
+            stream_fields.append(QgsField('upstream_area', QVariant.Double))
+            stream_fields.append(QgsField('length', QVariant.Double))
+            (stream_sink, stream_id) = self.parameterAsSink(parameters, self.OUTPUT_STREAMS, context, stream_fields,
+                                                            QgsWkbTypes.LineString, input_ldd.crs())
+            junction_fields = QgsFields()
+            junction_fields.append(QgsField('threshold', QVariant.Double))
+            junction_fields.append(QgsField('segment', QVariant.Int))
+            junction_fields.append(QgsField('downstream', QVariant.Int))
+            junction_fields.append(QgsField('strahler', QVariant.Int))
+            junction_fields.append(QgsField('upstream_area', QVariant.Double))
+            (junction_sink, junction_id) = self.parameterAsSink(parameters, self.OUTPUT_JUNCTIONS, context,
+                                                                junction_fields, QgsWkbTypes.Point, input_ldd.crs())
+
+            for i, threshold in enumerate(thresholds):
+                if feedback.isCanceled():
+                    return {}
+                label = '{:g}'.format(threshold)
+                feedback.pushInfo('Extracting streams for threshold {}'.format(label))
+                with profile.phase('threshold {}'.format(label)):
+                    with np.errstate(invalid='ignore'):
+                        streams = valid.ravel() & (values >= threshold)
+
+                    writer = RasterWriter(os.path.join(output_folder, 'streams_{}.tif'.format(label)), ldd_ds, 'VS_ORDINAL')
+                    writer.write(strahler.reshape(ldd.shape), streams.reshape(ldd.shape), 0)
+                    writer.close()
+
+                    segments = network.segments(streams, strahler, accumulation)
+                    junctions = np.zeros(len(streams), dtype=np.int64)
+                    junctions[segments['last']] = np.arange(1, len(segments['last']) + 1)
+                    writer = RasterWriter(os.path.join(output_folder, 'junctions_{}.tif'.format(label)), ldd_ds, 'VS_NOMINAL')
+                    writer.write(junctions.reshape(ldd.shape), (junctions > 0).reshape(ldd.shape), 0)
+                    writer.close()
+
+                    x, y = network.cell_centres(segments['vertices'])
+                    start = segments['start']
+                    junction_x, junction_y = network.cell_centres(segments['last'])
+                    for segment in range(len(segments['order'])):
+                        downstream = int(segments['downstream'][segment]) + 1
+                        points = [QgsPointXY(x[j], y[j]) for j in range(start[segment], start[segment + 1])]
+                        if len(points) > 1:
+                            stream = QgsFeature(stream_fields)
+                            stream.setGeometry(QgsGeometry.fromPolylineXY(points))
+                            stream.setAttributes([threshold, segment + 1, downstream, int(segments['order'][segment]),
+                                                  float(shreve[segments['last'][segment]]),
+                                                  float(segments['upstream_area'][segment]),
+                                                  float(segments['length'][segment])])
+                            stream_sink.addFeature(stream, QgsFeatureSink.FastInsert)
+                        junction = QgsFeature(junction_fields)
+                        junction.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(junction_x[segment], junction_y[segment])))
+                        junction.setAttributes([threshold, segment + 1, downstream, int(segments['order'][segment]),
+                                                float(segments['upstream_area'][segment])])
+                        junction_sink.addFeature(junction, QgsFeatureSink.FastInsert)
+                    feedback.pushInfo('Stream segments: {}'.format(len(segments['order'])))
+                feedback.setProgress(100 * (i + 1) / len(thresholds))
+
+            results[self.OUTPUT_FOLDER] = output_folder
+            results[self.OUTPUT_STREAMS] = stream_id
+            results[self.OUTPUT_JUNCTIONS] = junction_id
+
+            return results
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+# Subcatchment labels, topology tables and catchment polygons shared by the
+# vector subcatchment scripts. This module contains no algorithm, so the
+# Processing script provider skips it.
+
+from qgis.PyQt.QtCore import QVariant
+from qgis.core import (
+    QgsFeature,
+    QgsField,
+    QgsFields,
+    QgsProcessingException)
+
+from pcraster_blockio import open_raster, read_rows
+from pcraster_ldd import StreamNetwork, topology_table
+from pcraster_polygonize import dissolve
+
+
+def topology_fields():
+    fields = QgsFields()
+    fields.append(QgsField('catchment_id', QVariant.LongLong))
+    fields.append(QgsField('downstream_id', QVariant.LongLong))
+    fields.append(QgsField('area', QVariant.Double))
+    fields.append(QgsField('upstream_area', QVariant.Double))
+    fields.append(QgsField('outlet_x', QVariant.Double))
+    fields.append(QgsField('outlet_y', QVariant.Double))
+    fields.append(QgsField('strahler', QVariant.Int))
+    fields.append(QgsField('nest_left', QVariant.LongLong))
+    fields.append(QgsField('nest_right', QVariant.LongLong))
+    return fields
+
+
+def subcatchment_topology(ldd_path, outlets, order=None):
+    """
+    Labels the subcatchments of the outlets array, with an id above 0 at
+    every outlet cell, on the grid of an LDD raster. The table is collected
+    in the same pass over the network. Returns the network, the labels as an
+    array on the grid, 0 outside the subcatchments, and the topology table.
+    """
+    ldd_ds = open_raster(ldd_path)
+    ldd, valid = read_rows(ldd_ds, 0, ldd_ds.RasterYSize)
+    if outlets.shape != ldd.shape:
+        raise QgsProcessingException('The outlets must have the grid of the flow direction raster')
+    network = StreamNetwork(ldd, valid, ldd_ds.GetGeoTransform())
+    labels, topology = network.subcatchments(outlets, None if order is None else order.ravel())
+    return network, labels.reshape(network.shape), topology_table(network, topology)
+
+
+def topology_features(table, fields, transform):
+    """
+    Yields a feature without geometry for every row of a topology table,
+    with the outlet coordinates transformed to the destination CRS.
+    """
+    for i in range(len(table['id'])):
+        outlet = transform.transform(float(table['outlet_x'][i]), float(table['outlet_y'][i]))
+        feature = QgsFeature(fields)
+        feature.setAttributes([
+            int(table['id'][i]),
+            int(table['downstream_id'][i]),
+            float(table['area'][i]),
+            float(table['upstream_area'][i]),
+            outlet.x(),
+            outlet.y(),
+            int(table['order'][i]),
+            int(table['nest_left'][i]),
+            int(table['nest_right'][i])])
+        yield feature
+
+
+def catchment_polygons(polygons, table):
+    """
+    Assembles the whole catchment of every outlet from the (label,
+    multipolygon) subcatchment polygons of polygonize_array(): a catchment
+    is its own subcatchment dissolved with the catchments that drain into
+    it. Yields (id, multipolygon) as soon as all of those are finished, so
+    only catchments that still wait for an upstream part are kept.
+    """
+    parent = dict(zip(table['id'].tolist(), table['downstream_id'].tolist()))
+    waiting = dict.fromkeys(parent, 1)
+    for below in parent.values():
+        if below in waiting:
+            waiting[below] += 1
+    parts = {}
+    for label, polygon in polygons:
+        finished = [(label, polygon)]
+        while finished:
+            label, polygon = finished.pop()
+            parts.setdefault(label, []).append(polygon)
+            waiting[label] -= 1
+            if waiting[label] == 0:
+                catchment = dissolve(parts.pop(label))
+                yield label, catchment
+                if parent[label] in waiting:
+                    finished.append((parent[label], catchment))
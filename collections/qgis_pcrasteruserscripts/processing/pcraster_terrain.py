@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+import math
+import os
+import sys
+
+import numpy as np
+
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (
+    QgsProcessingException,
+    QgsProcessingAlgorithm,
+    QgsProcessingParameterRasterLayer,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterRasterDestination)
+
+# The shared helpers live next to this script in the scripts folder
+_SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+if _SCRIPT_FOLDER not in sys.path:
+    sys.path.append(_SCRIPT_FOLDER)
+
+from pcraster_blockio import (
+    RasterWriter,
+    map_blocks,
+    open_raster,
+    row_windows)
+from pcraster_profiling import Profile
+
+
+class TerrainTile:
+    """
+    Calculates the selected terrain derivatives of one row band of a DEM
+    read with a halo of one cell. The 3x3 neighbourhood is read once: slope,
+    aspect and hillshade use the Horn gradient, the curvatures the second
+    order terms of the Zevenbergen-Thorne polynomial. Missing neighbours get
+    the elevation of the centre cell, like PCRaster does.
+    """
+
+    def __init__(self, outputs, cell_width, cell_height, azimuth=315.0, altitude=45.0):
+        self.outputs = outputs
+        self.cell_width = cell_width
+        self.cell_height = cell_height
+        self.azimuth = math.radians(azimuth)
+        self.zenith = math.radians(90.0 - altitude)
+
+    def __call__(self, values, valid):
+        values = values.astype(np.float64)
+        centre = values[1:-1, 1:-1]
+        rows, cols = centre.shape
+
+        def z(dr, dc):
+            window = (slice(1 + dr, 1 + dr + rows), slice(1 + dc, 1 + dc + cols))
+            return np.where(valid[window], values[window], centre)
+
+        # z1 z2 z3 are the north row, z7 z8 z9 the south row
+        z1, z2, z3 = z(-1, -1), z(-1, 0), z(-1, 1)
+        z4, z6 = z(0, -1), z(0, 1)
+        z7, z8, z9 = z(1, -1), z(1, 0), z(1, 1)
+        dx, dy = self.cell_width, self.cell_height
+
+        results = {}
+        with np.errstate(all='ignore'):
+            if self.outputs & {'slope', 'aspect', 'hillshade'}:
+                # Gradient towards the east and the north
+                gx = ((z3 + 2 * z6 + z9) - (z1 + 2 * z4 + z7)) / (8 * dx)
+                gy = ((z1 + 2 * z2 + z3) - (z7 + 2 * z8 + z9)) / (8 * dy)
+                slope = np.hypot(gx, gy)
+                # Direction of the steepest descent, clockwise from the north
+                aspect = np.where(slope == 0, -1.0, np.degrees(np.arctan2(-gx, -gy)) % 360.0)
+                if 'slope' in self.outputs:
+                    results['slope'] = slope
+                if 'aspect' in self.outputs:
+                    results['aspect'] = aspect
+                if 'hillshade' in self.outputs:
+                    angle = np.arctan(slope)
+                    shade = (np.cos(self.zenith) * np.cos(angle) +
+                             np.sin(self.zenith) * np.sin(angle) * np.cos(self.azimuth - np.radians(aspect)))
+                    results['hillshade'] = 255.0 * np.clip(np.where(slope == 0, np.cos(self.zenith), shade), 0, 1)
+
+            if self.outputs & {'plancurv', 'profcurv', 'curvature'}:
+                d = ((z4 + z6) / 2 - centre) / (dx * dx)
+                e = ((z2 + z8) / 2 - centre) / (dy * dy)
+                f = (-z1 + z3 + z7 - z9) / (4 * dx * dy)
+                g = (z6 - z4) / (2 * dx)
+                h = (z2 - z8) / (2 * dy)
+                gradient = g * g + h * h
+                flat = gradient == 0
+                # Signs follow PCRaster: negative at concave, positive at convex slopes
+                if 'plancurv' in self.outputs:
+                    plancurv = -2 * (d * h * h + e * g * g - f * g * h) / gradient
+                    results['plancurv'] = np.where(flat, 0.0, plancurv)
+                if 'profcurv' in self.outputs:
+                    profcurv = -2 * (d * g * g + e * h * h + f * g * h) / gradient
+                    results['profcurv'] = np.where(flat, 0.0, profcurv)
+                if 'curvature' in self.outputs:
+                    results['curvature'] = -2 * (d + e)
+
+        return results, valid[1:-1, 1:-1]
+
+
+class PCRasterTerrainAlgorithm(QgsProcessingAlgorithm):
+    """
+    Calculates slope, aspect, plan, profile and total curvature and a
+    hillshade from one block-wise, multi-threaded read of a DEM.
+    """
+
+    INPUT_DEM = 'INPUT'
+    INPUT_AZIMUTH = 'INPUT_AZIMUTH'
+    INPUT_ALTITUDE = 'INPUT_ALTITUDE'
+    OUTPUT_SLOPE = 'OUTPUT_SLOPE'
+    OUTPUT_ASPECT = 'OUTPUT_ASPECT'
+    OUTPUT_PLANCURV = 'OUTPUT_PLANCURV'
+    OUTPUT_PROFCURV = 'OUTPUT_PROFCURV'
+    OUTPUT_CURVATURE = 'OUTPUT_CURVATURE'
+    OUTPUT_HILLSHADE = 'OUTPUT_HILLSHADE'
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return PCRasterTerrainAlgorithm()
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'terrainderivatives'
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr('terrain derivatives')
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return self.tr('PCRaster User Scripts')
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'pcrasteruser'
+
+    def shortHelpString(self):
+        """
+        Returns a localised short helper string for the algorithm. This string
+        should provide a basic description about what the algorithm does and the
+        parameters and outputs associated with it..
+        """
+        return self.tr(
+            """Slope, aspect, curvatures and hillshade of a digital elevation model in one pass
+
+            The 3x3 neighbourhood of every cell is read once and only the selected outputs are calculated. This replaces separate runs of slope, aspect, plancurv and profcurv.
+
+            Parameters:
+
+            * <b>Input DEM</b> (required) - scalar raster layer
+            * <b>Hillshade azimuth</b> (optional) - direction of the light source in degrees clockwise from the north
+            * <b>Hillshade altitude</b> (optional) - angle of the light source above the horizon in degrees
+            * <b>Output slope raster</b> (optional) - scalar raster with slope in fraction
+            * <b>Output aspect raster</b> (optional) - directional raster with aspect, -1 on flat cells
+            * <b>Output planform curvature raster</b> (optional) - scalar raster, negative at concave and positive at convex slopes
+            * <b>Output profile curvature raster</b> (optional) - scalar raster, negative at concave and positive at convex slopes
+            * <b>Output total curvature raster</b> (optional) - scalar raster, negative at concave and positive at convex surfaces
+            * <b>Output hillshade raster</b> (optional) - scalar raster with values from 0 to 255
+            """
+        )
+
+    def initAlgorithm(self, config=None):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUT_DEM,
+                self.tr('Input DEM')
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.INPUT_AZIMUTH,
+                self.tr('Hillshade azimuth'),
+                type=QgsProcessingParameterNumber.Double,
+                defaultValue=315.0,
+                minValue=0.0,
+                maxValue=360.0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.INPUT_ALTITUDE,
+                self.tr('Hillshade altitude'),
+                type=QgsProcessingParameterNumber.Double,
+                defaultValue=45.0,
+                minValue=0.0,
+                maxValue=90.0
+            )
+        )
+
+        for output, description in ((self.OUTPUT_SLOPE, 'Output slope raster'),
+                                    (self.OUTPUT_ASPECT, 'Output aspect raster'),
+                                    (self.OUTPUT_PLANCURV, 'Output planform curvature raster'),
+                                    (self.OUTPUT_PROFCURV, 'Output profile curvature raster'),
+                                    (self.OUTPUT_CURVATURE, 'Output total curvature raster'),
+                                    (self.OUTPUT_HILLSHADE, 'Output hillshade raster')):
+            self.addParameter(
+                QgsProcessingParameterRasterDestination(
+                    output,
+                    self.tr(description),
+                    optional=True,
+                    createByDefault=output == self.OUTPUT_SLOPE
+                )
+            )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+
+        input_dem = self.parameterAsRasterLayer(parameters, self.INPUT_DEM, context)
+        path = input_dem.dataProvider().dataSourceUri()
+        dem = open_raster(path)
+        geotransform = dem.GetGeoTransform()
+
+        with Profile(self.name(), feedback) as profile:
+            profile.raster(dem)
+            writers = {}
+            for output, derivative, scale in ((self.OUTPUT_SLOPE, 'slope', 'VS_SCALAR'),
+                                              (self.OUTPUT_ASPECT, 'aspect', 'VS_DIRECTION'),
+                                              (self.OUTPUT_PLANCURV, 'plancurv', 'VS_SCALAR'),
+                                              (self.OUTPUT_PROFCURV, 'profcurv', 'VS_SCALAR'),
+                                              (self.OUTPUT_CURVATURE, 'curvature', 'VS_SCALAR'),
+                                              (self.OUTPUT_HILLSHADE, 'hillshade', 'VS_SCALAR')):
+                outputFilePath = self.parameterAsOutputLayer(parameters, output, context)
+                if outputFilePath:
+                    writers[output, derivative] = RasterWriter(outputFilePath, dem, scale)
+            if not writers:
+                raise QgsProcessingException('Select at least one output raster')
+
+            tile = TerrainTile(
+                {derivative for _, derivative in writers},
+                abs(geotransform[1]),
+                abs(geotransform[5]),
+                self.parameterAsDouble(parameters, self.INPUT_AZIMUTH, context),
+                self.parameterAsDouble(parameters, self.INPUT_ALTITUDE, context))
+            with profile.phase('derivatives'):
+                windows = row_windows(dem)
+                for i, (derivatives, valid) in enumerate(map_blocks(path, windows, tile, halo=1)):
+                    if feedback.isCanceled():
+                        return {}
+                    for (output, derivative), writer in writers.items():
+                        writer.write(derivatives[derivative], valid, windows[i][0])
+                    feedback.setProgress(100 * (i + 1) / len(windows))
+
+                results = {}
+                for (output, derivative), writer in writers.items():
+                    results[output] = writer.close()
+
+            return results
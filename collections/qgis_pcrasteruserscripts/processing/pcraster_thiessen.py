@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+import os
+import sys
+
+import numpy as np
+
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
+from qgis.core import (
+    QgsFeature,
+    QgsFeatureSink,
+    QgsField,
+    QgsFields,
+    QgsProcessing,
+    QgsProcessingAlgorithm,
+    QgsProcessingException,
+    QgsProcessingParameterExtent,
+    QgsProcessingParameterFeatureSink,
+    QgsProcessingParameterFeatureSource,
+    QgsProcessingParameterField,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterRasterDestination,
+    QgsWkbTypes)
+
+# The shared helpers live next to this script in the scripts folder
+_SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+if _SCRIPT_FOLDER not in sys.path:
+    sys.path.append(_SCRIPT_FOLDER)
+
+from pcraster_blockio import (
+    RasterWriter,
+    grid_template,
+    map_ordered,
+    row_windows)
+from pcraster_interpolate import PointIndex, nearest_points
+from pcraster_polygonize import polygonize_array
+from pcraster_profiling import Profile
+
+
+class PCRasterThiessenAlgorithm(QgsProcessingAlgorithm):
+    """
+    Assigns every cell to its nearest point with one KD-tree query per row
+    band and writes the Thiessen zones as a raster and as polygons.
+    """
+
+    INPUT_POINTS = 'INPUT'
+    INPUT_FIELD = 'INPUT_FIELD'
+    INPUT_EXTENT = 'INPUT_EXTENT'
+    INPUT_RESOLUTION = 'INPUT_RESOLUTION'
+    OUTPUT = 'OUTPUT'
+    OUTPUT_POLYGONS = 'OUTPUT_POLYGONS'
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return PCRasterThiessenAlgorithm()
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'thiessenpolygons'
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr('Thiessen polygons')
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return self.tr('PCRaster User Scripts')
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'pcrasteruser'
+
+    def shortHelpString(self):
+        """
+        Returns a localised short helper string for the algorithm. This string
+        should provide a basic description about what the algorithm does and the
+        parameters and outputs associated with it..
+        """
+        return self.tr(
+            """Thiessen polygons of a point layer
+
+            Every cell gets the value of the nearest point, using the Euclidean distance between the cell centre and the point. This replaces the thiessen model, which rasterizes the points and grows zones from them with spreadzone and areamaximum. The raster and the polygons come from the same zones.
+
+            Parameters:
+
+            * <b>Point vector layer</b> (required) - point layer with the stations
+            * <b>Interpolation field</b> (optional) - numeric field with the value of every station; without it the zones are numbered after the stations
+            * <b>Extent</b> (optional) - extent of the output; by default the extent of the points
+            * <b>Spatial resolution</b> (required) - cell size in map units of the point layer
+            * <b>Thiessen polygons raster</b> (optional) - scalar raster with the field value, or nominal raster with the station number, of the nearest point
+            * <b>Thiessen polygons</b> (optional) - polygon layer with the zone of every station and its attributes
+            """
+        )
+
+    def initAlgorithm(self, config=None):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.INPUT_POINTS,
+                self.tr('Point vector layer'),
+                [QgsProcessing.TypeVectorPoint]
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterField(
+                self.INPUT_FIELD,
+                self.tr('Interpolation field'),
+                parentLayerParameterName=self.INPUT_POINTS,
+                type=QgsProcessingParameterField.Numeric,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterExtent(
+                self.INPUT_EXTENT,
+                self.tr('Extent'),
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.INPUT_RESOLUTION,
+                self.tr('Spatial resolution (map units)'),
+                type=QgsProcessingParameterNumber.Double,
+                minValue=0,
+                defaultValue=30
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterRasterDestination(
+                self.OUTPUT,
+                self.tr('Thiessen polygons raster'),
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.OUTPUT_POLYGONS,
+                self.tr('Thiessen polygons'),
+                QgsProcessing.TypeVectorPolygon,
+                optional=True
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+
+        source = self.parameterAsSource(parameters, self.INPUT_POINTS, context)
+        field = self.parameterAsString(parameters, self.INPUT_FIELD, context)
+        features, x, y, values = [], [], [], []
+        for feature in source.getFeatures():
+            if not feature.hasGeometry():
+                continue
+            point = feature.geometry().centroid().asPoint()
+            features.append(feature)
+            x.append(point.x())
+            y.append(point.y())
+            if field:
+                try:
+                    values.append(float(feature[field]))
+                except (TypeError, ValueError):
+                    values.append(np.nan)
+        if not features:
+            raise QgsProcessingException('The point layer has no points')
+
+        extent = self.parameterAsExtent(parameters, self.INPUT_EXTENT, context, source.sourceCrs())
+        if extent.isNull() or extent.isEmpty():
+            extent = source.sourceExtent()
+        resolution = self.parameterAsDouble(parameters, self.INPUT_RESOLUTION, context)
+        if resolution <= 0:
+            raise QgsProcessingException('The spatial resolution must be larger than 0')
+        template = grid_template((extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum()),
+                                 resolution, source.sourceCrs().toWkt())
+        geotransform = template.GetGeoTransform()
+        feedback.pushInfo('Grid of {} rows and {} columns'.format(template.RasterYSize, template.RasterXSize))
+
+        with Profile(self.name(), feedback) as profile:
+            profile.raster(template)
+            results = {}
+            outputFilePath = self.parameterAsOutputLayer(parameters, self.OUTPUT, context)
+            writer = None
+            if outputFilePath:
+                writer = RasterWriter(outputFilePath, template, 'VS_SCALAR' if field else 'VS_NOMINAL')
+            station_values = np.array(values, dtype=np.float64) if field else np.arange(1, len(features) + 1)
+
+            # Stations are numbered from 1 in the zone array, 0 is outside
+            index = PointIndex(x, y)
+            zones = np.zeros((template.RasterYSize, template.RasterXSize), dtype=np.int32)
+
+            def nearest(window):
+                yoff, ysize = window
+                rows, cols = np.mgrid[yoff:yoff + ysize, 0:template.RasterXSize]
+                station, _ = nearest_points(index,
+                                            geotransform[0] + (cols.ravel() + 0.5) * geotransform[1],
+                                            geotransform[3] + (rows.ravel() + 0.5) * geotransform[5])
+                return station.reshape(ysize, template.RasterXSize)
+
+            with profile.phase('nearest station'):
+                windows = row_windows(template)
+                for i, station in enumerate(map_ordered(nearest, windows)):
+                    if feedback.isCanceled():
+                        return {}
+                    yoff, ysize = windows[i]
+                    zones[yoff:yoff + ysize] = station + 1
+                    if writer is not None:
+                        band = station_values[station]
+                        writer.write(band, ~np.isnan(band) if field else np.ones(band.shape, dtype=bool), yoff)
+                    feedback.setProgress(50 * (i + 1) / len(windows))
+                if writer is not None:
+                    results[self.OUTPUT] = writer.close()
+
+            fields = QgsFields(source.fields())
+            fields.append(QgsField('station', QVariant.Int))
+            (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT_POLYGONS, context, fields,
+                                                   QgsWkbTypes.MultiPolygon, source.sourceCrs())
+            if sink is not None:
+                with profile.phase('polygonize'):
+                    feedback.pushInfo('Polygonizing the zones')
+                    for station, geometry in polygonize_array(zones, zones > 0, geotransform):
+                        if feedback.isCanceled():
+                            return {}
+                        polygon = QgsFeature(fields)
+                        polygon.setGeometry(geometry)
+                        polygon.setAttributes(features[station - 1].attributes() + [int(station)])
+                        sink.addFeature(polygon, QgsFeatureSink.FastInsert)
+                    results[self.OUTPUT_POLYGONS] = dest_id
+
+            return results
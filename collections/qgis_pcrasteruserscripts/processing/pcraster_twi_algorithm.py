@@ -11,17 +11,8 @@
 ***************************************************************************
 """
 
-from pcraster import (
-    readmap,
-    setclone,
-    cellarea,
-    slope,
-    lddcreate,
-    accuflux,
-    ln,
-    tan,
-    report
-)
+import os
+import sys
 
 from qgis import processing
 from qgis.PyQt.QtCore import QCoreApplication
@@ -33,6 +24,14 @@ from qgis.core import (
     QgsProcessingParameterCrs,
     QgsProcessingParameterRasterDestination)
 
+# The shared helpers live next to this script in the scripts folder
+_SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+if _SCRIPT_FOLDER not in sys.path:
+    sys.path.append(_SCRIPT_FOLDER)
+
+from pcraster_blockio import write_field
+from pcraster_profiling import Profile
+
 #from pcraster_tools.processing.algorithm import PCRasterAlgorithm
 
 class TwiAlgorithm(QgsProcessingAlgorithm):
@@ -121,25 +120,32 @@ class TwiAlgorithm(QgsProcessingAlgorithm):
         )
 
     def processAlgorithm(self, parameters, context, feedback):
+        from pcraster import readmap, setclone, cellarea, slope, lddcreate, accuflux, ln, tan
+
         input_raster = self.parameterAsRasterLayer(parameters, self.INPUT_RASTER, context)
         output_raster = self.parameterAsRasterLayer(parameters, self.OUTPUT_RASTER, context)
-        setclone(input_raster.dataProvider().dataSourceUri())
-        DTM = readmap(input_raster.dataProvider().dataSourceUri())
-        # Calculate Slope
-        SlopeFraction = slope(DTM)
-        SlopePercentage = SlopeFraction * 100
-        SlopeRadians = SlopePercentage * 0.062831853071796
-        
-        # Calculate Flow Accumulation
-        LDD = lddcreate(DTM,1E31,1E31,1E31,1E31)
-        FlowAccumulation = accuflux(LDD,1)
-        
-        # Calculate TWI
-        TWI = ln((FlowAccumulation * cellarea())/tan(SlopeRadians))
-
-        outputFilePath = self.parameterAsOutputLayer(parameters, self.OUTPUT_RASTER, context)
-
-        report(TWI,outputFilePath)
+        with Profile(self.name(), feedback) as profile:
+            profile.raster(input_raster.height(), input_raster.width())
+            with profile.phase('read'):
+                setclone(input_raster.dataProvider().dataSourceUri())
+                DTM = readmap(input_raster.dataProvider().dataSourceUri())
+            with profile.phase('compute'):
+                # Calculate Slope
+                SlopeFraction = slope(DTM)
+                SlopePercentage = SlopeFraction * 100
+                SlopeRadians = SlopePercentage * 0.062831853071796
+
+                # Calculate Flow Accumulation
+                LDD = lddcreate(DTM,1E31,1E31,1E31,1E31)
+                FlowAccumulation = accuflux(LDD,1)
+
+                # Calculate TWI
+                TWI = ln((FlowAccumulation * cellarea())/tan(SlopeRadians))
+
+            outputFilePath = self.parameterAsOutputLayer(parameters, self.OUTPUT_RASTER, context)
+
+            with profile.phase('write'):
+                write_field(TWI, outputFilePath, input_raster.dataProvider().dataSourceUri())
         
 #        self.set_output_crs(output_file=outputFilePath, crs=input_raster.crs(), feedback=feedback, context=context)
 
@@ -0,0 +1,430 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+import csv
+import os
+import sys
+
+import numpy as np
+from osgeo import gdal
+
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (
+    QgsProcessingException,
+    QgsProcessingAlgorithm,
+    QgsProcessingParameterRasterLayer,
+    QgsProcessingParameterEnum,
+    QgsProcessingParameterFileDestination,
+    QgsProcessingParameterRasterDestination)
+
+# The shared helpers live next to this script in the scripts folder
+_SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+if _SCRIPT_FOLDER not in sys.path:
+    sys.path.append(_SCRIPT_FOLDER)
+
+from pcraster_blockio import (
+    RasterWriter,
+    cell_area,
+    check_same_grid,
+    open_raster,
+    read_rows,
+    row_windows)
+from pcraster_profiling import Profile
+
+# Statistics in the order of the enum parameter, with the value scale of the
+# broadcast raster. None means the value scale of the input values.
+STATISTICS = [
+    ('count', 'VS_SCALAR'),
+    ('area', 'VS_SCALAR'),
+    ('total', 'VS_SCALAR'),
+    ('average', 'VS_SCALAR'),
+    ('minimum', None),
+    ('maximum', None),
+    ('stddev', 'VS_SCALAR'),
+    ('majority', None),
+    ('diversity', 'VS_SCALAR'),
+]
+
+
+def value_scale(ds):
+    """
+    Returns the PCRaster value scale of the value raster. A raster without
+    one is nominal when its cells are integers and scalar otherwise.
+    """
+    scale = ds.GetMetadataItem('PCRASTER_VALUESCALE')
+    if scale:
+        return scale
+    if ds.GetRasterBand(1).DataType in (gdal.GDT_Float32, gdal.GDT_Float64):
+        return 'VS_SCALAR'
+    return 'VS_NOMINAL'
+
+
+class ZoneStatistics:
+    """
+    Accumulates per-zone statistics over blocks of a class raster and a value
+    raster. Means and variances are merged with Chan's parallel algorithm so
+    the result does not depend on the block size.
+    """
+
+    def __init__(self, histogram=False):
+        self.zones = np.empty(0, dtype=np.int64)
+        self.cells = np.empty(0, dtype=np.int64)
+        self.count = np.empty(0, dtype=np.int64)
+        self.mean = np.empty(0, dtype=np.float64)
+        self.m2 = np.empty(0, dtype=np.float64)
+        self.minimum = np.empty(0, dtype=np.float64)
+        self.maximum = np.empty(0, dtype=np.float64)
+        self.histogram = histogram
+        # Sorted (zone, value) pairs as complex numbers, which numpy orders by
+        # the real part first, with the number of cells of every pair
+        self.pair_keys = np.empty(0, dtype=np.complex128)
+        self.pair_counts = np.empty(0, dtype=np.int64)
+
+    def _add_zones(self, zones):
+        merged = np.union1d(self.zones, zones)
+        if len(merged) == len(self.zones):
+            return
+        index = np.searchsorted(merged, self.zones)
+        for name, fill in (('cells', 0), ('count', 0), ('mean', 0.0), ('m2', 0.0),
+                           ('minimum', np.inf), ('maximum', -np.inf)):
+            old = getattr(self, name)
+            new = np.full(len(merged), fill, dtype=old.dtype)
+            new[index] = old
+            setattr(self, name, new)
+        self.zones = merged
+
+    def update(self, classes, class_valid, values, value_valid):
+        """
+        Adds a block of class and value cells.
+        """
+        zones, cells = np.unique(classes[class_valid].astype(np.int64), return_counts=True)
+        self._add_zones(zones)
+        self.cells[np.searchsorted(self.zones, zones)] += cells
+
+        selected = class_valid & value_valid
+        zone_of_cell = classes[selected].astype(np.int64)
+        value_of_cell = values[selected].astype(np.float64)
+        if len(zone_of_cell) == 0:
+            return
+        zones, inverse, count = np.unique(zone_of_cell, return_inverse=True, return_counts=True)
+        mean = np.bincount(inverse, weights=value_of_cell) / count
+        deviation = value_of_cell - mean[inverse]
+        m2 = np.bincount(inverse, weights=deviation * deviation)
+
+        order = np.argsort(inverse, kind='stable')
+        starts = np.concatenate(([0], np.cumsum(count)[:-1]))
+        minimum = np.minimum.reduceat(value_of_cell[order], starts)
+        maximum = np.maximum.reduceat(value_of_cell[order], starts)
+
+        index = np.searchsorted(self.zones, zones)
+        count_a = self.count[index]
+        total_count = count_a + count
+        delta = mean - self.mean[index]
+        self.mean[index] += delta * count / total_count
+        self.m2[index] += m2 + delta * delta * count_a * count / total_count
+        self.count[index] = total_count
+        self.minimum[index] = np.minimum(self.minimum[index], minimum)
+        self.maximum[index] = np.maximum(self.maximum[index], maximum)
+
+        if self.histogram:
+            self._update_histogram(zone_of_cell, value_of_cell)
+
+    def _update_histogram(self, zones, values):
+        # Only the pairs of the block are sorted; they are merged into the
+        # running table without sorting it again
+        keys, counts = np.unique(zones + 1j * values, return_counts=True)
+        index = np.searchsorted(self.pair_keys, keys)
+        found = index < len(self.pair_keys)
+        found[found] = self.pair_keys[index[found]] == keys[found]
+        self.pair_counts[index[found]] += counts[found]
+        self.pair_keys = np.insert(self.pair_keys, index[~found], keys[~found])
+        self.pair_counts = np.insert(self.pair_counts, index[~found], counts[~found])
+
+    def result(self, statistic, area):
+        """
+        Returns the values of a statistic for all zones, NaN where a zone has
+        no defined values.
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            defined = self.count > 0
+            if statistic == 'count':
+                return self.cells.astype(np.float64)
+            if statistic == 'area':
+                return self.cells * area
+            if statistic == 'total':
+                return np.where(defined, self.mean * self.count, np.nan)
+            if statistic == 'average':
+                return np.where(defined, self.mean, np.nan)
+            if statistic == 'minimum':
+                return np.where(defined, self.minimum, np.nan)
+            if statistic == 'maximum':
+                return np.where(defined, self.maximum, np.nan)
+            if statistic == 'stddev':
+                return np.where(defined, np.sqrt(self.m2 / self.count), np.nan)
+        result = np.full(len(self.zones), np.nan)
+        if len(self.pair_keys) == 0:
+            return result
+        pair_zones = self.pair_keys.real.astype(np.int64)
+        pair_values = self.pair_keys.imag
+        index = np.searchsorted(self.zones, pair_zones)
+        if statistic == 'diversity':
+            result[defined] = 0
+            np.add.at(result, index, 1)
+            return result
+        # majority: most frequent value, the highest value on ties
+        order = np.lexsort((pair_values, self.pair_counts, pair_zones))
+        last = np.ones(len(order), dtype=bool)
+        last[:-1] = pair_zones[order][1:] != pair_zones[order][:-1]
+        winners = order[last]
+        result[index[winners]] = pair_values[winners]
+        return result
+
+
+class PCRasterZonalStatisticsAlgorithm(QgsProcessingAlgorithm):
+    """
+    Calculates several statistics per class of a class raster in a single
+    block-wise pass over the class and value rasters.
+    """
+
+    INPUT_DISCRETE = 'INPUT'
+    INPUT_SCALAR = 'INPUT2'
+    INPUT_STATISTICS = 'INPUT3'
+    OUTPUT_TABLE = 'OUTPUT'
+    OUTPUT_COUNT = 'OUTPUT_COUNT'
+    OUTPUT_AREA = 'OUTPUT_AREA'
+    OUTPUT_TOTAL = 'OUTPUT_TOTAL'
+    OUTPUT_AVERAGE = 'OUTPUT_AVERAGE'
+    OUTPUT_MINIMUM = 'OUTPUT_MINIMUM'
+    OUTPUT_MAXIMUM = 'OUTPUT_MAXIMUM'
+    OUTPUT_STDDEV = 'OUTPUT_STDDEV'
+    OUTPUT_MAJORITY = 'OUTPUT_MAJORITY'
+    OUTPUT_DIVERSITY = 'OUTPUT_DIVERSITY'
+
+    def tr(self, string):
+        """
+        Returns a translatable string with the self.tr() function.
+        """
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return PCRasterZonalStatisticsAlgorithm()
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'zonalstatistics'
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr('zonalstatistics')
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return self.tr('PCRaster User Scripts')
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return 'pcrasteruser'
+
+    def shortHelpString(self):
+        """
+        Returns a localised short helper string for the algorithm. This string
+        should provide a basic description about what the algorithm does and the
+        parameters and outputs associated with it..
+        """
+        return self.tr(
+            """Statistics of the cell values per class, calculated in one pass
+
+            Replaces separate runs of areaarea, areatotal, areaaverage, areaminimum, areamaximum, areamajority and areadiversity.
+
+            Parameters:
+
+            * <b>Input class raster layer</b> (required) - boolean, nominal or ordinal raster layer
+            * <b>Input value raster layer</b> (required) - raster layer with the values to summarize
+            * <b>Statistics</b> (required) - statistics to calculate; majority and diversity need a boolean, nominal or ordinal value raster, as areamajority and areadiversity do. A value raster without a PCRaster value scale is taken as nominal when its cells are integers and as scalar otherwise
+            * <b>Output zone table</b> (optional) - CSV or Parquet table with one row per class
+            * <b>Output ... raster</b> (optional) - raster with the statistic of each class assigned to its cells, as the area operators do
+            """
+        )
+
+    def initAlgorithm(self, config=None):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUT_DISCRETE,
+                self.tr('Class raster layer')
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUT_SCALAR,
+                self.tr('Value raster layer')
+            )
+        )
+
+        self.statisticoption = [self.tr('Count'), self.tr('Area'), self.tr('Total'), self.tr('Average'),
+                                self.tr('Minimum'), self.tr('Maximum'), self.tr('Standard deviation'),
+                                self.tr('Majority'), self.tr('Diversity')]
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.INPUT_STATISTICS,
+                self.tr('Statistics'),
+                self.statisticoption,
+                allowMultiple=True,
+                defaultValue=[0, 3, 4, 5, 6]
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                self.OUTPUT_TABLE,
+                self.tr('Output zone table'),
+                self.tr('CSV files (*.csv);;Parquet files (*.parquet)'),
+                optional=True
+            )
+        )
+
+        for output, description in ((self.OUTPUT_COUNT, 'Output area count layer'),
+                                    (self.OUTPUT_AREA, 'Output area area layer'),
+                                    (self.OUTPUT_TOTAL, 'Output area total layer'),
+                                    (self.OUTPUT_AVERAGE, 'Output area average layer'),
+                                    (self.OUTPUT_MINIMUM, 'Output area minimum layer'),
+                                    (self.OUTPUT_MAXIMUM, 'Output area maximum layer'),
+                                    (self.OUTPUT_STDDEV, 'Output area standard deviation layer'),
+                                    (self.OUTPUT_MAJORITY, 'Output area majority layer'),
+                                    (self.OUTPUT_DIVERSITY, 'Output area diversity layer')):
+            self.addParameter(
+                QgsProcessingParameterRasterDestination(
+                    output,
+                    self.tr(description),
+                    optional=True,
+                    createByDefault=False
+                )
+            )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+
+        input_discrete = self.parameterAsRasterLayer(parameters, self.INPUT_DISCRETE, context)
+        input_scalar = self.parameterAsRasterLayer(parameters, self.INPUT_SCALAR, context)
+        statistics = [STATISTICS[i][0] for i in sorted(self.parameterAsEnums(parameters, self.INPUT_STATISTICS, context))]
+        if not statistics:
+            raise QgsProcessingException('Select at least one statistic')
+
+        class_ds = open_raster(input_discrete.dataProvider().dataSourceUri())
+        value_ds = open_raster(input_scalar.dataProvider().dataSourceUri())
+        check_same_grid(class_ds, value_ds)
+
+        outputs = {
+            'count': self.OUTPUT_COUNT, 'area': self.OUTPUT_AREA, 'total': self.OUTPUT_TOTAL,
+            'average': self.OUTPUT_AVERAGE, 'minimum': self.OUTPUT_MINIMUM, 'maximum': self.OUTPUT_MAXIMUM,
+            'stddev': self.OUTPUT_STDDEV, 'majority': self.OUTPUT_MAJORITY, 'diversity': self.OUTPUT_DIVERSITY}
+        output_rasters = {}
+        for statistic, scale in STATISTICS:
+            outputFilePath = self.parameterAsOutputLayer(parameters, outputs[statistic], context)
+            if outputFilePath:
+                output_rasters[statistic] = (outputFilePath, scale or value_scale(value_ds))
+        requested = set(statistics) | set(output_rasters)
+        if requested & {'majority', 'diversity'} and value_scale(value_ds) in ('VS_SCALAR', 'VS_DIRECTION'):
+            raise QgsProcessingException('Majority and diversity need a boolean, nominal or ordinal value raster')
+
+        with Profile(self.name(), feedback) as profile:
+            profile.raster(class_ds)
+            windows = row_windows(class_ds)
+            with profile.phase('statistics'):
+                zone_statistics = ZoneStatistics(histogram='majority' in requested or 'diversity' in requested)
+                for i, (yoff, ysize) in enumerate(windows):
+                    if feedback.isCanceled():
+                        return {}
+                    classes, class_valid = read_rows(class_ds, yoff, ysize)
+                    values, value_valid = read_rows(value_ds, yoff, ysize)
+                    zone_statistics.update(classes, class_valid, values, value_valid)
+                    feedback.setProgress(50 * (i + 1) / len(windows))
+
+            zones = zone_statistics.zones
+            if len(zones) == 0:
+                raise QgsProcessingException('The class raster has no defined cells')
+            feedback.pushInfo('Total classes: {}'.format(len(zones)))
+            area = cell_area(class_ds)
+            tables = dict((statistic, zone_statistics.result(statistic, area)) for statistic in requested)
+
+            results = {}
+            output_table = self.parameterAsFileOutput(parameters, self.OUTPUT_TABLE, context)
+            if output_table:
+                with profile.phase('write table'):
+                    self.writeTable(output_table, zones, statistics, tables)
+                results[self.OUTPUT_TABLE] = output_table
+
+            # Broadcast the per-class statistics back to the cells of each class
+            with profile.phase('write'):
+                writers = dict((statistic, RasterWriter(path, class_ds, scale))
+                               for statistic, (path, scale) in output_rasters.items())
+                for i, (yoff, ysize) in enumerate(windows if writers else []):
+                    if feedback.isCanceled():
+                        return {}
+                    classes, class_valid = read_rows(class_ds, yoff, ysize)
+                    index = np.searchsorted(zones, classes.astype(np.int64))
+                    index[~class_valid] = 0
+                    for statistic, writer in writers.items():
+                        values = tables[statistic][index]
+                        writer.write(values, class_valid & ~np.isnan(values), yoff)
+                    feedback.setProgress(50 + 50 * (i + 1) / len(windows))
+
+                for statistic, writer in writers.items():
+                    results[outputs[statistic]] = writer.close()
+
+            return results
+
+    def writeTable(self, path, zones, statistics, tables):
+        """
+        Writes the per-class statistics to a CSV or Parquet file.
+        """
+        if path.lower().endswith('.parquet'):
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                raise QgsProcessingException('Writing Parquet tables requires the pyarrow package')
+            columns = {'class': zones}
+            columns.update((statistic, tables[statistic]) for statistic in statistics)
+            pyarrow.parquet.write_table(pyarrow.table(columns), path)
+            return
+        with open(path, 'w', newline='') as csvfile:
+            csv_writer = csv.writer(csvfile)
+            csv_writer.writerow(['class'] + statistics)
+            for row, zone in enumerate(zones):
+                csv_writer.writerow([zone] + ['' if np.isnan(tables[s][row]) else tables[s][row] for s in statistics])
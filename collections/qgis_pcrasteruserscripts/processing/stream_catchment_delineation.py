@@ -5,22 +5,7 @@ Group : Hydrology
 With QGIS : 32809
 """
 
-from pcraster import (
-    readmap,
-    setclone,
-    lddcreate,
-    catchment,
-    streamorder,
-    areamaximum,
-    spreadmaxzone,
-    ifthen,
-    cover,
-    boolean,
-    accuflux,
-    ordinal,
-    scalar,
-    report
-)
+import numpy as np
 
 from qgis import processing
 from qgis.PyQt.QtCore import QCoreApplication
@@ -38,9 +23,66 @@ from qgis.core import (
     QgsProcessingParameterRasterDestination,
     QgsProcessingParameterCrs,
     QgsProcessingParameterString,
-    QgsProcessingParameterFile)
-
-import os, re, csv
+    QgsProcessingParameterFile,
+    QgsFeature,
+    QgsFeatureSink,
+    QgsField,
+    QgsFields,
+    QgsGeometry,
+    QgsLineString,
+    QgsWkbTypes,
+    QgsCoordinateReferenceSystem,
+    QgsProcessingUtils)
+from osgeo import gdal
+
+import os, sys, math
+
+# The shared helpers live next to this script in the scripts folder
+_SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+if _SCRIPT_FOLDER not in sys.path:
+    sys.path.append(_SCRIPT_FOLDER)
+
+from pcraster_blockio import open_raster, write_field
+from pcraster_ldd import StreamNetwork, snap_points
+from pcraster_polygonize import polygonize_array
+from pcraster_cache import DiskCache, default_cache_folder
+from pcraster_profiling import Profile
+
+# Downloaded DEMs are cached in tiles of this size in degrees
+TILE_DEGREES = 0.25
+
+
+def tile_indices(extent):
+    """
+    Returns the (column, row) indices of the cache tiles that cover an
+    extent in EPSG:4326.
+    """
+    return [(column, row)
+            for column in range(math.floor(extent.xMinimum() / TILE_DEGREES), math.ceil(extent.xMaximum() / TILE_DEGREES))
+            for row in range(math.floor(extent.yMinimum() / TILE_DEGREES), math.ceil(extent.yMaximum() / TILE_DEGREES))]
+
+
+def tile_groups(tiles):
+    """
+    Splits (column, row) tile indices into groups of tiles that touch by an
+    edge, so the bounding box of every group can be downloaded at once.
+    """
+    remaining = set(tiles)
+    groups = []
+    for tile in sorted(remaining):
+        if tile not in remaining:
+            continue
+        remaining.remove(tile)
+        stack, group = [tile], []
+        while stack:
+            column, row = stack.pop()
+            group.append((column, row))
+            for neighbour in ((column - 1, row), (column + 1, row), (column, row - 1), (column, row + 1)):
+                if neighbour in remaining:
+                    remaining.remove(neighbour)
+                    stack.append(neighbour)
+        groups.append(sorted(group))
+    return groups
 
 
 class StreamAndCatchmentDelineation(QgsProcessingAlgorithm):
@@ -57,6 +99,9 @@ class StreamAndCatchmentDelineation(QgsProcessingAlgorithm):
     OUTPUT_STREAMS = 'OUTPUT_STREAMS'
     OUTPUT_DEM = 'OUTPUT_DEM'
     OUTPUT_FLOWDIRECTION = 'OUTPUT_FLOWDIRECTION'
+    INPUT_RESOLUTION = 'INPUT_RESOLUTION'
+    INPUT_CACHE = 'INPUT_CACHE'
+    INPUT_CACHE_SIZE = 'INPUT_CACHE_SIZE'
 
     def initAlgorithm(self, config=None):
         self.addParameter(QgsProcessingParameterEnum(self.INPUT_DEM, 'Select DEM to download', 
@@ -70,6 +115,9 @@ class StreamAndCatchmentDelineation(QgsProcessingAlgorithm):
         self.addParameter(QgsProcessingParameterNumber(self.INPUT_THRESHOLD, 'Strahler order threshold', type=QgsProcessingParameterNumber.Integer, minValue=1, defaultValue=5))
         self.addParameter(QgsProcessingParameterNumber(self.INPUT_TOLERANCE, 'Snapping tolerance (map units)', type=QgsProcessingParameterNumber.Double, defaultValue=250))
         self.addParameter(QgsProcessingParameterCrs(self.INPUT_CRS, 'Output CRS', defaultValue='EPSG:3857'))
+        self.addParameter(QgsProcessingParameterNumber(self.INPUT_RESOLUTION, 'Output resolution (map units)', type=QgsProcessingParameterNumber.Double, minValue=0, defaultValue=30))
+        self.addParameter(QgsProcessingParameterFile(self.INPUT_CACHE, 'DEM tile cache folder', behavior=QgsProcessingParameterFile.Folder, optional=True, defaultValue=None))
+        self.addParameter(QgsProcessingParameterNumber(self.INPUT_CACHE_SIZE, 'DEM tile cache size (MB)', type=QgsProcessingParameterNumber.Integer, minValue=0, defaultValue=2048))
         self.addParameter(QgsProcessingParameterFeatureSink(self.OUTPUT_CATCHMENT, 'Output catchment polygon', type=QgsProcessing.TypeVectorAnyGeometry, createByDefault=True, defaultValue=None))
         self.addParameter(QgsProcessingParameterFeatureSink(self.OUTPUT_STREAMS, 'Output streams', type=QgsProcessing.TypeVectorAnyGeometry, createByDefault=True, supportsAppend=True, defaultValue=None))
         self.addParameter(QgsProcessingParameterRasterDestination(self.OUTPUT_DEM, 'Output DEM', createByDefault=True, defaultValue=None))
@@ -78,244 +126,245 @@ class StreamAndCatchmentDelineation(QgsProcessingAlgorithm):
 
 
     def processAlgorithm(self, parameters, context, model_feedback):
+        from pcraster import (
+            readmap,
+            setclone,
+            lddcreate,
+            catchment,
+            streamorder,
+            ifthen,
+            accuflux,
+            ordinal,
+            scalar,
+            pcr2numpy,
+            numpy2pcr,
+            Boolean,
+            report
+        )
+
         # Use a multi-step feedback, so that individual child algorithm progress reports are adjusted for the
         # overall progress through the model
-        feedback = QgsProcessingMultiStepFeedback(12, model_feedback)
-        results = {}
-        outputs = {}
+        feedback = QgsProcessingMultiStepFeedback(9, model_feedback)
+        with Profile(self.name(), feedback) as profile:
+            results = {}
+            outputs = {}
 
-        output_folder = self.parameterAsFile(parameters, self.OUTPUT_FOLDER, context)
-        
-        # Create PCRaster layer from point
-        input_string = self.parameterAsString(parameters, self.INPUT_OUTLET, context)
-        
-        # Regular expression pattern to extract x, y coordinates
-        pattern = r'([\d.]+),([\d.]+)'
+            output_folder = self.parameterAsFile(parameters, self.OUTPUT_FOLDER, context)
         
-        # Find coordinates using regex
-        match = re.search(pattern, input_string)
+            # Outlet point in the output CRS
+            outlet = self.parameterAsPoint(parameters, self.INPUT_OUTLET, context, self.parameterAsCrs(parameters, self.INPUT_CRS, context))
+
+            feedback.setCurrentStep(1)
+            if feedback.isCanceled():
+                return {}
+
+            # Download the DEM tiles that are not cached yet and reproject them
+            # to the output grid. Tiles are cached per dataset, and reprojected
+            # tiles per dataset, CRS and resolution, so a repeated run in the same
+            # region skips both the download and the warp. Missing tiles that
+            # touch are downloaded as one area and split into tiles afterwards,
+            # so a large study area takes few requests.
+            dem_option = self.parameterAsEnum(parameters, self.INPUT_DEM, context)
+            target_crs = self.parameterAsCrs(parameters, self.INPUT_CRS, context)
+            resolution = self.parameterAsDouble(parameters, self.INPUT_RESOLUTION, context)
+            cache = DiskCache(self.parameterAsFile(parameters, self.INPUT_CACHE, context) or default_cache_folder('dem'),
+                              self.parameterAsInt(parameters, self.INPUT_CACHE_SIZE, context) * 1024 * 1024)
+            tiles = tile_indices(self.parameterAsExtent(parameters, self.INPUT_EXTENT, context, QgsCoordinateReferenceSystem('EPSG:4326')))
+            with profile.phase('download'):
+                warped_tiles, raw_tiles, missing = {}, {}, []
+                for column, row in tiles:
+                    warped_tile = cache.get(('warped', dem_option, column, row, target_crs.toWkt(), resolution), '.tif')
+                    if warped_tile is not None:
+                        warped_tiles[column, row] = warped_tile
+                        continue
+                    tile = cache.get(('tile', dem_option, column, row), '.tif')
+                    if tile is None:
+                        missing.append((column, row))
+                    else:
+                        raw_tiles[column, row] = tile
+
+                for i, group in enumerate(tile_groups(missing)):
+                    columns, rows = zip(*group)
+                    feedback.pushInfo("Downloading DEM area {} with {} tiles...".format(i + 1, len(group)))
+                    alg_params = {
+                        'API_key': parameters[self.INPUT_KEY],
+                        'DEMs': parameters[self.INPUT_DEM],
+                        'Extent': '{},{},{},{} [EPSG:4326]'.format(min(columns) * TILE_DEGREES, (max(columns) + 1) * TILE_DEGREES,
+                                                                   min(rows) * TILE_DEGREES, (max(rows) + 1) * TILE_DEGREES),
+                        'OUTPUT': cache.temporary_path('.tif')
+                    }
+                    downloaded = processing.run('OTDEMDownloader:OpenTopography DEM Downloader', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+                    for column, row in group:
+                        tile_path = cache.temporary_path('.tif')
+                        gdal.Translate(tile_path, downloaded['OUTPUT'],
+                                       projWin=[column * TILE_DEGREES, (row + 1) * TILE_DEGREES,
+                                                (column + 1) * TILE_DEGREES, row * TILE_DEGREES],
+                                       creationOptions=['TILED=YES', 'COMPRESS=DEFLATE'])
+                        raw_tiles[column, row] = cache.put(('tile', dem_option, column, row), tile_path, '.tif',
+                                                           keep=list(warped_tiles.values()) + list(raw_tiles.values()))
+                    os.remove(downloaded['OUTPUT'])
+                    if feedback.isCanceled():
+                        return {}
+
+            with profile.phase('reproject'):
+                for i, (column, row) in enumerate(sorted(raw_tiles)):
+                    feedback.pushInfo("Reprojecting DEM tile {} of {}...".format(i + 1, len(raw_tiles)))
+                    warped_path = cache.temporary_path('.tif')
+                    gdal.Warp(warped_path, raw_tiles[column, row], dstSRS=target_crs.toWkt(), xRes=resolution, yRes=resolution,
+                              targetAlignedPixels=True, resampleAlg='near', dstNodata=-9999,
+                              multithread=True, warpOptions=['NUM_THREADS=ALL_CPUS'],
+                              creationOptions=['TILED=YES', 'COMPRESS=DEFLATE', 'NUM_THREADS=ALL_CPUS'])
+                    warped_tiles[column, row] = cache.put(('warped', dem_option, column, row, target_crs.toWkt(), resolution),
+                                                          warped_path, '.tif',
+                                                          keep=list(warped_tiles.values()) + list(raw_tiles.values()))
+                    if feedback.isCanceled():
+                        return {}
+
+            feedback.setCurrentStep(2)
+            if feedback.isCanceled():
+                return {}
+
+            # Mosaic the tiles and clip them to the study area on the output grid
+            extent = self.parameterAsExtent(parameters, self.INPUT_EXTENT, context, target_crs)
+            bounds = (math.floor(extent.xMinimum() / resolution) * resolution, math.floor(extent.yMinimum() / resolution) * resolution,
+                      math.ceil(extent.xMaximum() / resolution) * resolution, math.ceil(extent.yMaximum() / resolution) * resolution)
+            with profile.phase('mosaic'):
+                mosaic = QgsProcessingUtils.generateTempFilename('dem.vrt')
+                gdal.BuildVRT(mosaic, list(warped_tiles.values()), outputBounds=bounds, srcNodata=-9999, VRTNodata=-9999)
+
+            feedback.setCurrentStep(3)
+            if feedback.isCanceled():
+                return {}
+
+            # Convert DEM to PCRaster Format
+            feedback.pushInfo("Converting DEM to PCRaster format...")
+            alg_params = {
+                'INPUT': mosaic,
+                'INPUT2': 3,  # Scalar
+                'OUTPUT': parameters[self.OUTPUT_DEM]
+            }
+            with profile.phase('convert'):
+                outputs['ConvertDemToPcrasterFormat'] = processing.run('pcraster:converttopcrasterformat', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+
+            feedback.setCurrentStep(4)
+            if feedback.isCanceled():
+                return {}
+
+            # Calculate flow direction
+            feedback.pushInfo("Calculating flow direction...")
+            output_dem = self.parameterAsRasterLayer(parameters, self.OUTPUT_DEM, context)
+            dem_ds = open_raster(output_dem.dataProvider().dataSourceUri())
+            profile.raster(dem_ds)
+            with profile.phase('read'):
+                setclone(output_dem.dataProvider().dataSourceUri())
+                DEM = readmap(output_dem.dataProvider().dataSourceUri())
+            with profile.phase('lddcreate'):
+                FlowDirection = lddcreate(DEM,1e31,1e31,1e31,1e31)
+            output_ldd = self.parameterAsOutputLayer(parameters, self.OUTPUT_FLOWDIRECTION, context)
+            with profile.phase('write flow direction'):
+                write_field(FlowDirection, output_ldd, output_dem.dataProvider().dataSourceUri())
+
+            feedback.setCurrentStep(5)
+            if feedback.isCanceled():
+                return {}
+
+
+            # Calculate Strahler orders
+            feedback.pushInfo("Calculating Strahler orders...")
+            with profile.phase('streamorder'):
+                StrahlerOrders = streamorder(FlowDirection)
+
+            feedback.setCurrentStep(6)
+            if feedback.isCanceled():
+                return {}
+
+            # Select Strahler orders >= threshold
+            feedback.pushInfo("Deriving stream network raster...")
+            with profile.phase('stream network'):
+                input_threshold = self.parameterAsInt(parameters,self.INPUT_THRESHOLD,context)
+                river = ifthen(StrahlerOrders >= ordinal(input_threshold), StrahlerOrders)
+                riverstrahler = ordinal(scalar(river) - (scalar(input_threshold) - 1))
+                report(riverstrahler,os.path.join(output_folder,"river.map"))
+
+            # Snap the outlet to the cell with the largest upstream area within
+            # the tolerance, searching only the cells around the outlet
+            feedback.pushInfo("Snapping outlet to stream...")
+            geotransform = dem_ds.GetGeoTransform()
+            with profile.phase('snap outlet'):
+                Tolerance = self.parameterAsDouble(parameters,self.INPUT_TOLERANCE,context)
+                FlowAccum = pcr2numpy(accuflux(FlowDirection,1), np.nan)
+                rows, cols = snap_points(FlowAccum, ~np.isnan(FlowAccum),
+                                         [int((outlet.y() - geotransform[3]) // geotransform[5])],
+                                         [int((outlet.x() - geotransform[0]) // geotransform[1])],
+                                         Tolerance, abs(geotransform[1]), abs(geotransform[5]))
+                if rows[0] < 0:
+                    raise QgsProcessingException('The DEM has no cells within the snapping tolerance of the outlet')
+                outlet_cells = np.full(FlowAccum.shape, 255, dtype=np.uint8)
+                outlet_cells[rows[0], cols[0]] = 1
+                OutletSnapped = numpy2pcr(Boolean, outlet_cells, 255)
+                report(OutletSnapped,os.path.join(output_folder,"outletsnapped.map"))
         
-        if match:
-            x_coordinate = match.group(1)
-            y_coordinate = match.group(2)
-        
-            # Write coordinates to CSV file
-            with open('{}'.format(os.path.join(output_folder,"coordinates.csv")), 'w', newline='') as csvfile:
-                csv_writer = csv.writer(csvfile)
-                csv_writer.writerow([x_coordinate, y_coordinate, '1'])
-
-            feedback.pushInfo("Coordinates written to {}".format(os.path.join(output_folder,"coordinates.csv")))
-        else:
-            feedback.pushInfo("Coordinates not found in the input string.")
-
-        feedback.setCurrentStep(1)
-        if feedback.isCanceled():
-            return {}
-
-        # OpenTopography DEM Downloader
-        feedback.pushInfo("Downloading DEM...")
-        alg_params = {
-            'API_key': parameters[self.INPUT_KEY],
-            'DEMs': parameters[self.INPUT_DEM],
-            'Extent': parameters[self.INPUT_EXTENT],
-            'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-        }
-        outputs['OpentopographyDemDownloader'] = processing.run('OTDEMDownloader:OpenTopography DEM Downloader', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-        feedback.setCurrentStep(2)
-        if feedback.isCanceled():
-            return {}
-
-        # Warp (reproject)
-        feedback.pushInfo("Reprojecting DEM...")
-        alg_params = {
-            'DATA_TYPE': 0,  # Use Input Layer Data Type
-            'EXTRA': '',
-            'INPUT': outputs['OpentopographyDemDownloader']['OUTPUT'],
-            'MULTITHREADING': False,
-            'NODATA': -9999,
-            'OPTIONS': '',
-            'RESAMPLING': 0,  # Nearest Neighbour
-            'SOURCE_CRS': None,
-            'TARGET_CRS': parameters[self.INPUT_CRS],
-            'TARGET_EXTENT': None,
-            'TARGET_EXTENT_CRS': None,
-            'TARGET_RESOLUTION': 30,
-            'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-        }
-        outputs['WarpReproject'] = processing.run('gdal:warpreproject', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-        feedback.setCurrentStep(3)
-        if feedback.isCanceled():
-            return {}
-
-        # Convert DEM to PCRaster Format
-        feedback.pushInfo("Converting DEM to PCRaster format...")
-        alg_params = {
-            'INPUT': outputs['WarpReproject']['OUTPUT'],
-            'INPUT2': 3,  # Scalar
-            'OUTPUT': parameters[self.OUTPUT_DEM]
-        }
-        outputs['ConvertDemToPcrasterFormat'] = processing.run('pcraster:converttopcrasterformat', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-        feedback.setCurrentStep(4)
-        if feedback.isCanceled():
-            return {}
-
-        # Calculate flow direction
-        feedback.pushInfo("Calculating flow direction (this can take some time!)...")
-        output_dem = self.parameterAsRasterLayer(parameters, self.OUTPUT_DEM, context)
-        setclone(output_dem.dataProvider().dataSourceUri())
-        DEM = readmap(output_dem.dataProvider().dataSourceUri())
-        FlowDirection = lddcreate(DEM,1e31,1e31,1e31,1e31)
-        output_ldd = self.parameterAsOutputLayer(parameters, self.OUTPUT_FLOWDIRECTION, context)
-        report(FlowDirection,output_ldd)
-
-        feedback.setCurrentStep(5)
-        if feedback.isCanceled():
-            return {}
-
-
-        # Calculate Strahler orders
-        feedback.pushInfo("Calculating Strahler orders...")
-        StrahlerOrders = streamorder(FlowDirection)
-
-        feedback.setCurrentStep(6)
-        if feedback.isCanceled():
-            return {}
-
-        # Select Strahler orders >= threshold
-        feedback.pushInfo("Deriving stream network raster...")
-        input_threshold = self.parameterAsInt(parameters,self.INPUT_THRESHOLD,context)
-        river = ifthen(StrahlerOrders >= ordinal(input_threshold), StrahlerOrders)
-        riverstrahler = ordinal(scalar(river) - (scalar(input_threshold) - 1))
-        report(riverstrahler,os.path.join(output_folder,"river.map"))
-
-        # import outlet to PCRaster
-        feedback.pushInfo("Snapping outlet to stream...")
-        cmd = "col2map -B {} {} --clone {}".format(os.path.join(output_folder, "coordinates.csv"),os.path.join(output_folder, "outlet.map"),os.path.join(output_folder, "river.map"))
-        os.system(cmd)
-
-        OutletOrigin = readmap(os.path.join(output_folder,"outlet.map"))
-        Tolerance = self.parameterAsDouble(parameters,self.INPUT_TOLERANCE,context)
-        Outletbuffer = spreadmaxzone(OutletOrigin,0,1,Tolerance)
-        report(Outletbuffer,os.path.join(output_folder,"outletbuffer.map"))
-        FlowAccum = accuflux(FlowDirection,1)
-        LocalMax = areamaximum(FlowAccum,Outletbuffer)
-        OutletSnapped = ifthen(FlowAccum == LocalMax, boolean(1))
-        report(OutletSnapped,os.path.join(output_folder,"outletsnapped.map"))
-        
-        feedback.pushInfo("Delineating catchment raster...")
-        catchmentraster = catchment(FlowDirection,OutletSnapped)
-        report(catchmentraster,os.path.join(output_folder,"catchment.map"))
+            feedback.pushInfo("Delineating catchment raster...")
+            with profile.phase('catchment'):
+                catchmentraster = catchment(FlowDirection,OutletSnapped)
+                report(catchmentraster,os.path.join(output_folder,"catchment.map"))
         
 
-        feedback.setCurrentStep(7)
-        if feedback.isCanceled():
-            return {}
+            feedback.setCurrentStep(7)
+            if feedback.isCanceled():
+                return {}
 
-        results[self.OUTPUT_DEM] = outputs['ConvertDemToPcrasterFormat']['OUTPUT']
-        
-        # Thin river raster
-        feedback.pushInfo("Thinning the stream network raster...")
-        alg_params = {
-            'GRASS_RASTER_FORMAT_META': '',
-            'GRASS_RASTER_FORMAT_OPT': '',
-            'GRASS_REGION_CELLSIZE_PARAMETER': 0,
-            'GRASS_REGION_PARAMETER': None,
-            'input': os.path.join(output_folder,"river.map"),
-            'iterations': 200,
-            'output': QgsProcessing.TEMPORARY_OUTPUT
-        }
-        
-        outputs['ThinRiverRaster'] = processing.run('grass7:r.thin', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-        feedback.setCurrentStep(8)
-        if feedback.isCanceled():
-            return {}
-
-        # Convert river raster to line vector
-        feedback.pushInfo("Vectorizing the stream network...")
-        alg_params = {
-            '-b': False,
-            '-s': False,
-            '-t': False,
-            '-v': True,
-            '-z': False,
-            'GRASS_OUTPUT_TYPE_PARAMETER': 0,  # auto
-            'GRASS_REGION_CELLSIZE_PARAMETER': 0,
-            'GRASS_REGION_PARAMETER': None,
-            'GRASS_VECTOR_DSCO': '',
-            'GRASS_VECTOR_EXPORT_NOCAT': False,
-            'GRASS_VECTOR_LCO': '',
-            'column': 'value',
-            'input': outputs['ThinRiverRaster']['output'],
-            'type': 0,  # line
-            'output': QgsProcessing.TEMPORARY_OUTPUT
-        }
-        outputs['ConvertRiverRasterToLineVector'] = processing.run('grass7:r.to.vect', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-        feedback.setCurrentStep(9)
-        if feedback.isCanceled():
-            return {}
-
-        # Assign projection
-        alg_params = {
-            'CRS': parameters[self.INPUT_CRS],
-            'INPUT': outputs['ConvertRiverRasterToLineVector']['output'],
-            'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-        }
-        outputs['AssignProjection'] = processing.run('native:assignprojection', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-        feedback.setCurrentStep(10)
-        if feedback.isCanceled():
-            return {}
-
-        # Fix geometries
-        alg_params = {
-            'INPUT': outputs['AssignProjection']['OUTPUT'],
-            'METHOD': 1,  # Structure
-            'OUTPUT': parameters[self.OUTPUT_STREAMS]
-        }
-        outputs['FixGeometries'] = processing.run('native:fixgeometries', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-        results['OutputStreams'] = outputs['FixGeometries']['OUTPUT']
-
-        feedback.setCurrentStep(11)
-        if feedback.isCanceled():
-            return {}
-
-        # Polygonize catchment raster
-        feedback.pushInfo("Polygonizing the catchment boundary...")
-        alg_params = {
-            'BAND': 1,
-            'EIGHT_CONNECTEDNESS': False,
-            'EXTRA': '',
-            'FIELD': 'DN',
-            'INPUT': os.path.join(output_folder,"catchment.map"),
-            'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-        }
-        outputs['PolygonizeCatchmentRaster'] = processing.run('gdal:polygonize', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-
-        feedback.setCurrentStep(12)
-        if feedback.isCanceled():
-            return {}
-
-        # Extract by expression
-        alg_params = {
-            'EXPRESSION': '"DN" = 1',
-            'INPUT': outputs['PolygonizeCatchmentRaster']['OUTPUT'],
-            'OUTPUT': QgsProcessing.TEMPORARY_OUTPUT
-        }
-        outputs['ExtractByExpression'] = processing.run('native:extractbyexpression', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
+            results[self.OUTPUT_DEM] = outputs['ConvertDemToPcrasterFormat']['OUTPUT']
         
-        # Assign projection
-        alg_params = {
-            'CRS': parameters[self.INPUT_CRS],
-            'INPUT': outputs['ExtractByExpression']['OUTPUT'],
-            'OUTPUT':parameters[self.OUTPUT_CATCHMENT]
-        }
-        outputs['AssignProjection'] = processing.run('native:assignprojection', alg_params, context=context, feedback=feedback, is_child_algorithm=True)
-        results['OutputCatchmentPolygon'] = outputs['AssignProjection']['OUTPUT']
+            # Vectorize the stream network by walking the LDD, so every segment
+            # between confluences becomes one line with its attributes
+            feedback.pushInfo("Vectorizing the stream network...")
+            with profile.phase('vectorize streams'):
+                ldd = pcr2numpy(FlowDirection, 0)
+                orders = pcr2numpy(StrahlerOrders, 0)
+                network = StreamNetwork(ldd, ldd != 0, geotransform)
+                segments = network.segments(orders >= input_threshold, orders.ravel())
+                fields = QgsFields()
+                fields.append(QgsField('segment', QVariant.Int))
+                fields.append(QgsField('downstream', QVariant.Int))
+                fields.append(QgsField('strahler', QVariant.Int))
+                fields.append(QgsField('upstream_area', QVariant.Double))
+                fields.append(QgsField('length', QVariant.Double))
+                (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT_STREAMS, context, fields,
+                                                       QgsWkbTypes.LineString, self.parameterAsCrs(parameters, self.INPUT_CRS, context))
+                x, y = network.cell_centres(segments['vertices'])
+                start = segments['start']
+                for i in range(len(start) - 1):
+                    if start[i + 1] - start[i] < 2:
+                        continue
+                    feature = QgsFeature(fields)
+                    feature.setGeometry(QgsGeometry(QgsLineString(x[start[i]:start[i + 1]].tolist(), y[start[i]:start[i + 1]].tolist())))
+                    downstream_segment = int(segments['downstream'][i])
+                    feature.setAttributes([i + 1, downstream_segment + 1 if downstream_segment >= 0 else None,
+                                           int(segments['order'][i]), float(segments['upstream_area'][i]),
+                                           float(segments['length'][i])])
+                    sink.addFeature(feature, QgsFeatureSink.FastInsert)
+            results['OutputStreams'] = dest_id
+
+            feedback.setCurrentStep(8)
+            if feedback.isCanceled():
+                return {}
+
+            # Polygonize the catchment raster in row bands on all cores and
+            # write the polygon as soon as its last band is done
+            feedback.pushInfo("Polygonizing the catchment boundary...")
+            with profile.phase('polygonize catchment'):
+                catchment_cells = pcr2numpy(catchmentraster, 0)
+                fields = QgsFields()
+                fields.append(QgsField('DN', QVariant.Int))
+                (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT_CATCHMENT, context, fields,
+                                                       QgsWkbTypes.MultiPolygon, self.parameterAsCrs(parameters, self.INPUT_CRS, context))
+                for label, geometry in polygonize_array(catchment_cells, catchment_cells == 1, geotransform, feedback=feedback):
+                    feature = QgsFeature(fields)
+                    feature.setGeometry(geometry)
+                    feature.setAttributes([int(label)])
+                    sink.addFeature(feature, QgsFeatureSink.FastInsert)
+            results['OutputCatchmentPolygon'] = dest_id
         
         return results
 
@@ -351,6 +400,12 @@ class StreamAndCatchmentDelineation(QgsProcessingAlgorithm):
 <p>Search buffer for snapping to the drainage</p>
 <h3>Output CRS</h3>
 <p>Output projection. <b>Make sure you have set your project to the same projection!</b></p>
+<h3>Output resolution (map units)</h3>
+<p>Cell size of the reprojected DEM</p>
+<h3>DEM tile cache folder</h3>
+<p>Folder to keep downloaded and reprojected DEM tiles, so later runs in the same region do not download and reproject them again. By default a folder in the QGIS profile is used</p>
+<h3>DEM tile cache size (MB)</h3>
+<p>When the cache grows beyond this size, the least recently used tiles are removed</p>
 <h3>Output folder</h3>
 <p>Folder to store intermediate outputs</p>
 <br><p align="right">Algorithm author: Hans van der Kwast</p><p align="right">Help author: Hans van der Kwast</p><p align="right">Algorithm version: 1.0</p></body></html>"""
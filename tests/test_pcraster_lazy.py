@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+# The fused kernels of pcraster_lazy must give the same result with numexpr
+# as with the NumPy fallback. The helper modules import QGIS and GDAL, so
+# the tests are skipped where those are not installed.
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+pytest.importorskip('osgeo.gdal')
+pytest.importorskip('qgis.core')
+numexpr = pytest.importorskip('numexpr')
+
+USER_SCRIPTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            'collections', 'qgis_pcrasteruserscripts', 'processing')
+if USER_SCRIPTS not in sys.path:
+    sys.path.append(USER_SCRIPTS)
+
+import pcraster_lazy as lazy
+
+
+class Template:
+    """
+    Stands in for the clone dataset; the kernels only need its width.
+    """
+
+    RasterXSize = 3
+
+
+def evaluate(expression, monkeypatch, use_numexpr):
+    monkeypatch.setattr(lazy, 'numexpr', numexpr if use_numexpr else None)
+    return lazy.Kernel(expression, Template()).evaluate(0, 2)
+
+
+@pytest.mark.parametrize('use_numexpr', [True, False])
+def test_kernel_missing_values(monkeypatch, use_numexpr):
+    a = lazy.array(np.array([[1.0, 2.0, -9.0], [4.0, 0.0, 6.0]]), missing=-9.0)
+    b = lazy.array(np.array([[2.0, 0.0, 1.0], [1.0, 3.0, -9.0]]), missing=-9.0)
+    result = evaluate(lazy.cover(a / b, 0.5) + lazy.ifthen(a > 1, a), monkeypatch, use_numexpr)
+    expected = np.array([[np.nan, 0.5 + 2.0, np.nan], [4.0 + 4.0, np.nan, 0.5 + 6.0]])
+    np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize('use_numexpr', [True, False])
+def test_kernel_boolean_operators(monkeypatch, use_numexpr):
+    a = lazy.array(np.array([[1.0, 0.0, 1.0], [0.0, 1.0, -9.0]]), 'VS_BOOLEAN', missing=-9.0)
+    b = lazy.array(np.array([[1.0, 1.0, 0.0], [0.0, -9.0, 1.0]]), 'VS_BOOLEAN', missing=-9.0)
+    result = evaluate(lazy.ifthenelse(a & ~b, 10.0, lazy.max(a, b)), monkeypatch, use_numexpr)
+    expected = np.array([[1.0, 1.0, 10.0], [0.0, np.nan, np.nan]])
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_kernel_broadcasts_constants(monkeypatch):
+    result = evaluate(lazy.sqrt(lazy.local('{0}', 4.0)), monkeypatch, True)
+    np.testing.assert_array_equal(result, np.full((2, 3), 2.0))
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+# Running many Processing jobs headless in a pool of warm worker processes:
+#
+#     python tools/batch.py jobs.jsonl --workers 8 --output results.jsonl
+#     make-jobs | python tools/batch.py --workers 8 > results.jsonl
+#
+# Every input line is a job, a JSON object with an algorithm, its parameters
+# and an optional id:
+#
+#     {"id": "tile-17", "algorithm": "pcraster:accuflux", "parameters": {"INPUT": "ldd.map", ...}}
+#
+# Every worker starts QGIS, imports PCRaster and loads the PCRaster Tools
+# plugin and the user scripts once, and then runs jobs until the input ends,
+# so the start-up is paid per worker instead of per job. An algorithm is
+# looked up in the Processing registry, like native:buffer, or else by the
+# name of a script in the script folders, like script:hand or hand. Every
+# job writes one JSON line with its id, whether it succeeded, its results or
+# error, its time and the worker that ran it, in the order the jobs finish.
+# When a worker crashes the pool is started again and the jobs it was
+# running are tried once more, one at a time.
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+if TOOLS not in sys.path:
+    sys.path.append(TOOLS)
+
+from headless import PCRASTER_PLUGIN, USER_SCRIPTS
+
+# Jobs queued per worker, so a worker never waits for the next job
+JOBS_PER_WORKER = 2
+
+# Times a job may be running in a worker that crashes before it fails
+CRASHES = 2
+
+# State of a worker process, set by start_worker()
+_scripts = {}
+_verbose = False
+_start_error = None
+
+
+def start_worker(plugins, script_folders, verbose):
+    """
+    Initialises a worker process: starts QGIS, imports PCRaster and loads
+    the plugins and scripts. Anything written to the standard output is
+    sent to the standard error, which keeps the results on the standard
+    output of the main process clean. When QGIS cannot start, the error is
+    kept and every job of the worker fails with it.
+    """
+    global _scripts, _verbose, _start_error
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    _verbose = verbose
+    try:
+        from headless import load_plugins, load_scripts, start_qgis
+
+        start_qgis()
+        try:
+            import pcraster  # noqa: F401
+        except ImportError:
+            pass
+        load_plugins(plugins)
+        _scripts = load_scripts(script_folders)
+    except Exception as error:
+        _start_error = 'The worker could not start QGIS: {}'.format(error)
+
+
+def find_algorithm(algorithm_id):
+    """
+    Returns a new instance of an algorithm from the Processing registry or
+    the loaded scripts.
+    """
+    from qgis.core import QgsApplication
+    algorithm = QgsApplication.processingRegistry().createAlgorithmById(algorithm_id)
+    if algorithm is not None:
+        return algorithm
+    name = algorithm_id[len('script:'):] if algorithm_id.startswith('script:') else algorithm_id
+    if name in _scripts:
+        return _scripts[name].create()
+    raise ValueError('Unknown algorithm {}'.format(algorithm_id))
+
+
+def run_job(job):
+    """
+    Runs a job in a worker and returns its record.
+    """
+    from headless import run_algorithm
+
+    record = {'id': job['id'], 'algorithm': job['algorithm'], 'worker': os.getpid()}
+    start = time.perf_counter()
+    try:
+        if _start_error is not None:
+            raise RuntimeError(_start_error)
+        results = run_algorithm(find_algorithm(job['algorithm']), job['parameters'], _verbose)
+        # Layers and other QGIS objects cannot leave the worker
+        record.update(ok=True, results=json.loads(json.dumps(results, default=str)), error=None)
+    except Exception as error:
+        record.update(ok=False, results=None, error=str(error))
+    record['seconds'] = time.perf_counter() - start
+    return record
+
+
+def read_jobs(paths):
+    """
+    Yields (job, None) for every valid line of the job files, or of the
+    standard input for no files or -, and (None, record) with the error for
+    every line that is not a valid job.
+    """
+    count = 0
+    for path in paths or ['-']:
+        job_file = sys.stdin if path == '-' else open(path)
+        try:
+            for line in job_file:
+                if not line.strip():
+                    continue
+                count += 1
+                job = None
+                try:
+                    job = json.loads(line)
+                    if not isinstance(job, dict) or not isinstance(job.get('algorithm'), str):
+                        raise ValueError('a job needs an algorithm')
+                    parameters = job.get('parameters', {})
+                    if not isinstance(parameters, dict):
+                        raise ValueError('the parameters must be an object')
+                except ValueError as error:
+                    job_id = job.get('id', count) if isinstance(job, dict) else count
+                    yield None, {'id': job_id, 'algorithm': None, 'worker': None, 'ok': False, 'results': None,
+                                 'error': 'Invalid job: {}'.format(error), 'seconds': 0.0}
+                    continue
+                yield {'id': job.get('id', count), 'algorithm': job['algorithm'], 'parameters': parameters}, None
+        finally:
+            if job_file is not sys.stdin:
+                job_file.close()
+
+
+def run_jobs(jobs, workers, initargs, write):
+    """
+    Runs the (job, error) pairs of read_jobs() in a pool of workers and
+    calls write with every record. Returns the number of failed jobs.
+    """
+    context = multiprocessing.get_context('spawn')
+
+    def start_pool():
+        return ProcessPoolExecutor(workers, mp_context=context, initializer=start_worker, initargs=initargs)
+
+    pool = start_pool()
+    pending = {}
+    retries = deque()
+    exhausted = False
+    failed = 0
+    try:
+        while True:
+            if retries:
+                # A job that was running when a worker crashed runs alone, so
+                # it cannot take other jobs down with it a second time
+                if not pending:
+                    job, crashes = retries.popleft()
+                    pending[pool.submit(run_job, job)] = (job, crashes)
+            else:
+                while not exhausted and len(pending) < workers * JOBS_PER_WORKER:
+                    item = next(jobs, None)
+                    if item is None:
+                        exhausted = True
+                    elif item[0] is None:
+                        write(item[1])
+                        failed += 1
+                    else:
+                        pending[pool.submit(run_job, item[0])] = (item[0], 0)
+            if not pending:
+                return failed
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            broken = any(isinstance(future.exception(), BrokenProcessPool) for future in done)
+            if broken:
+                # Every job still in the pool fails with it, so wait for all of them
+                done, _ = wait(pending)
+            for future in done:
+                job, crashes = pending.pop(future)
+                if isinstance(future.exception(), BrokenProcessPool):
+                    if crashes + 1 < CRASHES:
+                        retries.append((job, crashes + 1))
+                        continue
+                    record = {'id': job['id'], 'algorithm': job['algorithm'], 'worker': None, 'ok': False,
+                              'results': None, 'error': 'A worker crashed running this job', 'seconds': None}
+                else:
+                    record = future.result()
+                write(record)
+                if not record['ok']:
+                    failed += 1
+            if broken:
+                print('A worker crashed, starting the pool again', file=sys.stderr)
+                pool.shutdown(wait=False)
+                pool = start_pool()
+    finally:
+        pool.shutdown(wait=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs Processing jobs from JSON lines in a pool of QGIS workers')
+    parser.add_argument('jobs', nargs='*', help='JSON lines files with jobs; the standard input by default')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='number of worker processes')
+    parser.add_argument('--output', help='JSON lines file for the results; the standard output by default')
+    parser.add_argument('--plugins', nargs='*', default=[PCRASTER_PLUGIN],
+                        help='Processing provider plugins to load, {} by default'.format(PCRASTER_PLUGIN))
+    parser.add_argument('--scripts', nargs='*', default=[USER_SCRIPTS],
+                        help='folders with script algorithms, the user scripts by default')
+    parser.add_argument('--verbose', action='store_true', help='print the log of the algorithms to stderr')
+    arguments = parser.parse_args()
+
+    output_file = open(arguments.output, 'w') if arguments.output else sys.stdout
+
+    def write(record):
+        output_file.write(json.dumps(record) + '\n')
+        output_file.flush()
+
+    start = time.perf_counter()
+    try:
+        failed = run_jobs(read_jobs(arguments.jobs), max(arguments.workers, 1),
+                          (arguments.plugins, arguments.scripts, arguments.verbose), write)
+    finally:
+        if output_file is not sys.stdout:
+            output_file.close()
+    print('Done in {:.1f} s, {} failed jobs'.format(time.perf_counter() - start, failed), file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
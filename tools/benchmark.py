@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+# Benchmarks of the PCRaster scripts on synthetic maps:
+#
+#     python tools/benchmark.py run --sizes 1000 5000 --repeat 3 --output results.jsonl
+#     python tools/benchmark.py compare before.jsonl after.jsonl
+#
+# run generates deterministic maps for every size in the data folder, or
+# reuses them, and runs every case in a fresh Python process, so the peak
+# memory of a run is its own. Every run appends one JSON line with its time,
+# throughput and peak memory to the output file. compare prints the median
+# time of every case and size in two result files and exits with status 1
+# when a case got slower by more than the tolerance.
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+if TOOLS not in sys.path:
+    sys.path.append(TOOLS)
+
+from headless import COLLECTIONS, ROOT, USER_SCRIPTS
+
+OPERATORS = os.path.join(COLLECTIONS, 'qgis_pcrasterscripts', 'processing')
+
+# Benchmark cases: the script and its parameters for the synthetic maps of
+# generate() and an output folder
+CASES = {
+    'lddcreate': (os.path.join(OPERATORS, 'pcraster_lddcreate_algorithm.py'),
+                  lambda data, out: {'INPUT': data['dem'], 'OUTPUT': os.path.join(out, 'ldd.map')}),
+    'accuflux': (os.path.join(OPERATORS, 'pcraster_accuflux_algorithm.py'),
+                 lambda data, out: {'INPUT': data['ldd'], 'INPUT2': data['friction'],
+                                    'OUTPUT': os.path.join(out, 'accuflux.map')}),
+    'spread': (os.path.join(OPERATORS, 'pcraster_spread_algorithm.py'),
+               lambda data, out: {'INPUT': data['sources'], 'INPUT2': data['friction'], 'INPUT3': data['friction'],
+                                  'OUTPUT': os.path.join(out, 'spread.map')}),
+    'windowaverage': (os.path.join(OPERATORS, 'pcraster_windowaverage_algorithm.py'),
+                      lambda data, out: {'INPUT': data['dem'], 'INPUT1': 1, 'INPUT2': 5,
+                                         'OUTPUT': os.path.join(out, 'windowaverage.map')}),
+    'windowmajority': (os.path.join(OPERATORS, 'pcraster_windowmajority_algorithm.py'),
+                       lambda data, out: {'INPUT': data['classes'], 'INPUT1': 1, 'INPUT2': 5,
+                                          'OUTPUT': os.path.join(out, 'windowmajority.map')}),
+    'vectorsubcatchments': (os.path.join(USER_SCRIPTS, 'pcraster_calculate_vector_subcatchments.py'),
+                            lambda data, out: {'INPUT': data['ldd'], 'THRESHOLD': 5, 'DEST_CRS': 'EPSG:3857',
+                                               'OUTPUT_RIVERS': os.path.join(out, 'rivers.map'),
+                                               'OUTPUT_JUNCTIONS': os.path.join(out, 'junctions.map'),
+                                               'OUTPUT_OUTLETS': os.path.join(out, 'outlets.map'),
+                                               'OUTPUT': os.path.join(out, 'subcatchments.gpkg')}),
+}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', '-C', ROOT, 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_case(case, data_folder):
+    """
+    Runs one case in this process and returns its record. Called in a fresh
+    process by run().
+    """
+    sys.path.append(USER_SCRIPTS)
+    from headless import run_algorithm, script_algorithm, start_qgis
+    from pcraster_profiling import peak_rss
+
+    start_qgis()
+    with open(os.path.join(data_folder, 'manifest.json')) as manifest_file:
+        manifest = json.load(manifest_file)
+    data = {name: os.path.join(data_folder, name + '.map') for name in ('dem', 'ldd', 'classes', 'friction', 'sources')}
+    path, parameters = CASES[case]
+    algorithm = script_algorithm(path)
+    record = {'case': case, 'script': os.path.relpath(path, ROOT), 'size': manifest['size'],
+              'cells': manifest['size'] ** 2, 'baseline_rss': peak_rss()}
+    with tempfile.TemporaryDirectory() as out:
+        start = time.perf_counter()
+        try:
+            run_algorithm(algorithm, parameters(data, out))
+            record['ok'], record['error'] = True, None
+        except Exception as error:
+            record['ok'], record['error'] = False, str(error)
+        record['seconds'] = time.perf_counter() - start
+    record['cells_per_second'] = record['cells'] / record['seconds'] if record['ok'] else None
+    record['peak_rss'] = peak_rss()
+
+    try:
+        from qgis.core import Qgis
+        record['qgis'] = Qgis.version()
+    except ImportError:
+        pass
+    try:
+        import pcraster
+        record['pcraster'] = getattr(pcraster, '__version__', None)
+    except ImportError:
+        pass
+    return record
+
+
+def run(arguments):
+    from synthetic import generate
+
+    cases = arguments.cases or sorted(CASES)
+    unknown = set(cases) - set(CASES)
+    if unknown:
+        sys.exit('Unknown cases: {}'.format(', '.join(sorted(unknown))))
+    common = {'time': datetime.datetime.now(datetime.timezone.utc).isoformat(), 'commit': git_commit(),
+              'host': platform.node(), 'platform': platform.platform(), 'python': platform.python_version(),
+              'label': arguments.label}
+    for size in arguments.sizes:
+        folder = os.path.join(arguments.data, str(size))
+        print('Generating {0} x {0} cells in {1}'.format(size, folder), file=sys.stderr)
+        generate(folder, size, seed=arguments.seed)
+        for case in cases:
+            for repeat in range(arguments.repeat):
+                worker = subprocess.run([sys.executable, os.path.abspath(__file__), 'case', case, folder],
+                                        stdout=subprocess.PIPE, universal_newlines=True)
+                if worker.returncode != 0 or not worker.stdout.strip():
+                    record = {'case': case, 'size': size, 'ok': False,
+                              'error': 'worker exited with status {}'.format(worker.returncode)}
+                else:
+                    record = json.loads(worker.stdout.strip().splitlines()[-1])
+                record.update(common, repeat=repeat)
+                print('{case} {size}: {result}'.format(
+                    case=case, size=size,
+                    result='{:.2f} s'.format(record['seconds']) if record['ok'] else record['error']),
+                    file=sys.stderr)
+                with open(arguments.output, 'a') as output_file:
+                    output_file.write(json.dumps(record) + '\n')
+
+
+def medians(path):
+    """
+    Returns the median time in seconds per (case, size) of the successful
+    runs in a result file.
+    """
+    times = {}
+    with open(path) as result_file:
+        for line in result_file:
+            if line.strip():
+                record = json.loads(line)
+                if record.get('ok'):
+                    times.setdefault((record['case'], record['size']), []).append(record['seconds'])
+    return {key: statistics.median(values) for key, values in times.items()}
+
+
+def compare(arguments):
+    before, after = medians(arguments.before), medians(arguments.after)
+    slower = False
+    print('{:<22}{:>8}{:>12}{:>12}{:>9}'.format('case', 'size', 'before (s)', 'after (s)', 'ratio'))
+    for key in sorted(set(before) | set(after)):
+        if key not in before or key not in after:
+            print('{:<22}{:>8}{:>12}{:>12}'.format(key[0], key[1], *(
+                '{:.2f}'.format(times[key]) if key in times else '-' for times in (before, after))))
+            continue
+        ratio = after[key] / before[key]
+        flag = ''
+        if ratio > 1 + arguments.tolerance:
+            flag, slower = '  slower', True
+        print('{:<22}{:>8}{:>12.2f}{:>12.2f}{:>9.2f}{}'.format(key[0], key[1], before[key], after[key], ratio, flag))
+    sys.exit(1 if slower else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of the PCRaster scripts on synthetic maps')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    run_parser = commands.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 2000, 5000],
+                            help='number of rows and columns of the maps, up to 20000')
+    run_parser.add_argument('--cases', nargs='+', help='cases to run: {}'.format(', '.join(sorted(CASES))))
+    run_parser.add_argument('--repeat', type=int, default=3, help='runs per case and size')
+    run_parser.add_argument('--seed', type=int, default=None, help='seed of the synthetic maps')
+    run_parser.add_argument('--data', default=os.path.join(tempfile.gettempdir(), 'pcraster-benchmark'),
+                            help='folder for the synthetic maps, reused between runs')
+    run_parser.add_argument('--output', default='benchmark.jsonl', help='JSON lines file the results are appended to')
+    run_parser.add_argument('--label', help='label stored with the results, like a QGIS or PCRaster version')
+    run_parser.set_defaults(function=run)
+
+    compare_parser = commands.add_parser('compare', help='compare two result files')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.add_argument('--tolerance', type=float, default=0.1,
+                                help='fraction by which a case may get slower, 0.1 by default')
+    compare_parser.set_defaults(function=compare)
+
+    case_parser = commands.add_parser('case', help=argparse.SUPPRESS)
+    case_parser.add_argument('case')
+    case_parser.add_argument('data')
+    case_parser.set_defaults(function=lambda arguments: print(json.dumps(run_case(arguments.case, arguments.data))))
+
+    arguments = parser.parse_args()
+    if getattr(arguments, 'seed', 0) is None:
+        from synthetic import DEFAULT_SEED
+        arguments.seed = DEFAULT_SEED
+    arguments.function(arguments)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+# Running the scripts of the collections without the QGIS GUI. QGIS is
+# started once per process without a display, after which any script file
+# can be loaded as an algorithm and run with a dictionary of parameters.
+# Processing provider plugins, like PCRaster Tools, can be loaded from the
+# plugin folder of the QGIS profile.
+
+import glob
+import importlib
+import importlib.util
+import inspect
+import os
+import sys
+
+# Root of the repository and the folders with the script collections
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COLLECTIONS = os.path.join(ROOT, 'collections')
+USER_SCRIPTS = os.path.join(COLLECTIONS, 'qgis_pcrasteruserscripts', 'processing')
+
+# Plugin with the pcraster:* algorithms
+PCRASTER_PLUGIN = 'pcraster_tools'
+
+_application = None
+
+
+def start_qgis():
+    """
+    Starts QGIS without a display and initialises Processing with the
+    native algorithms, once per process. Returns the QgsApplication.
+    """
+    global _application
+    if _application is not None:
+        return _application
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from qgis.core import QgsApplication
+    _application = QgsApplication([], False)
+    _application.initQgis()
+
+    plugins = os.path.join(QgsApplication.pkgDataPath(), 'python', 'plugins')
+    if plugins not in sys.path:
+        sys.path.append(plugins)
+    from processing.core.Processing import Processing
+    Processing.initialize()
+    from qgis.analysis import QgsNativeAlgorithms
+    if QgsApplication.processingRegistry().providerById('native') is None:
+        QgsApplication.processingRegistry().addProvider(QgsNativeAlgorithms())
+    return _application
+
+
+def script_algorithm(path):
+    """
+    Returns an initialised instance of the algorithm in a script file.
+    """
+    from qgis.core import QgsProcessingAlgorithm
+    name = 'headless_' + os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    for _, value in inspect.getmembers(module, inspect.isclass):
+        if issubclass(value, QgsProcessingAlgorithm) and value.__module__ == name:
+            return value().create()
+    raise ValueError('{} contains no Processing algorithm'.format(path))
+
+
+def load_plugins(names):
+    """
+    Loads Processing provider plugins from the plugin folder of the QGIS
+    profile without a GUI and returns the names of the plugins that could
+    not be loaded. A plugin is created with no interface and only its
+    initProcessing() is called.
+    """
+    from qgis.core import QgsApplication
+    plugins = os.path.join(QgsApplication.qgisSettingsDirPath(), 'python', 'plugins')
+    if plugins not in sys.path:
+        sys.path.append(plugins)
+    failed = []
+    for name in names:
+        try:
+            plugin = importlib.import_module(name).classFactory(None)
+            plugin.initProcessing()
+        except Exception as error:
+            print('Could not load the plugin {}: {}'.format(name, error), file=sys.stderr)
+            failed.append(name)
+    return failed
+
+
+def load_scripts(folders):
+    """
+    Returns the algorithms of the script files in folders by name, skipping
+    helper modules without an algorithm and scripts that fail to import.
+    """
+    algorithms = {}
+    for folder in folders:
+        for path in sorted(glob.glob(os.path.join(folder, '*.py'))):
+            try:
+                algorithm = script_algorithm(path)
+            except ValueError:
+                continue
+            except Exception as error:
+                print('Could not load {}: {}'.format(path, error), file=sys.stderr)
+                continue
+            algorithms[algorithm.name()] = algorithm
+    return algorithms
+
+
+class PrintFeedback:
+    """
+    Mixin for QgsProcessingFeedback that prints the log to stderr.
+    """
+
+    def pushInfo(self, info):
+        print(info, file=sys.stderr)
+
+    def reportError(self, error, fatalError=False):
+        print('ERROR: ' + error, file=sys.stderr)
+
+
+def run_algorithm(algorithm, parameters, verbose=False):
+    """
+    Runs an algorithm with a new context and returns its results. Raises a
+    RuntimeError when the parameters are not valid or the algorithm fails.
+    """
+    from qgis.core import QgsProcessingContext, QgsProcessingFeedback
+
+    feedback_class = type('Feedback', (PrintFeedback, QgsProcessingFeedback), {}) if verbose else QgsProcessingFeedback
+    feedback = feedback_class()
+    context = QgsProcessingContext()
+    ok, message = algorithm.checkParameterValues(parameters, context)
+    if not ok:
+        raise RuntimeError('{}: {}'.format(algorithm.name(), message))
+    results, ok = algorithm.run(parameters, context, feedback)
+    if not ok:
+        raise RuntimeError('{} failed'.format(algorithm.name()))
+    return results
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+# What the script collections add to the start-up of QGIS:
+#
+#     python tools/startup.py
+#     python tools/startup.py --output startup.json
+#
+# Every script folder is loaded in a fresh process after QGIS started, the
+# way the Processing script provider loads it: every file is executed and
+# its algorithm is created with its parameters. The time of every file and
+# the packages it imported are reported. Loading a collection must not
+# import PCRaster or SciPy, which the scripts only import when they run, so
+# the command exits with status 1 when it does.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+if TOOLS not in sys.path:
+    sys.path.append(TOOLS)
+
+from headless import COLLECTIONS, ROOT, USER_SCRIPTS
+
+OPERATORS = os.path.join(COLLECTIONS, 'qgis_pcrasterscripts', 'processing')
+
+# Packages that must not be imported to register the algorithms
+FORBIDDEN = ('pcraster', 'scipy')
+
+# Files listed per folder in the report
+SLOWEST = 10
+
+# Only the packages outside the standard library are reported (Python 3.10+)
+STANDARD_LIBRARY = frozenset(getattr(sys, 'stdlib_module_names', ()))
+
+
+def measure(folder):
+    """
+    Loads every script in a folder in this process and returns the start-up
+    record of the folder. Called in a fresh process by main().
+    """
+    from headless import script_algorithm, start_qgis
+
+    start = time.perf_counter()
+    start_qgis()
+    record = {'folder': os.path.relpath(folder, ROOT), 'qgis_seconds': time.perf_counter() - start, 'scripts': []}
+    sys.path.append(folder)
+    own_modules = {os.path.splitext(name)[0] for name in os.listdir(folder)}
+    for name in sorted(os.listdir(folder)):
+        if not name.endswith('.py'):
+            continue
+        before = set(sys.modules)
+        start = time.perf_counter()
+        script = {'file': name, 'algorithm': None, 'error': None}
+        try:
+            algorithm = script_algorithm(os.path.join(folder, name))
+            script['algorithm'] = {'name': algorithm.name(), 'displayName': algorithm.displayName(),
+                                   'group': algorithm.group(),
+                                   'parameters': [parameter.name() for parameter in algorithm.parameterDefinitions()]}
+        except ValueError:
+            pass
+        except Exception as error:
+            script['error'] = str(error)
+        script['seconds'] = time.perf_counter() - start
+        packages = {module.split('.')[0] for module in set(sys.modules) - before}
+        script['imports'] = sorted(package for package in packages
+                                   if package not in own_modules and package not in STANDARD_LIBRARY and
+                                   not package.startswith(('headless_', '_')))
+        record['scripts'].append(script)
+    record['seconds'] = sum(script['seconds'] for script in record['scripts'])
+    return record
+
+
+def report(record):
+    scripts = record['scripts']
+    algorithms = sum(1 for script in scripts if script['algorithm'] is not None)
+    print('{}: {} files, {} algorithms, {:.2f} s (QGIS itself {:.2f} s)'.format(
+        record['folder'], len(scripts), algorithms, record['seconds'], record['qgis_seconds']))
+    for script in sorted(scripts, key=lambda script: -script['seconds'])[:SLOWEST]:
+        print('    {:<52}{:>8.3f} s  {}'.format(script['file'], script['seconds'], ' '.join(script['imports'])))
+    for script in scripts:
+        if script['error']:
+            print('    {} failed to load: {}'.format(script['file'], script['error']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Start-up time of the script collections')
+    parser.add_argument('folders', nargs='*', default=[USER_SCRIPTS, OPERATORS],
+                        help='script folders, the user scripts and the PCRaster operator scripts by default')
+    parser.add_argument('--output', help='JSON file for the records, with the metadata of every algorithm')
+    parser.add_argument('--measure', help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.measure:
+        print(json.dumps(measure(arguments.measure)))
+        return
+
+    records = []
+    for folder in arguments.folders:
+        worker = subprocess.run([sys.executable, os.path.abspath(__file__), '--measure', os.path.abspath(folder)],
+                                stdout=subprocess.PIPE, universal_newlines=True)
+        if worker.returncode != 0 or not worker.stdout.strip():
+            sys.exit('Measuring {} failed with status {}'.format(folder, worker.returncode))
+        record = json.loads(worker.stdout.strip().splitlines()[-1])
+        report(record)
+        records.append(record)
+    if arguments.output:
+        with open(arguments.output, 'w') as output_file:
+            json.dump(records, output_file, indent=2)
+
+    offenders = [(record['folder'], script['file'], package) for record in records for script in record['scripts']
+                 for package in script['imports'] if package in FORBIDDEN]
+    for folder, name, package in offenders:
+        print('{}/{} imports {} when it is loaded'.format(folder, name, package), file=sys.stderr)
+    sys.exit(1 if offenders else 0)
+
+
+if __name__ == '__main__':
+    main()
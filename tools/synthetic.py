@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+"""
+
+# Deterministic synthetic PCRaster maps for benchmarks: a DEM, an LDD, a
+# class map, a friction map and a map of source points of any size. The
+# maps only depend on the seed and the size, not on the machine or the
+# band size they are written in, and are written in row bands, so sizes of
+# 20000 x 20000 cells do not need the whole map in memory.
+
+import json
+import os
+
+import numpy as np
+from osgeo import gdal
+
+gdal.UseExceptions()
+
+# Bump when the maps change, so cached data sets are generated again
+GENERATOR_VERSION = 1
+
+DEFAULT_SEED = 20240601
+
+# Spacing in cells of the coarsest noise lattice; every octave halves it
+NOISE_SPACING = 256
+NOISE_OCTAVES = 4
+
+# Rows per band when writing
+BAND_ROWS = 512
+
+DATA_TYPES = {
+    'VS_LDD': (gdal.GDT_Byte, 255),
+    'VS_NOMINAL': (gdal.GDT_Int32, -2147483648),
+    'VS_SCALAR': (gdal.GDT_Float32, -3.4028234663852886e+38),
+}
+
+
+class Noise:
+    """
+    Smooth value noise: octaves of seeded random lattices interpolated
+    bilinearly, with values between -1 and 1.
+    """
+
+    def __init__(self, rows, cols, seed):
+        rng = np.random.default_rng(seed)
+        self.octaves = []
+        for octave in range(NOISE_OCTAVES):
+            spacing = max(NOISE_SPACING >> octave, 2)
+            lattice = rng.uniform(-1, 1, (rows // spacing + 2, cols // spacing + 2))
+            self.octaves.append((spacing, lattice, 0.5 ** octave))
+        self.scale = sum(weight for _, _, weight in self.octaves)
+
+    def band(self, yoff, ysize, cols):
+        values = np.zeros((ysize, cols))
+        for spacing, lattice, weight in self.octaves:
+            y = np.arange(yoff, yoff + ysize) / spacing
+            x = np.arange(cols) / spacing
+            i, j = y.astype(np.int64), x.astype(np.int64)
+            t, u = (y - i)[:, None], (x - j)[None, :]
+            top = lattice[i][:, j] * (1 - u) + lattice[i][:, j + 1] * u
+            bottom = lattice[i + 1][:, j] * (1 - u) + lattice[i + 1][:, j + 1] * u
+            values += weight * (top * (1 - t) + bottom * t)
+        return values / self.scale
+
+
+def dem_band(noise, yoff, ysize, rows, cols, cell_size):
+    """
+    Elevation sloping down towards the last row with hills of a few hundred
+    cells on top.
+    """
+    slope = (rows - np.arange(yoff, yoff + ysize, dtype=np.float64))[:, None] * cell_size * 0.01
+    return slope + 50.0 * noise.band(yoff, ysize, cols)
+
+
+def ldd_band(yoff, ysize, rows, cols, seed):
+    """
+    Flow directions that drain every cell to the south-west, south or
+    south-east neighbour, picked per cell from a generator seeded with the
+    row, so the paths merge into trees. The last row holds the pits.
+    """
+    ldd = np.empty((ysize, cols), dtype=np.uint8)
+    for k, row in enumerate(range(yoff, yoff + ysize)):
+        if row == rows - 1:
+            ldd[k] = 5
+            continue
+        directions = np.random.default_rng([seed, row]).integers(1, 4, cols).astype(np.uint8)
+        if directions[0] == 1:
+            directions[0] = 2
+        if directions[-1] == 3:
+            directions[-1] = 2
+        ldd[k] = directions
+    return ldd
+
+
+def write_map(path, rows, cols, cell_size, valuescale, band):
+    """
+    Writes a PCRaster map from band(yoff, ysize) in row bands, through a
+    temporary GeoTIFF because the PCRaster driver can only copy.
+    """
+    datatype, nodata = DATA_TYPES[valuescale]
+    temporary_path = path + '.tif'
+    ds = gdal.GetDriverByName('GTiff').Create(temporary_path, cols, rows, 1, datatype,
+                                              ['TILED=YES', 'BIGTIFF=IF_SAFER'])
+    ds.SetGeoTransform((0.0, cell_size, 0.0, rows * cell_size, 0.0, -cell_size))
+    output_band = ds.GetRasterBand(1)
+    output_band.SetNoDataValue(nodata)
+    for yoff in range(0, rows, BAND_ROWS):
+        ysize = min(BAND_ROWS, rows - yoff)
+        output_band.WriteArray(band(yoff, ysize), 0, yoff)
+    output_band = None
+    gdal.GetDriverByName('PCRaster').CreateCopy(path, ds, options=['PCRASTER_VALUESCALE={}'.format(valuescale)])
+    ds = None
+    gdal.GetDriverByName('GTiff').Delete(temporary_path)
+
+
+def generate(folder, size, seed=DEFAULT_SEED, cell_size=30.0, classes=8, sources=16):
+    """
+    Writes the synthetic maps of size x size cells to a folder, unless the
+    folder already holds the same data set, and returns their paths by name:
+    dem, ldd, classes, friction and sources.
+    """
+    rows = cols = int(size)
+    paths = {name: os.path.join(folder, name + '.map') for name in ('dem', 'ldd', 'classes', 'friction', 'sources')}
+    manifest = {'version': GENERATOR_VERSION, 'size': rows, 'seed': seed, 'cell_size': cell_size,
+                'classes': classes, 'sources': sources}
+    manifest_path = os.path.join(folder, 'manifest.json')
+    if os.path.exists(manifest_path) and all(os.path.exists(path) for path in paths.values()):
+        with open(manifest_path) as manifest_file:
+            if json.load(manifest_file) == manifest:
+                return paths
+    os.makedirs(folder, exist_ok=True)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    terrain = Noise(rows, cols, seed)
+    write_map(paths['dem'], rows, cols, cell_size, 'VS_SCALAR',
+              lambda yoff, ysize: dem_band(terrain, yoff, ysize, rows, cols, cell_size))
+    write_map(paths['ldd'], rows, cols, cell_size, 'VS_LDD',
+              lambda yoff, ysize: ldd_band(yoff, ysize, rows, cols, seed))
+
+    zones = Noise(rows, cols, seed + 1)
+    write_map(paths['classes'], rows, cols, cell_size, 'VS_NOMINAL',
+              lambda yoff, ysize: np.clip(((zones.band(yoff, ysize, cols) + 1) / 2 * classes).astype(np.int32),
+                                          0, classes - 1) + 1)
+    roughness = Noise(rows, cols, seed + 2)
+    write_map(paths['friction'], rows, cols, cell_size, 'VS_SCALAR',
+              lambda yoff, ysize: 1.0 + 0.5 * roughness.band(yoff, ysize, cols))
+
+    rng = np.random.default_rng(seed + 3)
+    source_cells = rng.choice(rows * cols, min(sources, rows * cols), replace=False)
+
+    def source_band(yoff, ysize):
+        band = np.zeros((ysize, cols), dtype=np.int32)
+        inside = (source_cells >= yoff * cols) & (source_cells < (yoff + ysize) * cols)
+        band.flat[source_cells[inside] - yoff * cols] = np.arange(1, len(source_cells) + 1)[inside]
+        return band
+
+    write_map(paths['sources'], rows, cols, cell_size, 'VS_NOMINAL', source_band)
+
+    with open(manifest_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+    return paths